@@ -54,6 +54,7 @@ INTERNAL_IPS = [
 
 MIDDLEWARE = [
     # "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "pors.middleware.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -159,3 +160,14 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# How the ActionLog records are written, "sync" (inserted in the request)
+# or "buffered" (inserted in bulk by a background thread, see
+# pors/log_writer.py).
+
+PORS_ACTION_LOG_MODE = "sync"
+
+# Where the reports of the background report jobs are generated (see
+# pors/report_jobs.py), it must be shared by all of the worker processes.
+
+PORS_REPORTS_DIR = BASE_DIR / "reports"
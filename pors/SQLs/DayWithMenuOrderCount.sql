@@ -1,9 +1,9 @@
-SELECT menu.AvailableDate ,COUNT([Order].Id) AS OrderCount
+SELECT menu.AvailableDate ,COUNT(o.id) AS OrderCount
 FROM (
-    select distinct AvailableDate
+    select distinct AvailableDate, AvailableDateOrdinal
     from pors_dailymenuitem
      ) AS menu
-         LEFT JOIN [Order]
-                   ON [Order].DeliveryDate = menu.AvailableDate
-WHERE menu.AvailableDate BETWEEN %s and %s
+         LEFT JOIN pors_ordersummary AS o
+                   ON o.DeliveryDateOrdinal = menu.AvailableDateOrdinal
+WHERE menu.AvailableDateOrdinal BETWEEN %s and %s
 GROUP BY menu.AvailableDate
\ No newline at end of file
@@ -0,0 +1,8 @@
+SELECT 'MENU' AS Kind, dmi.AvailableDate AS [Date], dmi.Item_id AS Item, dmi.IsActive
+FROM pors_dailymenuitem AS dmi
+WHERE dmi.AvailableDateOrdinal BETWEEN %s AND %s
+UNION ALL
+SELECT 'HOLIDAY' AS Kind, h.HolidayDate AS [Date], NULL AS Item, NULL AS IsActive
+FROM pors_holiday AS h
+WHERE h.HolidayDateOrdinal BETWEEN %s AND %s
+ORDER BY Kind, [Date], Item
@@ -1,9 +1,9 @@
 SELECT oi.DeliveryDate, oi.DeliveryBuilding, oi.DeliveryFloor, oi.Quantity, oi.PricePerOne,
            i.id, i.ItemName, i.Image, i.CurrentPrice,
            i.Category_id, i.ItemDesc, oi.Personnel,
-           o.SubsidyCap, o.PersonnelDebt, o.TotalPrice, i.MealType
+           o.id AS OrderId, o.SubsidyCap, o.PersonnelDebt, o.TotalPrice, i.MealType
     FROM pors_orderitem AS oi
     INNER JOIN pors_item AS i ON oi.Item_id = i.id
-    INNER JOIN "Order" AS o ON o.Personnel = oi.Personnel AND o.DeliveryDate = oi.DeliveryDate and o.MealType = i.MealType 
-    WHERE oi.DeliveryDate between %s AND %s and oi.Personnel = %s
+    INNER JOIN pors_ordersummary AS o ON o.Personnel = oi.Personnel AND o.DeliveryDateOrdinal = oi.DeliveryDateOrdinal and o.MealType = i.MealType
+    WHERE oi.DeliveryDateOrdinal between %s AND %s and oi.Personnel = %s
     ORDER BY oi.DeliveryDate
\ No newline at end of file
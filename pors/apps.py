@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PorsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pors"
+
+    def ready(self):
+        # Connecting the cache invalidation receivers.
+        from . import signals  # noqa: F401
+        from .queries import registry
+
+        registry.load()
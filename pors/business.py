@@ -1,20 +1,22 @@
-import json
 from typing import Optional
 
 import jdatetime
-from django.db.models import Sum, Value
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Value
 from django.db.models.functions import Coalesce
+from django.utils import timezone
 
+from . import caches
+from . import deadlines as d
 from . import models as m
+from . import queries
+from . import report_cache
 from . import serializers as s
 from .utils import (
-    create_jdate_object,
-    execute_raw_sql_with_params,
+    TUPLE_ROWS,
     first_and_last_day_date,
-    get_specific_deadline,
     localnow,
     split_dates,
-    split_json_dates,
     validate_date,
 )
 
@@ -79,7 +81,7 @@ def validate_calendar_request(
         return "Invalid month value."
 
 
-def get_days_with_menu(month: int, year: int) -> dict[str, str]:
+def get_days_with_menu(month: int, year: int) -> list[dict[str, int]]:
     """
     Fetching the days with menu on database and total orders
         on each day.
@@ -89,21 +91,24 @@ def get_days_with_menu(month: int, year: int) -> dict[str, str]:
         year: requested year.
 
     Returns:
-        Serialized data contains the day with menus and total orders.
+        The day number (`day`) and total orders (`ordersNumber`) of each
+        day with menu.
     """
 
     first_day, last_day = first_and_last_day_date(month, year)
 
-    with open("./pors/SQLs/DayWithMenuOrderCount.sql", "r") as file:
-        query = file.read()
-    result = execute_raw_sql_with_params(query, (first_day, last_day))
-
-    days_with_menu_serializer = s.DayWithMenuSerializer(result, many=True).data
-    splited_days_with_menu = split_json_dates(
-        json.dumps(days_with_menu_serializer)
+    rows = queries.registry["DayWithMenuOrderCount"].execute(
+        (m.date_ordinal(first_day), m.date_ordinal(last_day)),
+        mode=TUPLE_ROWS,
     )
 
-    return splited_days_with_menu
+    return [
+        {
+            "day": split_dates(row.AvailableDate, mode="day"),
+            "ordersNumber": row.OrderCount,
+        }
+        for row in rows
+    ]
 
 
 def is_date_valid_for_action(
@@ -124,13 +129,9 @@ def is_date_valid_for_action(
     if 24 > hours_deadline < 0:
         raise ValueError("`hours_deadline` value must be between 0 and 24.")
 
-    eligable_date = now + jdatetime.timedelta(days=days_deadline)
-    if eligable_date.hour >= hours_deadline:
-        eligable_date += jdatetime.timedelta(days=1)
-
-    if date >= eligable_date.strftime("%Y/%m/%d"):
-        return True
-    return False
+    return d.hour_ordinal(now) < d.cutoff_hour_ordinal(
+        m.date_ordinal(date), days_deadline, hours_deadline
+    )
 
 
 def get_first_orderable_date(
@@ -139,8 +140,10 @@ def get_first_orderable_date(
     launch_deadlines: dict[int, s.Deadline],
 ):
     """
-    Returning the first valid date for order submission based on deadline.
-    The deadline values must be a Deadline namedtuple.
+    Returning the first valid date for order submission based on deadline,
+    the first date which is open for breakfast or launch (see
+    `deadlines.first_open_day`). The deadline values must be a Deadline
+    namedtuple.
 
     Args:
         now: Current datetime.
@@ -150,35 +153,213 @@ def get_first_orderable_date(
         Tuple of `year`, `month` and `day` values, don't forget the order :).
     """
 
-    passed_days = 0
-    weekday = now.weekday()
-    while True:
-        breakfast_deadline = breakfast_deadlines[weekday]
-        launch_deadline = launch_deadlines[weekday]
+    day = d.first_open_day(
+        d.hour_ordinal(now),
+        {
+            weekday: (breakfast_deadlines[weekday], launch_deadlines[weekday])
+            for weekday in range(7)
+        },
+    )
+    date = jdatetime.date.fromordinal(day)
+    return date.year, date.month, date.day
 
-        if (
-            (
-                breakfast_deadline.Days == passed_days
-                and breakfast_deadline.Hour <= now.hour
-            )
-            or (breakfast_deadline.Days > passed_days)
-        ) and (
-            (
-                launch_deadline.Days == passed_days
-                and launch_deadline.Hour <= now.hour
+
+OrderSummaryKey = tuple[str, str, str]
+
+
+def calculate_order_summaries(
+    order_items,
+) -> dict[OrderSummaryKey, m.OrderSummary]:
+    """
+    Aggregating order items into (unsaved) `OrderSummary` objects, the
+    same way the `Order` view does.
+
+    The subsidies are read from the database, not from the per process
+    `caches.subsidy_cache`, so the stored bills never use a stale subsidy
+    of another worker.
+
+    Args:
+        order_items: OrderItem queryset.
+
+    Returns:
+        Summaries keyed by (`Personnel`, `DeliveryDate`, `MealType`).
+    """
+
+    summaries: dict[OrderSummaryKey, m.OrderSummary] = {}
+    rows = order_items.order_by("id").values_list(
+        "Personnel",
+        "DeliveryDate",
+        "Item__MealType",
+        "Item__Category__IsPrimary",
+        "Quantity",
+        "PricePerOne",
+        "DeliveryBuilding",
+        "DeliveryFloor",
+    )
+    for (
+        personnel,
+        date,
+        meal_type,
+        is_primary,
+        quantity,
+        price,
+        building,
+        floor,
+    ) in rows.iterator():
+        key = (personnel, date, meal_type)
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = m.OrderSummary(
+                Personnel=personnel, DeliveryDate=date, MealType=meal_type
             )
-            or (launch_deadline.Days > passed_days)
-        ):
+        summary.HasPrimary = summary.HasPrimary or is_primary
+        summary.TotalPrice += quantity * price
 
-            passed_days += 1
-            if weekday != 6:  # has 7 days only (starts with 0)
-                weekday += 1
-            else:
-                weekday = 0
+        # Items of a meal are delivered to the same place, the latest
+        # submitted item wins if they are not.
+        summary.DeliveryBuilding = building
+        summary.DeliveryFloor = floor
 
-        else:
-            now += jdatetime.timedelta(days=passed_days)
-            return now.year, now.month, now.day
+    subsidies = caches.SubsidyIndex.load().get_many(
+        summary.DeliveryDate for summary in summaries.values()
+    )
+    for summary in summaries.values():
+        summary.apply_subsidy(subsidies[summary.DeliveryDate] or 0)
+
+    return summaries
+
+
+def refresh_order_summary(personnel: str, date: str, meal_type: str):
+    """
+    Recalculating the `OrderSummary` record of a personnel's meal on a date
+    from its order items. The record gets removed if there is no item left.
+
+    The cached reports of the date are invalidated too (once the
+    transaction is committed).
+
+    Warnings:
+        Call this function in the same transaction that changed the order
+        items, otherwise the summary may get out of sync.
+    """
+
+    transaction.on_commit(lambda: report_cache.invalidate(date, date))
+
+    lookup = dict(Personnel=personnel, DeliveryDate=date, MealType=meal_type)
+    summaries = calculate_order_summaries(
+        m.OrderItem.objects.filter(
+            Personnel=personnel, DeliveryDate=date, Item__MealType=meal_type
+        )
+    )
+    summary = summaries.get((personnel, date, meal_type))
+    if summary is None:
+        m.OrderSummary.objects.filter(**lookup).delete()
+        return
+
+    m.OrderSummary.objects.update_or_create(
+        **lookup,
+        defaults=dict(
+            HasPrimary=summary.HasPrimary,
+            DeliveryBuilding=summary.DeliveryBuilding,
+            DeliveryFloor=summary.DeliveryFloor,
+            TotalPrice=summary.TotalPrice,
+            SubsidyCap=summary.SubsidyCap,
+            PersonnelDebt=summary.PersonnelDebt,
+            SubsidySpent=summary.SubsidySpent,
+        ),
+    )
+
+
+def refresh_order_summary_subsidies(
+    from_date: str, until_date: Optional[str] = None
+):
+    """
+    Recalculating the bill of the order summaries between the dates, must
+    be called whenever a subsidy changes. The subsidies are read from the
+    database, see `calculate_order_summaries`.
+    """
+
+    summaries = m.OrderSummary.objects.filter(
+        DeliveryDateOrdinal__gte=m.date_ordinal(from_date)
+    )
+    if until_date:
+        summaries = summaries.filter(
+            DeliveryDateOrdinal__lte=m.date_ordinal(until_date)
+        )
+
+    subsidies = caches.SubsidyIndex.load()
+    changed = []
+    for summary in summaries.iterator():
+        amount = subsidies.get(summary.DeliveryDate) or 0
+        if summary.SubsidyCap != amount:
+            summary.apply_subsidy(amount)
+            changed.append(summary)
+
+    m.OrderSummary.objects.bulk_update(
+        changed,
+        ["SubsidyCap", "PersonnelDebt", "SubsidySpent"],
+        batch_size=500,
+    )
+
+
+def add_order_item(
+    order_item: m.OrderItem,
+    create_log: str,
+    increase_log: str,
+    user: str,
+    admin: Optional[str] = None,
+    reason: Optional[m.AdminManipulationReason] = None,
+    comment: Optional[str] = None,
+):
+    """
+    Adding the (unsaved) order item to the personnel's order, or increasing
+    its quantity by 1 if the personnel has already ordered the item on that
+    date. Either way the action gets logged.
+
+    The quantity is increased by a single conditional UPDATE, so parallel
+    requests (double clicks, several tabs) can not lose an increment. If
+    the item has not been ordered yet it gets inserted, and if a parallel
+    request inserts it first, the unique constraint fails and the UPDATE is
+    retried (and so is the insert, if the row got removed again).
+
+    Warnings:
+        Call this function inside a transaction.
+
+    Args:
+        order_item: Unsaved order item with the quantity of 1.
+        create_log: Log message in case of inserting the item.
+        increase_log: Log message in case of increasing the quantity.
+        user, admin, reason, comment: Logging parameters.
+    """
+
+    log_kwargs = dict(user=user, admin=admin, reason=reason, comment=comment)
+    current_item = m.OrderItem.objects.filter(
+        Personnel=order_item.Personnel,
+        DeliveryDate=order_item.DeliveryDate,
+        Item=order_item.Item,
+    )
+    increase = dict(Quantity=F("Quantity") + 1, ModifiedAt=timezone.now())
+
+    while not current_item.update(**increase):
+        try:
+            with transaction.atomic():
+                order_item.save(log=create_log, **log_kwargs)
+            return
+        except IntegrityError:
+            # Inserted by a parallel request in the meantime, which may be
+            # removed before the UPDATE.
+            pass
+
+    # The row is locked by the UPDATE until the end of the transaction.
+    record_id, quantity = current_item.values_list("id", "Quantity").get()
+    # Only the changed field, the same as the `Logger` updates.
+    m.ActionLog.objects.log(
+        m.ActionLog.ActionTypeChoices.UPDATE,
+        log_msg=increase_log,
+        model=m.OrderItem,
+        record_id=record_id,
+        old_data={"Quantity": quantity - 1},
+        **log_kwargs,
+    )
 
 
 class OverrideUserValidator:
@@ -298,7 +479,7 @@ class ValidateRemove:
             raise ValueError("Item does not exists in provided date.")
 
         orders = m.OrderItem.objects.filter(
-            DeliveryDate=self.date, Item=self.item
+            DeliveryDateOrdinal=m.date_ordinal(self.date), Item=self.item
         )
         if orders:
             self.message = (
@@ -316,14 +497,8 @@ class ValidateRemove:
 
         now = localnow()
 
-        year, month, day = split_dates(self.date, mode="all")
-        date_obj = jdatetime.datetime(year, month, day)
-        days_deadline, hours_deadline = get_specific_deadline(
-            date_obj.weekday(), self.item.MealType
-        )
-
-        is_date_valid_for_removal = is_date_valid_for_action(
-            now, self.date, days_deadline, hours_deadline
+        is_date_valid_for_removal = caches.get_deadline_table().is_open(
+            self.date, self.item.MealType, now
         )
         if not is_date_valid_for_removal:
             self.message = "مهلت حذف کردن آیتم در تاریخ مورد نظر تمام شده است."
@@ -456,8 +631,14 @@ class ValidateOrder(OverrideUserValidator):
         """
         Checking user's default delivery building and floor value in db.
         Either one or both of them is null, it raise ValueError.
+
+        The values are read from the database, not the cached user, since
+        they are used for the new order items.
         """
 
+        self.user.refresh_from_db(
+            fields=["LastDeliveryBuilding", "LastDeliveryFloor"]
+        )
         delivery_building = self.user.LastDeliveryBuilding
         delivery_floor = self.user.LastDeliveryFloor
         if not (delivery_building and delivery_floor):
@@ -494,14 +675,8 @@ class ValidateOrder(OverrideUserValidator):
 
         now = localnow()
 
-        year, month, day = split_dates(self.date, mode="all")
-        date_obj = jdatetime.datetime(year, month, day)
-        days_deadline, hours_deadline = get_specific_deadline(
-            date_obj.weekday(), self.item.MealType
-        )
-
-        is_valid = is_date_valid_for_action(
-            now, self.date, days_deadline, hours_deadline
+        is_valid = caches.get_deadline_table().is_open(
+            self.date, self.item.MealType, now
         )
         if not is_valid:
             self.message = "مهلت ثبت / لغو سفارش در این تاریخ تمام شده است."
@@ -522,15 +697,16 @@ class ValidateOrder(OverrideUserValidator):
         if not self.item.Category.IsPrimary:
             return
 
-        current_order = m.Order.objects.filter(
+        current_order = m.OrderSummary.objects.filter(
             DeliveryDate=self.date,
-            Personnel=self.user,
+            Personnel=self.user.Personnel,
             MealType=m.MealTypeChoices.LAUNCH,
         ).first()
         if current_order is not None and current_order.HasPrimary:
             self.message = "شما نمی‌توانید بیشتر 1 غذای اصلی سفارش دهید."
             raise ValueError("You cannot submit more than 1 primary item.")
 
+    @transaction.atomic
     def create_order(self):
         """
         Submitting order.
@@ -546,44 +722,35 @@ class ValidateOrder(OverrideUserValidator):
                 "This method is only available if provided data is valid."
             )
 
-        instance = m.OrderItem.objects.filter(
-            Personnel=self.user.Personnel,
-            DeliveryDate=self.date,
-            Item=self.item,
-        ).first()
-        if instance:
-            instance.Quantity += 1
-            instance.save(
-                log=(
-                    f"Launch Item {self.item.ItemName}'s Quantity just"
-                    f" increased by 1 for {self.date}"
-                ),
-                user=self.user.Personnel,
-                admin=self.admin_user,
-                reason=self.reason,
-                comment=self.comment,
-            )
-            return
-
-        m.OrderItem(
-            Personnel=self.user.Personnel,
-            DeliveryDate=self.date,
-            DeliveryBuilding=self.user.LastDeliveryBuilding,
-            DeliveryFloor=self.user.LastDeliveryFloor,
-            Item=self.item,
-            Quantity=1,
-            PricePerOne=self.item.CurrentPrice,
-        ).save(
-            log=(
+        add_order_item(
+            m.OrderItem(
+                Personnel=self.user.Personnel,
+                DeliveryDate=self.date,
+                DeliveryBuilding=self.user.LastDeliveryBuilding,
+                DeliveryFloor=self.user.LastDeliveryFloor,
+                Item=self.item,
+                Quantity=1,
+                PricePerOne=self.item.CurrentPrice,
+            ),
+            create_log=(
                 f"Launch Item {self.item.ItemName} just added to order for"
                 f" {self.date}"
             ),
+            increase_log=(
+                f"Launch Item {self.item.ItemName}'s Quantity just"
+                f" increased by 1 for {self.date}"
+            ),
             user=self.user.Personnel,
             admin=self.admin_user,
             reason=self.reason,
             comment=self.comment,
         )
 
+        refresh_order_summary(
+            self.user.Personnel, self.date, self.item.MealType
+        )
+
+    @transaction.atomic
     def remove_order(self):
         """
         Removing the specified order.
@@ -625,6 +792,10 @@ class ValidateOrder(OverrideUserValidator):
                 comment=self.comment,
             )
 
+        refresh_order_summary(
+            self.user.Personnel, self.date, self.item.MealType
+        )
+
 
 class ValidateBreakfast(OverrideUserValidator):
     """
@@ -711,8 +882,14 @@ class ValidateBreakfast(OverrideUserValidator):
         """
         Checking user's default delivery building and floor value in db.
         Either one or both of them is null, it raise ValueError.
+
+        The values are read from the database, not the cached user, since
+        they are used for the new order items.
         """
 
+        self.user.refresh_from_db(
+            fields=["LastDeliveryBuilding", "LastDeliveryFloor"]
+        )
         delivery_building = self.user.LastDeliveryBuilding
         delivery_floor = self.user.LastDeliveryFloor
         if not (delivery_building and delivery_floor):
@@ -731,14 +908,8 @@ class ValidateBreakfast(OverrideUserValidator):
 
         now = localnow()
 
-        year, month, day = split_dates(self.date, mode="all")
-        date_obj = jdatetime.datetime(year, month, day)
-        days_deadline, hours_deadline = get_specific_deadline(
-            date_obj.weekday(), self.item.MealType
-        )
-
-        is_valid_for_submission = is_date_valid_for_action(
-            now, self.date, days_deadline, hours_deadline
+        is_valid_for_submission = caches.get_deadline_table().is_open(
+            self.date, self.item.MealType, now
         )
         if not is_valid_for_submission:
             self.message = (
@@ -756,9 +927,9 @@ class ValidateBreakfast(OverrideUserValidator):
 
         """
 
-        breakfast_order = m.Order.objects.filter(
+        breakfast_order = m.OrderSummary.objects.filter(
             DeliveryDate=self.date,
-            Personnel=self.user,
+            Personnel=self.user.Personnel,
             MealType=m.MealTypeChoices.BREAKFAST,
         )
         if breakfast_order.exists():
@@ -767,6 +938,7 @@ class ValidateBreakfast(OverrideUserValidator):
                 "Personnel cannot submit more than 1 breakfast" " item(s)."
             )
 
+    @transaction.atomic
     def create_breakfast_order(self):
         """
         Creating breakfast order for personnel
@@ -780,43 +952,33 @@ class ValidateBreakfast(OverrideUserValidator):
                 "This method is only available if provided data is valid."
             )
 
-        instance = m.OrderItem.objects.filter(
-            Personnel=self.user.Personnel,
-            DeliveryDate=self.date,
-            Item=self.item,
-        ).first()
-        if instance:
-            instance.Quantity += 1
-            instance.save(
-                log=(
-                    f"Breakfast Item {self.item.ItemName}'s Quantity just"
-                    f" increased by 1 for {self.date}"
-                ),
-                user=self.user.Personnel,
-                admin=self.admin_user,
-                reason=self.reason,
-                comment=self.comment,
-            )
-            return
-
-        m.OrderItem(
-            Personnel=self.user.Personnel,
-            DeliveryDate=self.date,
-            DeliveryBuilding=self.user.LastDeliveryBuilding,
-            DeliveryFloor=self.user.LastDeliveryFloor,
-            Item=self.item,
-            PricePerOne=self.item.CurrentPrice,
-        ).save(
-            log=(
+        add_order_item(
+            m.OrderItem(
+                Personnel=self.user.Personnel,
+                DeliveryDate=self.date,
+                DeliveryBuilding=self.user.LastDeliveryBuilding,
+                DeliveryFloor=self.user.LastDeliveryFloor,
+                Item=self.item,
+                PricePerOne=self.item.CurrentPrice,
+            ),
+            create_log=(
                 f"Breakfast Item {self.item.ItemName} just added to the order"
                 f" for {self.date}"
             ),
+            increase_log=(
+                f"Breakfast Item {self.item.ItemName}'s Quantity just"
+                f" increased by 1 for {self.date}"
+            ),
             user=self.user.Personnel,
             admin=self.admin_user,
             reason=self.reason,
             comment=self.comment,
         )
 
+        refresh_order_summary(
+            self.user.Personnel, self.date, self.item.MealType
+        )
+
 
 class ValidateAddMenuItem:
     """
@@ -904,14 +1066,8 @@ class ValidateAddMenuItem:
         """
 
         now = localnow()
-        year, month, day = split_dates(self.date, mode="all")
-        date_obj = jdatetime.datetime(year, month, day)
-        days_deadline, hours_deadline = get_specific_deadline(
-            date_obj.weekday(), self.item.MealType
-        )
-
-        is_date_valid_for_add = is_date_valid_for_action(
-            now, self.date, days_deadline, hours_deadline
+        is_date_valid_for_add = caches.get_deadline_table().is_open(
+            self.date, self.item.MealType, now
         )
         if not is_date_valid_for_add:
             self.message = (
@@ -977,7 +1133,7 @@ class ValidateDeliveryBuilding(OverrideUserValidator):
         self.date: str = ""
         self.new_delivery_building: str = ""
         self.new_delivery_floor: str = ""
-        self.order: m.Order = m.Order.objects.none()
+        self.order: m.OrderSummary = m.OrderSummary.objects.none()
 
     def is_valid(self):
         """
@@ -1040,25 +1196,23 @@ class ValidateDeliveryBuilding(OverrideUserValidator):
 
     def _validate_building(self):
         """
-        Validating provided building and floor via 'available_buildings'.
+        Validating provided building and floor via the cached
+        `caches.LocationTree`.
         """
 
-        if not self.new_delivery_building.startswith("Building_"):
+        if not self.new_delivery_building.startswith(
+            caches.BUILDING_CODE_PREFIX
+        ):
             raise ValueError("Invalid building value.")
 
-        valid_building = m.HR_constvalue.objects.filter(
-            Code=self.new_delivery_building
-        )
-        if not valid_building.exists():
+        floors = caches.get_location_tree().floors
+        if self.new_delivery_building not in floors:
             self.message = "ساختمان انتخابی شما در سیستم موجود نمی‌باشد."
             raise ValueError(
                 "'newDeliveryBuilding' value does not exists in available"
                 " choices."
             )
-        valid_floor = m.HR_constvalue.objects.filter(
-            Code=self.new_delivery_floor, Parent_id=valid_building.first().pk
-        )
-        if not valid_floor.exists():
+        if self.new_delivery_floor not in floors[self.new_delivery_building]:
             self.message = "طبقه انتخابی شما در سیستم موجود نمی‌باشد."
             raise ValueError(
                 "'newDeliveryFloor' value does not exists in available"
@@ -1073,7 +1227,7 @@ class ValidateDeliveryBuilding(OverrideUserValidator):
         Will store order object in 'self.order' after validation.
         """
 
-        current_order = m.Order.objects.filter(
+        current_order = m.OrderSummary.objects.filter(
             Personnel=self.user.Personnel,
             DeliveryDate=self.date,
             MealType=self.meal_type,
@@ -1098,16 +1252,8 @@ class ValidateDeliveryBuilding(OverrideUserValidator):
         Checking if the requested date is valid for action.
         """
 
-        date_obj = create_jdate_object(self.date)
-        deadline: s.Deadline = get_specific_deadline(
-            weekday=date_obj.weekday(),
-            meal_type=self.meal_type,
-            deadline=s.Deadline,
-        )
-        now = localnow()
-
-        is_valid = is_date_valid_for_action(
-            now, self.date, deadline.Days, deadline.Hour
+        is_valid = caches.get_deadline_table().is_open(
+            self.date, self.meal_type, localnow()
         )
 
         if not is_valid:
@@ -1116,6 +1262,7 @@ class ValidateDeliveryBuilding(OverrideUserValidator):
                 "Deadline for changing delivery building is over."
             )
 
+    @transaction.atomic
     def change_delivery_place(self):
         """
         Changing personnel's 'DeliveryBuilding' and 'DeliveryFloor' value
@@ -1138,6 +1285,7 @@ class ValidateDeliveryBuilding(OverrideUserValidator):
             DeliveryBuilding=self.new_delivery_building,
             DeliveryFloor=self.new_delivery_floor,
         )
+        refresh_order_summary(personnel, self.date, self.meal_type)
 
         # manual log insertion
         # todo doc
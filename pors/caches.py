@@ -0,0 +1,476 @@
+"""In-process caches used on the hot paths of the system.
+
+Every cache in this module is per process (per IIS/WSGI worker), so a
+change made by one worker is NOT visible to the other ones until the entry
+expires. That is why every entry has a short ttl, and the invalidation
+hooks in `signals` only guarantee freshness for the worker which made the
+change.
+"""
+
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha256
+from typing import Any, Callable, Hashable, Iterable, NamedTuple, Optional
+
+import jdatetime
+from django.db.models import Q
+from persiantools.jdatetime import JalaliDate
+
+from . import deadlines as d
+from . import models as m
+
+# Maximum number of authenticated users which are kept in memory.
+AUTH_CACHE_MAX_SIZE = 2048
+
+# Seconds that an authenticated user stays valid in the cache, a rotated
+# token (or a deactivated user) stays valid for the other workers this long.
+AUTH_CACHE_TTL = 15
+
+# Fields of the users which are kept in the cache, in the order of the
+# model's fields. They only identify and authorize the user, the other
+# fields (e.g. LastDeliveryBuilding) are loaded from the database when
+# they are accessed.
+AUTH_FIELDS = ("id", "Personnel", "IsAdmin", "Token", "ExpiredAt", "IsActive")
+
+# Number of months which their menu and holidays are kept in memory, and
+# the seconds they stay valid.
+CALENDAR_CACHE_MAX_SIZE = 24
+CALENDAR_CACHE_TTL = 300
+
+# Number of years which their holidays are kept in memory, and the seconds
+# they stay valid.
+HOLIDAY_CACHE_MAX_SIZE = 4
+HOLIDAY_CACHE_TTL = 300
+
+# Weekdays which are always holiday, Thursday and Friday.
+WEEKEND_WEEKDAYS = (5, 6)
+
+# Seconds that the SystemSetting snapshot stays valid. Keep it short since
+# the settings are usually changed directly on the database level.
+SYSTEM_SETTING_TTL = 5
+
+# Seconds that the building/floor tree stays valid. HR_constvalue is
+# maintained by the HR system, so its changes are seen after this long.
+LOCATION_TREE_TTL = 300
+
+# Prefix of the buildings' codes in HR_constvalue.
+BUILDING_CODE_PREFIX = "Building_"
+
+# Seconds that the deadlines stay valid.
+DEADLINE_TABLE_TTL = 60
+
+# Seconds that the subsidy index stays valid. Bills of the other workers
+# may use the previous subsidies for this long after a change.
+SUBSIDY_INDEX_TTL = 60
+
+
+class TTLCache:
+    """
+    A thread safe, size bounded cache which its entries expire after `ttl`
+    seconds. When the cache is full, the least recently used entry gets
+    evicted.
+
+    Hit and miss counters are available via `stats` for monitoring purposes.
+
+    Args:
+        max_size: Maximum number of entries.
+        ttl: Life time of each entry in seconds.
+        timer: Monotonic clock, replaceable for testing purposes.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= self._timer():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._data[key] = (self._timer() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def evict(self, predicate: Callable[[Hashable, Any], bool]) -> None:
+        """Removing every entry that `predicate(key, value)` is true for."""
+
+        with self._lock:
+            keys = [k for k, v in self._data.items() if predicate(k, v[1])]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+        }
+
+
+class SubsidyIndex:
+    """
+    Subsidy amounts of the dates, looked up in O(log n) without querying.
+
+    The subsidies are flattened into consecutive segments, each segment
+    starts at a boundary (the first day of a subsidy or the day after the
+    last day of one) and has a single amount (None if no subsidy covers
+    it). If subsidies overlap, the one with the lowest id wins, like
+    the database lookup did.
+
+    Args:
+        subsidies: (first day, last day, amount) of each subsidy, ordered
+            by their id. Days are ordinals (see `models.date_ordinal`), the
+            last day is None for the open ended subsidies.
+    """
+
+    def __init__(
+        self, subsidies: Iterable[tuple[int, Optional[int], int]]
+    ) -> None:
+        subsidies = list(subsidies)
+        self._boundaries = sorted(
+            {first for first, _, _ in subsidies}
+            | {last + 1 for _, last, _ in subsidies if last is not None}
+        )
+        self._amounts = [
+            next(
+                (
+                    amount
+                    for first, last, amount in subsidies
+                    if first <= day and (last is None or day <= last)
+                ),
+                None,
+            )
+            for day in self._boundaries
+        ]
+
+    @classmethod
+    def load(cls) -> "SubsidyIndex":
+        return cls(
+            m.Subsidy.objects.order_by("id").values_list(
+                "FromDateOrdinal", "UntilDateOrdinal", "Amount"
+            )
+        )
+
+    def get(self, date: str) -> Optional[int]:
+        """Returning the subsidy amount of the date, None if it has none."""
+
+        i = bisect_right(self._boundaries, m.date_ordinal(date)) - 1
+        return self._amounts[i] if i >= 0 else None
+
+    def get_many(self, dates: Iterable[str]) -> dict[str, Optional[int]]:
+        """Returning the subsidy amount of each date, keyed by the date."""
+
+        return {date: self.get(date) for date in set(dates)}
+
+
+class DeadlineTable:
+    """
+    Deadlines of each weekday and meal type, and the cut-off of the dates.
+
+    A (date, meal type) is open for actions until its cut-off, see the
+    `deadlines` module. Cut-offs are calculated once per date, so checking
+    a date is a dict lookup and an integer comparison.
+
+    Args:
+        deadlines: (weekday, meal type, days, hour) of the Deadlines rows.
+    """
+
+    def __init__(
+        self, deadlines: Iterable[tuple[int, str, int, int]]
+    ) -> None:
+        self.deadlines: dict[tuple[int, str], tuple[int, int]] = {
+            (weekday, meal_type): (days, hour)
+            for weekday, meal_type, days, hour in deadlines
+        }
+        self._cutoffs: dict[tuple[str, str], int] = {}
+
+    @classmethod
+    def load(cls) -> "DeadlineTable":
+        return cls(
+            m.Deadlines.objects.values_list(
+                "WeekDay", "MealType", "Days", "Hour"
+            )
+        )
+
+    def get(self, weekday: int, meal_type: str) -> tuple[int, int]:
+        """
+        Returning the days and hour deadline, raises
+        `Deadlines.DoesNotExist` if it's not defined.
+        """
+
+        try:
+            return self.deadlines[weekday, meal_type]
+        except KeyError:
+            raise m.Deadlines.DoesNotExist(
+                f"No {meal_type} deadline for weekday {weekday}."
+            ) from None
+
+    def cutoff(self, date: str, meal_type: str) -> int:
+        key = (date, meal_type)
+        cutoff = self._cutoffs.get(key)
+        if cutoff is None:
+            day = m.date_ordinal(date)
+            cutoff = d.cutoff_hour_ordinal(
+                day, *self.get(d.weekday(day), meal_type)
+            )
+            self._cutoffs[key] = cutoff
+        return cutoff
+
+    def is_open(
+        self, date: str, meal_type: str, now: jdatetime.datetime
+    ) -> bool:
+        """Whether the actions of the meal on the date are open at `now`."""
+
+        return d.hour_ordinal(now) < self.cutoff(date, meal_type)
+
+
+class MonthMetadata(NamedTuple):
+    """
+    Attributes:
+        first_weekday: Weekday of the first day of the month, 0 is Saturday.
+        length: Number of days of the month.
+        weekend_days: Days of the month which are weekend holidays.
+    """
+
+    first_weekday: int
+    length: int
+    weekend_days: frozenset[int]
+
+
+@lru_cache(maxsize=CALENDAR_CACHE_MAX_SIZE * 4)
+def get_month_metadata(year: int, month: int) -> MonthMetadata:
+    """Returning the metadata of the month, which never changes."""
+
+    first_weekday = d.weekday(m.date_ordinal(f"{year:04}/{month:02}/01"))
+    length = JalaliDate.days_in_month(month, year)
+    return MonthMetadata(
+        first_weekday,
+        length,
+        frozenset(
+            day
+            for day in range(1, length + 1)
+            if (first_weekday + day - 1) % 7 in WEEKEND_WEEKDAYS
+        ),
+    )
+
+
+class LocationTree(NamedTuple):
+    """
+    Buildings and their floors, out of HR_constvalue.
+
+    Attributes:
+        buildings: Serialized buildings (see `BuildingSerializer`), they
+            are shared between requests, DO NOT mutate them.
+        floors: Floor codes of each building code.
+    """
+
+    buildings: list
+    floors: dict[str, frozenset[str]]
+
+    @classmethod
+    def load(cls) -> "LocationTree":
+        """Loading the buildings and their floors with a single query."""
+
+        from .serializers import BuildingSerializer
+
+        rows = list(
+            m.HR_constvalue.objects.filter(
+                Q(Code__startswith=BUILDING_CODE_PREFIX)
+                | Q(Parent__Code__startswith=BUILDING_CODE_PREFIX)
+            ).values("id", "Code", "Caption", "Parent_id")
+        )
+        buildings = {
+            row["id"]: dict(code=row["Code"], title=row["Caption"], floors=[])
+            for row in rows
+            if row["Code"].startswith(BUILDING_CODE_PREFIX)
+        }
+        for row in rows:
+            if row["Parent_id"] in buildings:
+                buildings[row["Parent_id"]]["floors"].append(row)
+
+        floors = {}
+        for building in buildings.values():
+            # The first building wins if the codes are duplicated.
+            floors.setdefault(
+                building["code"],
+                frozenset(floor["Code"] for floor in building["floors"]),
+            )
+        return cls(
+            BuildingSerializer(buildings.values(), many=True).data, floors
+        )
+
+
+auth_cache = TTLCache(AUTH_CACHE_MAX_SIZE, AUTH_CACHE_TTL)
+system_setting_cache = TTLCache(1, SYSTEM_SETTING_TTL)
+deadline_cache = TTLCache(1, DEADLINE_TABLE_TTL)
+location_cache = TTLCache(1, LOCATION_TREE_TTL)
+subsidy_cache = TTLCache(1, SUBSIDY_INDEX_TTL)
+calendar_cache = TTLCache(CALENDAR_CACHE_MAX_SIZE, CALENDAR_CACHE_TTL)
+holiday_cache = TTLCache(HOLIDAY_CACHE_MAX_SIZE, HOLIDAY_CACHE_TTL)
+
+
+def _token_key(token: str) -> tuple[str, str]:
+    # Raw tokens are never kept in memory as keys.
+    return "token", sha256(token.encode()).hexdigest()
+
+
+def get_user_by_token(token: str, today: str) -> Optional[m.User]:
+    """
+    Returning the active user which owns the `token` and its token is not
+    expired until `today`.
+
+    Args:
+        token: The token which was sent by the client.
+        today: Current date in yyyy/mm/dd format.
+    """
+
+    key = _token_key(token)
+    values = auth_cache.get(key)
+    if values is None:
+        values = (
+            m.User.objects.filter(Token=token, IsActive=True)
+            .values_list(*AUTH_FIELDS)
+            .first()
+        )
+        if values is None:
+            return None
+        auth_cache.set(key, values)
+
+    user = _build_user(values)
+    if user.ExpiredAt < today:
+        return None
+    return user
+
+
+def get_user_by_personnel(personnel: str) -> Optional[m.User]:
+    """Returning the user record of the `personnel` (active or not)."""
+
+    key = ("personnel", personnel)
+    values = auth_cache.get(key)
+    if values is None:
+        values = (
+            m.User.objects.filter(Personnel=personnel)
+            .values_list(*AUTH_FIELDS)
+            .first()
+        )
+        if values is None:
+            return None
+        auth_cache.set(key, values)
+    return _build_user(values)
+
+
+def _build_user(values: tuple) -> m.User:
+    # A new instance per call, so the (deferred) fields which are loaded by
+    # a request are never shared with the other requests.
+    return m.User.from_db(m.User.objects.db, AUTH_FIELDS, values)
+
+
+def invalidate_user(user: m.User) -> None:
+    """
+    Dropping every cached entry that belongs to the user, including the
+    entries which are cached with an old (rotated) token.
+    """
+
+    auth_cache.evict(lambda key, values: values[0] == user.pk)
+
+
+def get_system_setting() -> m.SystemSetting:
+    """Returning a snapshot of the (single) SystemSetting record."""
+
+    setting = system_setting_cache.get("setting")
+    if setting is None:
+        setting = m.SystemSetting.objects.last()
+        system_setting_cache.set("setting", setting)
+    return setting
+
+
+def get_location_tree() -> LocationTree:
+    """Returning the tree of the buildings, see `LocationTree`."""
+
+    tree = location_cache.get("tree")
+    if tree is None:
+        tree = LocationTree.load()
+        location_cache.set("tree", tree)
+    return tree
+
+
+def get_deadline_table() -> DeadlineTable:
+    """Returning the table of the deadlines, see `DeadlineTable`."""
+
+    table = deadline_cache.get("table")
+    if table is None:
+        table = DeadlineTable.load()
+        deadline_cache.set("table", table)
+    return table
+
+
+def get_subsidy_index() -> SubsidyIndex:
+    """Returning the index of the subsidies, see `SubsidyIndex`."""
+
+    index = subsidy_cache.get("index")
+    if index is None:
+        index = SubsidyIndex.load()
+        subsidy_cache.set("index", index)
+    return index
+
+
+def get_month_holidays(year: int, month: int) -> frozenset[int]:
+    """
+    Returning the days of the month which are defined as holiday (weekends
+    are not included). Holidays of the whole year are loaded at once.
+    """
+
+    holidays = holiday_cache.get(year)
+    if holidays is None:
+        holidays = {}
+        dates = m.Holiday.objects.filter(
+            HolidayDateOrdinal__range=(
+                m.date_ordinal(f"{year:04}/01/01"),
+                m.date_ordinal(f"{year + 1:04}/01/01") - 1,
+            )
+        ).values_list("HolidayDate", flat=True)
+        for date in dates:
+            _, holiday_month, day = map(int, date.split("/"))
+            holidays.setdefault(holiday_month, set()).add(day)
+        holidays = {key: frozenset(days) for key, days in holidays.items()}
+        holiday_cache.set(year, holidays)
+    return holidays.get(month, frozenset())
+
+
+def invalidate_calendar_month(date: str) -> None:
+    """Dropping the cached calendar data of the `date`'s month."""
+
+    year, month, _ = date.split("/")
+    calendar_cache.delete(("month", int(year), int(month)))
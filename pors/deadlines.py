@@ -0,0 +1,74 @@
+"""Deadline arithmetic on integer day ordinals.
+
+Dates are handled as their day ordinals (see `models.date_ordinal`) and
+instants as hour ordinals (see `hour_ordinal`), so the calculations below
+are plain integer operations which never build date objects or strings.
+
+A date is open for actions (submission, removal, etc.) of a meal until its
+cut-off, `Hour` o'clock of `Days` days before the date, where `Days` and
+`Hour` come from the Deadlines row of the date's weekday.
+"""
+
+from typing import Iterable, Mapping
+
+import jdatetime
+
+# Ordinal 3 is a Saturday, the first day (0) of the week.
+WEEKDAY_OFFSET = 4
+
+
+def weekday(day: int) -> int:
+    """Weekday of the day ordinal, 0 is Saturday."""
+
+    return (day + WEEKDAY_OFFSET) % 7
+
+
+def hour_ordinal(now: jdatetime.datetime) -> int:
+    """Number of hours since the day ordinal 0."""
+
+    return now.toordinal() * 24 + now.hour
+
+
+def cutoff_hour_ordinal(
+    day: int, days_deadline: int, hours_deadline: int
+) -> int:
+    """
+    Returning the hour (see `hour_ordinal`) which the actions of the `day`
+    (an ordinal) are closed from.
+    """
+
+    return (day - days_deadline) * 24 + hours_deadline
+
+
+def first_open_day(
+    now: int, deadlines: Mapping[int, Iterable[tuple[int, int]]]
+) -> int:
+    """
+    Returning the first day (ordinal) from today on which is open for at
+    least one of the meals, in constant time.
+
+    For each weekday, the days which are open for a meal are the ones after
+    a threshold, so the answer is the first day of the weekday after the
+    threshold of its earliest meal, whichever comes first.
+
+    Args:
+        now: Current hour ordinal.
+        deadlines: (days, hour) deadlines of each meal, keyed by weekday.
+            Every weekday must have at least one deadline.
+    """
+
+    today = now // 24
+    first_day = None
+    for week_day in range(7):
+        # cutoff > now  <=>  day > (now - hour) // 24 + days
+        threshold = max(
+            today,
+            min(
+                (now - hour) // 24 + days + 1
+                for days, hour in deadlines[week_day]
+            ),
+        )
+        day = threshold + (week_day - weekday(threshold)) % 7
+        if first_day is None or day < first_day:
+            first_day = day
+    return first_day
@@ -6,7 +6,7 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.response import Response
 
-from . import models as m
+from . import caches
 from . import utils as u
 from .messages import Message
 
@@ -16,13 +16,13 @@ messages = Message()
 def is_open_for_admins() -> bool:
     """Returning current system state for admin users."""
 
-    return m.SystemSetting.objects.last().IsSystemOpenForAdmin
+    return caches.get_system_setting().IsSystemOpenForAdmin
 
 
 def is_open_for_personnel() -> bool:
     """Returning current system state for personnel."""
 
-    return m.SystemSetting.objects.last().IsSystemOpenForPersonnel
+    return caches.get_system_setting().IsSystemOpenForPersonnel
 
 
 def check(what_to_check: list[Callable]):
@@ -80,6 +80,9 @@ def authenticate(privileged_users: bool = False):
     If the `privileged_users` is set, will also check the personnel's role
         in database via `IsAdmin` field.
 
+    Users are looked up through `caches.auth_cache`, so on the hot path
+    no query is sent to the database.
+
     Args:
         privileged_users (bool): Does this view requires admin privilege.
     """
@@ -94,11 +97,7 @@ def authenticate(privileged_users: bool = False):
             if not token:
                 return HttpResponseRedirect(redirect_to=gateway_url)
 
-            user = m.User.objects.filter(
-                Token=token,
-                IsActive=True,
-                ExpiredAt__gte=now.strftime("%Y/%m/%d"),
-            ).first()
+            user = caches.get_user_by_token(token, now.strftime("%Y/%m/%d"))
             if not user:
                 return HttpResponseRedirect(redirect_to=gateway_url)
 
@@ -125,10 +124,12 @@ def authenticate(privileged_users: bool = False):
                     "You are not authorized to access this feature"
                     " cutie ;)."
                 )
-            
-            override_user = m.User.objects.filter(
-                Personnel=override_username
-            ).first()
+
+            override_user = (
+                caches.get_user_by_personnel(override_username)
+                if override_username
+                else None
+            )
             return view(request, user, override_user, *args, **kwargs)
 
         return wrapper
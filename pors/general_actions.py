@@ -1,9 +1,14 @@
-import jdatetime
-from persiantools.jdatetime import JalaliDate
+from typing import Optional
 
-from .models import Holiday
-from .serializers import GeneralCalendarSerializer, HolidaySerializer
-from .utils import first_and_last_day_date, get_weekend_holidays, split_dates
+from . import queries
+from .caches import calendar_cache, get_month_holidays, get_month_metadata
+from .models import date_ordinal
+from .serializers import (
+    GeneralCalendarSerializer,
+    OrderSerializer,
+    PersonnelMenuItemSerializer,
+)
+from .utils import TUPLE_ROWS, first_and_last_day_date, split_dates
 
 
 class GeneralCalendar:
@@ -11,66 +16,180 @@ class GeneralCalendar:
     This class is responsible for generating general calendar
     for both admin and non admin users.
 
+    The metadata of the month and its holidays are memoized in `caches`,
+    so rendering the calendar needs no query on the hot path.
+
     Args:
         year: Requested year.
         month: Requested month.
+        holidays: Holiday dates of the month, if not provided they will
+            get read from `caches.get_month_holidays`.
     """
 
-    def __init__(self, year: int, month: int) -> None:
+    def __init__(
+        self, year: int, month: int, holidays: Optional[list[str]] = None
+    ) -> None:
         self.year = year
         self.month = month
+        self.holidays = holidays
 
     def get_calendar(self):
         """
         Returning the general calendar serilized data.
         """
 
+        metadata = get_month_metadata(self.year, self.month)
         return GeneralCalendarSerializer(
             data={
                 "year": self.year,
                 "month": self.month,
-                "firstDayOfWeek": self._get_first_day_of_week(),
-                "lastDayOfMonth": self._get_last_day_of_month(),
-                "holidays": self._get_holidays(),
+                # increasing by 1 since the value starts from 0
+                "firstDayOfWeek": metadata.first_weekday + 1,
+                "lastDayOfMonth": metadata.length,
+                "holidays": metadata.weekend_days | self._get_holidays(),
             }
         ).initial_data
 
-    def _get_last_day_of_month(self) -> int:
-        last_day = JalaliDate.days_in_month(self.month, self.year)
-        return last_day
+    def _get_holidays(self) -> frozenset[int]:
+        """Returning the days of the month which are defined as holiday."""
+
+        if self.holidays is None:
+            return get_month_holidays(self.year, self.month)
+        return frozenset(split_dates(list(self.holidays), mode="day"))
+
+
+class PersonnelCalendar:
+    """
+    This class is responsible for generating a personnel's calendar.
+
+    The month related part (general calendar, days with menu and menu
+    items) is the same for every personnel, so it is fetched with a single
+    query and kept in `caches.calendar_cache`. The open/closed flags of the
+    menu items are calculated on each request based on the current time.
+
+    So on the hot path only the personnel's orders (with their bills) are
+    queried, the deadlines are read from `caches.deadline_cache`.
+
+    Args:
+        year: Requested year.
+        month: Requested month.
+        personnel: The personnel which the calendar belongs to.
+        bypass_date_limitations: If set, all days are open for actions
+            (admins accessing another personnel's panel).
+    """
+
+    def __init__(
+        self,
+        year: int,
+        month: int,
+        personnel: str,
+        bypass_date_limitations: bool = False,
+    ) -> None:
+        self.year = year
+        self.month = month
+        self.personnel = personnel
+        self.bypass_date_limitations = bypass_date_limitations
+        self.first_day, self.last_day = first_and_last_day_date(month, year)
+        self.days = (date_ordinal(self.first_day), date_ordinal(self.last_day))
+
+    def get_calendar(self) -> dict:
+        """
+        Returning the calendar data, compatible with
+        `schemas/personnel-calendar.json`.
+        """
+
+        month_data = self._get_month_data()
+        ordered_days, total_debt, order_items = self._get_orders()
 
-    def _get_first_day_of_week(self) -> int:
-        first_day_week_num = jdatetime.datetime(
-            self.year, self.month, 1
-        ).weekday()
+        menu_items_data = PersonnelMenuItemSerializer(
+            month_data["menuItems"],
+            context={"bypass_date_limitations": self.bypass_date_limitations},
+        ).data
 
-        # increasing by 1 since the value starts from 0
-        return first_day_week_num + 1
+        return {
+            **month_data["calendar"],
+            "daysWithMenu": month_data["daysWithMenu"],
+            **menu_items_data,
+            "orderedDays": ordered_days,
+            "totalDebt": total_debt,
+            **OrderSerializer(order_items).data,
+        }
 
-    def _get_first_and_last_day_of_month(self) -> tuple[int, int]:
-        first_day_date, last_day_date = first_and_last_day_date(
-            self.month, self.year
+    def _get_month_data(self) -> dict:
+        """
+        Returning the shared data of the month from cache, or building
+        it if it's not cached.
+
+        Warnings:
+            The returned data is shared between requests, DO NOT mutate it.
+        """
+
+        key = ("month", self.year, self.month)
+        month_data = calendar_cache.get(key)
+        if month_data is None:
+            days_with_menu, menu_items, holidays = self._get_month_menu()
+            month_data = {
+                "calendar": GeneralCalendar(
+                    self.year, self.month, holidays
+                ).get_calendar(),
+                "daysWithMenu": split_dates(days_with_menu, mode="day"),
+                "menuItems": menu_items,
+            }
+            calendar_cache.set(key, month_data)
+
+        return month_data
+
+    def _get_month_menu(self) -> tuple[list[str], list[dict], list[str]]:
+        """
+        Fetching the month's menu and holidays with a single query.
+
+        Returns:
+            Sorted unique days which have menu (active or not), active menu
+            items and the holidays of the month.
+        """
+
+        rows = queries.registry["PersonnelCalendarMenu"].execute(
+            (*self.days, *self.days), mode=TUPLE_ROWS
         )
-        return first_day_date, last_day_date
 
-    def _get_holidays(self):
+        days_with_menu = []
+        menu_items = []
+        holidays = []
+        for row in rows:
+            if row.Kind == "HOLIDAY":
+                holidays.append(row.Date)
+                continue
+
+            if not days_with_menu or days_with_menu[-1] != row.Date:
+                days_with_menu.append(row.Date)
+            if row.IsActive:
+                menu_items.append(
+                    {"AvailableDate": row.Date, "Item_id": row.Item}
+                )
+
+        return days_with_menu, menu_items, holidays
+
+    def _get_orders(self) -> tuple[list[int], int, list[dict]]:
         """
-        Fetching holidays from database,
-        Then calculating weekend holidays and packing them into unique list.
+        Fetching personnel's ordered items joined with their orders.
+
+        Returns:
+            Ordered days (one per order), total debt of the orders and the
+            ordered items.
         """
 
-        first_day, last_day = self._get_first_and_last_day_of_month()
-        weekend_holidays = get_weekend_holidays(self.year, self.month)
-        holidays = Holiday.objects.filter(
-            HolidayDate__range=(first_day, last_day)
-        ).order_by("HolidayDate")
-        holidays_serializer = HolidaySerializer(holidays).data
-
-        # Unpacking dict into list
-        listed_holidays_serializer: list = holidays_serializer["holidays"]
-        listed_holidays_serializer += weekend_holidays
-        listed_holidays_serializer.sort()
-        splited_holidays = split_dates(listed_holidays_serializer, mode="day")
-
-        # Making it a set due to removing duplicate.
-        return set(splited_holidays)
+        order_items = queries.registry["PersonnelOrderWithBill"].execute(
+            (*self.days, self.personnel)
+        )
+
+        ordered_days = []
+        total_debt = 0
+        seen_orders = set()
+        for row in order_items:
+            if row["OrderId"] in seen_orders:
+                continue
+            seen_orders.add(row["OrderId"])
+            ordered_days.append(split_dates(row["DeliveryDate"], mode="day"))
+            total_debt += row["PersonnelDebt"]
+
+        return ordered_days, total_debt, order_items
@@ -0,0 +1,161 @@
+"""Buffered writer of the ActionLog records.
+
+By default (PORS_ACTION_LOG_MODE = "sync") every log is inserted right away
+in the request which caused it. In the "buffered" mode the records are
+queued in memory and a background thread inserts them with `bulk_create`
+whenever `ACTION_LOG_BUFFER_SIZE` records are queued or
+`ACTION_LOG_FLUSH_INTERVAL` seconds are passed, and once more when the
+process exits.
+
+Notes:
+    The buffered mode trades durability for latency: the queued records of
+    a process which gets killed (not stopped) are lost, and so are the
+    oldest records beyond `ACTION_LOG_MAX_QUEUED` while the database is
+    unavailable.
+"""
+
+import atexit
+import logging
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+SYNC = "sync"
+BUFFERED = "buffered"
+
+# Number of queued records which triggers a flush.
+ACTION_LOG_BUFFER_SIZE = 100
+
+# Maximum seconds that a record stays in the queue.
+ACTION_LOG_FLUSH_INTERVAL = 2
+
+# Maximum number of queued records, failed flushes keep their records for
+# the next flush up to this number, the oldest ones are dropped after that.
+ACTION_LOG_MAX_QUEUED = 10_000
+
+
+def get_mode() -> str:
+    return getattr(settings, "PORS_ACTION_LOG_MODE", SYNC)
+
+
+class ActionLogBuffer:
+    """
+    Thread safe queue of unsaved log records, which are inserted in bulk by
+    `flush`. If inserting fails, the records are kept for the next flush,
+    up to `max_queued` records.
+
+    Args:
+        max_size: Number of queued records which wakes the writer thread up.
+        flush_interval: Seconds between two flushes of the writer thread.
+        max_queued: Maximum number of queued records, see
+            `ACTION_LOG_MAX_QUEUED`.
+    """
+
+    def __init__(
+        self,
+        max_size: int = ACTION_LOG_BUFFER_SIZE,
+        flush_interval: float = ACTION_LOG_FLUSH_INTERVAL,
+        max_queued: int = ACTION_LOG_MAX_QUEUED,
+    ) -> None:
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self._records = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def add(self, record) -> None:
+        with self._lock:
+            self._records.append(record)
+            dropped = self._drop_overflow()
+            is_full = len(self._records) >= self.max_size
+        if dropped:
+            logger.error("Dropped %s queued action logs.", dropped)
+        if is_full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Inserting the queued records, returns the number of them."""
+
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return 0
+
+        try:
+            type(records[0])._base_manager.bulk_create(
+                records, batch_size=self.max_size
+            )
+        except Exception:
+            logger.exception("Flushing %s action logs failed.", len(records))
+            with self._lock:
+                self._records[:0] = records
+                dropped = self._drop_overflow()
+            if dropped:
+                logger.error("Dropped %s queued action logs.", dropped)
+            return 0
+        return len(records)
+
+    def _drop_overflow(self) -> int:
+        """Dropping the oldest records beyond `max_queued`, with the lock."""
+
+        overflow = len(self._records) - self.max_queued
+        if overflow <= 0:
+            return 0
+        del self._records[:overflow]
+        return overflow
+
+    def start(self) -> None:
+        """Starting the writer thread, if it is not running already."""
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="action-log-writer", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Stopping the writer thread and flushing the remaining records."""
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 5)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                # Also after a failed flush, so a broken connection is
+                # replaced for the next one.
+                close_old_connections()
+
+
+buffer = ActionLogBuffer()
+
+
+def enqueue(record, using: str) -> None:
+    """
+    Queuing the unsaved `record` in the buffer, once the current transaction
+    (if any) is committed. So the log of a rolled back action is dropped,
+    the same way it would be in the sync mode.
+    """
+
+    buffer.start()
+    transaction.on_commit(lambda: buffer.add(record), using=using)
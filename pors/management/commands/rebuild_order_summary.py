@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pors import business as b
+from pors import models as m
+
+SUMMARY_FIELDS = (
+    "HasPrimary",
+    "DeliveryBuilding",
+    "DeliveryFloor",
+    "TotalPrice",
+    "SubsidyCap",
+    "PersonnelDebt",
+    "SubsidySpent",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilding the OrderSummary table from the OrderItem table, or"
+        " verifying that they are in sync (--verify)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report the out of sync summaries, change nothing.",
+        )
+        parser.add_argument(
+            "--from-date", help="First delivery date, e.g. 1403/01/01."
+        )
+        parser.add_argument(
+            "--until-date", help="Last delivery date, e.g. 1403/12/29."
+        )
+
+    def handle(self, *args, **options):
+        order_items = m.OrderItem.objects.all()
+        summaries = m.OrderSummary.objects.all()
+        if options["from_date"]:
+            day = m.date_ordinal(options["from_date"])
+            order_items = order_items.filter(DeliveryDateOrdinal__gte=day)
+            summaries = summaries.filter(DeliveryDateOrdinal__gte=day)
+        if options["until_date"]:
+            day = m.date_ordinal(options["until_date"])
+            order_items = order_items.filter(DeliveryDateOrdinal__lte=day)
+            summaries = summaries.filter(DeliveryDateOrdinal__lte=day)
+
+        expected = b.calculate_order_summaries(order_items)
+
+        if options["verify"]:
+            self.verify(expected, summaries)
+            return
+
+        with transaction.atomic():
+            summaries.delete()
+            m.OrderSummary.objects.bulk_create(
+                expected.values(), batch_size=500
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(expected)} order summaries rebuilt.")
+        )
+
+    def verify(self, expected: dict, summaries):
+        mismatches = 0
+        for summary in summaries.iterator():
+            key = (summary.Personnel, summary.DeliveryDate, summary.MealType)
+            expected_summary = expected.pop(key, None)
+            if expected_summary is None:
+                mismatches += 1
+                self.stdout.write(f"{key}: has no order item.")
+                continue
+
+            for field in SUMMARY_FIELDS:
+                value = getattr(summary, field)
+                expected_value = getattr(expected_summary, field)
+                if value != expected_value:
+                    mismatches += 1
+                    self.stdout.write(
+                        f"{key}: {field} is {value!r}, expected"
+                        f" {expected_value!r}."
+                    )
+
+        for key in expected:
+            mismatches += 1
+            self.stdout.write(f"{key}: summary is missing.")
+
+        if mismatches:
+            raise CommandError(
+                f"{mismatches} mismatch(es) found, run the command without"
+                " --verify to rebuild the summaries."
+            )
+
+        self.stdout.write(self.style.SUCCESS("Order summaries are in sync."))
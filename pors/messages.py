@@ -16,10 +16,14 @@ class Message:
             return Response ({"data":date, "messages":m.messages()})
         ```
 
+    The messages are kept on the request itself (not on the instance), so
+    they are released along with the request, even if messages() is never
+    called, and the instances can be shared between threads.
+
     Warnings:
 
-        * BE CAREFUL THAT AFTER CALLING THE messages() METHOD THE _messages
-        ATTR GET FLUSHED.
+        * BE CAREFUL THAT AFTER CALLING THE messages() METHOD THE MESSAGES
+        OF THE REQUEST GET FLUSHED.
         * use messages() only in return statements
     """
 
@@ -36,23 +40,21 @@ class Message:
     DT_LONG = "DISPLAY_TIME_LONG"
     DT_PARAMENT = "DISPLAY_TIME_PARAMENT"
 
-    def __init__(self):
-        self._messages: dict[object, list[dict[str, str]]] = dict()
+    # Attribute of the request which holds its messages.
+    REQUEST_ATTR = "_pors_messages"
 
     def add_message(
         self, request, message: str, level=INFO, display_duration=DT_SHORT
     ):
 
-        if request not in self._messages:
-            self._messages[request] = []
+        if self.REQUEST_ATTR not in vars(request):
+            setattr(request, self.REQUEST_ATTR, [])
 
-        self._messages[request].append({
+        getattr(request, self.REQUEST_ATTR).append({
             "level": level,
             "message": message,
             "displayDuration": display_duration,
         })
 
-    def messages(self, request):
-        temp = self._messages[request]
-        del self._messages[request]
-        return temp
+    def messages(self, request) -> list[dict[str, str]]:
+        return vars(request).pop(self.REQUEST_ATTR, [])
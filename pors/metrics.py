@@ -0,0 +1,210 @@
+"""Request metrics of the system, in the Prometheus text format.
+
+`middleware.InstrumentationMiddleware` records the latency, the number and
+time of the database queries and the response size of every request,
+keyed by the name of its url (`pors:calendar`, etc.). `render` returns
+them, along with the counters of the raw queries (`queries.registry`) and
+the caches (`caches`), for the admin-only metrics view.
+
+Notes:
+    The metrics are per process (per IIS/WSGI worker), like the caches,
+    so every scrape shows the numbers of the worker which served it.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Iterable, Optional
+
+from . import caches, queries
+
+# Upper bounds of the histograms' buckets, the last (+Inf) is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Name of the requests which do not match any url.
+UNMATCHED_VIEW = "unmatched"
+
+
+class Histogram:
+    """
+    Counts of the observed values per bucket, and their sum.
+
+    Args:
+        buckets: Sorted upper bounds (inclusive) of the buckets.
+    """
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        """Yielding the cumulative buckets, sum and count of the metric."""
+
+        total = 0
+        bounds = [*self.buckets, "+Inf"]
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {total}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {total}"
+
+
+class ViewMetrics:
+    """Metrics of the requests of a view."""
+
+    def __init__(self) -> None:
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_time = 0.0
+        self.response_size = Histogram(RESPONSE_SIZE_BUCKETS)
+
+
+class MetricsRegistry:
+    """The metrics of the views of this process, keyed by their names."""
+
+    def __init__(self) -> None:
+        self._views: dict[str, ViewMetrics] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        view: str,
+        latency: float,
+        queries_count: int,
+        query_time: float,
+        response_size: Optional[int],
+    ) -> None:
+        """
+        Recording a request of the `view`, the size of the streaming
+        responses is unknown (None) and is not recorded.
+        """
+
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics()
+            metrics.latency.observe(latency)
+            metrics.queries.observe(queries_count)
+            metrics.query_time += query_time
+            if response_size is not None:
+                metrics.response_size.observe(response_size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._views.clear()
+
+    def render(self) -> str:
+        """Returning every metric of the process in the text format."""
+
+        with self._lock:
+            lines = list(self._view_lines())
+        lines.extend(_query_lines())
+        lines.extend(_cache_lines())
+        return "\n".join(lines) + "\n"
+
+    def _view_lines(self) -> Iterable[str]:
+        views = sorted(self._views.items())
+        yield from _histogram_lines(
+            "pors_request_duration_seconds",
+            "Latency of the requests.",
+            ((view, metrics.latency) for view, metrics in views),
+        )
+        yield from _histogram_lines(
+            "pors_request_queries",
+            "Number of the database queries per request.",
+            ((view, metrics.queries) for view, metrics in views),
+        )
+        yield from _sample_lines(
+            "pors_request_query_seconds_total",
+            "Time spent on the database queries of the requests.",
+            (
+                (_labels(view=view), metrics.query_time)
+                for view, metrics in views
+            ),
+        )
+        yield from _histogram_lines(
+            "pors_response_size_bytes",
+            "Size of the (non streaming) responses.",
+            ((view, metrics.response_size) for view, metrics in views),
+        )
+
+
+def _histogram_lines(
+    name: str, description: str, histograms
+) -> Iterable[str]:
+    yield f"# HELP {name} {description}"
+    yield f"# TYPE {name} histogram"
+    for view, histogram in histograms:
+        yield from histogram.samples(name, _labels(view=view))
+
+
+def _sample_lines(
+    name: str, description: str, samples, kind: str = "counter"
+) -> Iterable[str]:
+    yield f"# HELP {name} {description}"
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples:
+        yield f"{name}{{{labels}}} {value}"
+
+
+def _query_lines() -> Iterable[str]:
+    stats = sorted(queries.registry.stats().items())
+    for key, name, description in (
+        ("calls", "pors_raw_query_calls_total", "Executions of the query."),
+        ("rows", "pors_raw_query_rows_total", "Rows fetched by the query."),
+        (
+            "total_time",
+            "pors_raw_query_seconds_total",
+            "Time spent on the query.",
+        ),
+    ):
+        yield from _sample_lines(
+            name,
+            description,
+            ((_labels(query=query), stat[key]) for query, stat in stats),
+        )
+
+
+def _cache_lines() -> Iterable[str]:
+    stats = sorted(
+        (name.removesuffix("_cache"), cache.stats())
+        for name, cache in vars(caches).items()
+        if isinstance(cache, caches.TTLCache)
+    )
+    for key, name, description, kind in (
+        ("hits", "pors_cache_hits_total", "Hits of the cache.", "counter"),
+        (
+            "misses",
+            "pors_cache_misses_total",
+            "Misses of the cache.",
+            "counter",
+        ),
+        ("size", "pors_cache_entries", "Entries of the cache.", "gauge"),
+    ):
+        yield from _sample_lines(
+            name,
+            description,
+            ((_labels(cache=cache), stat[key]) for cache, stat in stats),
+            kind,
+        )
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(
+        f'{key}="{_escape(value)}"' for key, value in labels.items()
+    )
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+
+registry = MetricsRegistry()
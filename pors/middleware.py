@@ -0,0 +1,68 @@
+"""Middlewares of the system."""
+
+import time
+
+from django.db import connection
+
+from . import metrics
+
+
+class QueryCounter:
+    """
+    Execute wrapper of the database connection (see
+    `connection.execute_wrapper`), counts the queries and their time.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started_at
+
+
+class InstrumentationMiddleware:
+    """
+    Recording the latency, the database queries and the response size of
+    every request into `metrics.registry`, keyed by the url name.
+
+    It only costs a few additions per request and per query, so it is
+    meant to be left on in production.
+
+    Notes:
+        The latency of the streaming responses (reports) covers building
+        the response, not sending its content.
+    """
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        latency = time.perf_counter() - started_at
+
+        match = request.resolver_match
+        metrics.registry.observe(
+            match.view_name if match else metrics.UNMATCHED_VIEW,
+            latency,
+            counter.count,
+            counter.time,
+            _response_size(response),
+        )
+        return response
+
+
+def _response_size(response):
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    if response.streaming:
+        return None
+    return len(response.content)
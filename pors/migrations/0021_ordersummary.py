@@ -0,0 +1,96 @@
+# Generated by Django 4.2 on 2026-10-18 06:42
+
+from django.db import migrations, models
+
+
+def populate_order_summary(apps, schema_editor):
+    """Building the summaries of the existing order items."""
+
+    OrderItem = apps.get_model("pors", "OrderItem")
+    OrderSummary = apps.get_model("pors", "OrderSummary")
+    Subsidy = apps.get_model("pors", "Subsidy")
+
+    subsidies = list(
+        Subsidy.objects.values_list("FromDate", "UntilDate", "Amount")
+    )
+
+    def subsidy_amount(date):
+        for from_date, until_date, amount in subsidies:
+            if from_date <= date <= (until_date or "1499/12/12"):
+                return amount
+        return 0
+
+    summaries = {}
+    order_items = OrderItem.objects.order_by("id").values_list(
+        "Personnel",
+        "DeliveryDate",
+        "Item__MealType",
+        "Item__Category__IsPrimary",
+        "Quantity",
+        "PricePerOne",
+        "DeliveryBuilding",
+        "DeliveryFloor",
+    )
+    for (
+        personnel,
+        date,
+        meal_type,
+        is_primary,
+        quantity,
+        price,
+        building,
+        floor,
+    ) in order_items.iterator():
+        key = (personnel, date, meal_type)
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = OrderSummary(
+                Personnel=personnel, DeliveryDate=date, MealType=meal_type
+            )
+        summary.HasPrimary = summary.HasPrimary or is_primary
+        summary.TotalPrice += quantity * price
+        summary.DeliveryBuilding = building
+        summary.DeliveryFloor = floor
+
+    for summary in summaries.values():
+        amount = subsidy_amount(summary.DeliveryDate)
+        summary.SubsidyCap = amount
+        summary.PersonnelDebt = max(summary.TotalPrice - amount, 0)
+        summary.SubsidySpent = min(summary.TotalPrice, amount)
+
+    OrderSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pors', '0020_alter_adminmanipulationreason_title'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('Personnel', models.CharField(max_length=250)),
+                ('DeliveryDate', models.CharField(max_length=10)),
+                ('MealType', models.CharField(choices=[('BRF', 'صبحانه'), ('LNC', 'ناهار')], max_length=3)),
+                ('HasPrimary', models.BooleanField(default=False)),
+                ('DeliveryBuilding', models.CharField(max_length=250)),
+                ('DeliveryFloor', models.CharField(max_length=250)),
+                ('TotalPrice', models.PositiveIntegerField(default=0)),
+                ('SubsidyCap', models.PositiveIntegerField(default=0)),
+                ('PersonnelDebt', models.PositiveIntegerField(default=0)),
+                ('SubsidySpent', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ordersummary',
+            index=models.Index(fields=['DeliveryDate'], name='ordersummary_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ordersummary',
+            constraint=models.UniqueConstraint(fields=('Personnel', 'DeliveryDate', 'MealType'), name='unique_personnel_date_mealtype'),
+        ),
+        migrations.RunPython(populate_order_summary, migrations.RunPython.noop),
+    ]
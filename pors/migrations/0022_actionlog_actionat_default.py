@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 06:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pors', '0021_ordersummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='actionlog',
+            name='ActionAt',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,131 @@
+# Generated by Django 4.2 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+import pors.models
+
+# (model, shamsi date field, ordinal field)
+ORDINAL_FIELDS = [
+    ("DailyMenuItem", "AvailableDate", "AvailableDateOrdinal"),
+    ("Holiday", "HolidayDate", "HolidayDateOrdinal"),
+    ("OrderItem", "DeliveryDate", "DeliveryDateOrdinal"),
+    ("OrderSummary", "DeliveryDate", "DeliveryDateOrdinal"),
+    ("Subsidy", "FromDate", "FromDateOrdinal"),
+    ("Subsidy", "UntilDate", "UntilDateOrdinal"),
+]
+
+
+def populate_date_ordinals(apps, schema_editor):
+    """Filling the ordinals of the existing records, one update per date."""
+
+    for model_name, date_field, ordinal_field in ORDINAL_FIELDS:
+        model = apps.get_model("pors", model_name)
+        dates = (
+            model.objects.exclude(**{f"{date_field}__isnull": True})
+            .values_list(date_field, flat=True)
+            .distinct()
+        )
+        for date in list(dates):
+            model.objects.filter(**{date_field: date}).update(
+                **{ordinal_field: pors.models.date_ordinal(date)}
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pors', '0022_actionlog_actionat_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailymenuitem',
+            name='AvailableDateOrdinal',
+            field=pors.models.DateOrdinalField(null=True, source='AvailableDate'),
+        ),
+        migrations.AddField(
+            model_name='holiday',
+            name='HolidayDateOrdinal',
+            field=pors.models.DateOrdinalField(null=True, source='HolidayDate'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='DeliveryDateOrdinal',
+            field=pors.models.DateOrdinalField(null=True, source='DeliveryDate'),
+        ),
+        migrations.AddField(
+            model_name='ordersummary',
+            name='DeliveryDateOrdinal',
+            field=pors.models.DateOrdinalField(null=True, source='DeliveryDate'),
+        ),
+        migrations.AddField(
+            model_name='subsidy',
+            name='FromDateOrdinal',
+            field=pors.models.DateOrdinalField(null=True, source='FromDate'),
+        ),
+        migrations.AddField(
+            model_name='subsidy',
+            name='UntilDateOrdinal',
+            field=pors.models.DateOrdinalField(null=True, source='UntilDate'),
+        ),
+        migrations.RunPython(
+            populate_date_ordinals, migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name='dailymenuitem',
+            name='AvailableDateOrdinal',
+            field=pors.models.DateOrdinalField(source='AvailableDate'),
+        ),
+        migrations.AlterField(
+            model_name='holiday',
+            name='HolidayDateOrdinal',
+            field=pors.models.DateOrdinalField(source='HolidayDate'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='DeliveryDateOrdinal',
+            field=pors.models.DateOrdinalField(source='DeliveryDate'),
+        ),
+        migrations.AlterField(
+            model_name='ordersummary',
+            name='DeliveryDateOrdinal',
+            field=pors.models.DateOrdinalField(source='DeliveryDate'),
+        ),
+        migrations.AlterField(
+            model_name='subsidy',
+            name='FromDateOrdinal',
+            field=pors.models.DateOrdinalField(source='FromDate'),
+        ),
+        migrations.RemoveIndex(
+            model_name='ordersummary',
+            name='ordersummary_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='dailymenuitem',
+            index=models.Index(fields=['AvailableDateOrdinal', 'Item'], name='dailymenuitem_day_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='holiday',
+            index=models.Index(fields=['HolidayDateOrdinal'], name='holiday_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['Personnel', 'DeliveryDateOrdinal'], name='orderitem_personnel_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['DeliveryDateOrdinal', 'Item'], name='orderitem_day_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordersummary',
+            index=models.Index(fields=['DeliveryDateOrdinal'], name='ordersummary_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordersummary',
+            index=models.Index(fields=['Personnel', 'DeliveryDateOrdinal'], name='ordersummary_personnel_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subsidy',
+            index=models.Index(fields=['FromDateOrdinal', 'UntilDateOrdinal'], name='subsidy_days_idx'),
+        ),
+    ]
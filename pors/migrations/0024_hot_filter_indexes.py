@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pors', '0023_date_ordinals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['Token'], name='user_token_idx'),
+        ),
+    ]
@@ -12,7 +12,9 @@ used in this project, and you can find its code in /pors/SQLs
 Contracts:
 
 The date should be stored in the database as a solar(shamsi) date and with
-the Charfield data type.
+the Charfield data type. Date fields which are filtered by range also have
+a derived `DateOrdinalField` (e.g. DeliveryDateOrdinal) which must be used
+for range filters and joins instead of the string.
 
 Any change in one of the states that includes data in the database
 should be recorded in the ActionLog table.
@@ -20,12 +22,95 @@ should be recorded in the ActionLog table.
 Prices are in Toman everywhere.
 """
 
+from typing import Optional
+
+import jdatetime
 from django.db import models
 from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from . import log_writer
+
+
+def date_ordinal(date: Optional[str]) -> Optional[int]:
+    """
+    Converting a shamsi date (yyyy/mm/dd) to its day ordinal, the number of
+    days since 0001/01/01 (which is 1). Ordinals keep the order of the
+    dates, so they can be compared instead of the strings.
+    """
+
+    if date is None:
+        return None
+    year, month, day = map(int, date.split("/"))
+    return jdatetime.date(year, month, day).toordinal()
+
+
+class DateOrdinalField(models.PositiveIntegerField):
+    """
+    Day ordinal (see `date_ordinal`) of a shamsi date field of the same
+    model, which is calculated whenever the record is saved (or bulk
+    created). Queryset `update` calls do NOT update it, so never update the
+    `source` field that way.
+
+    Args:
+        source: Name of the shamsi date field.
+    """
+
+    def __init__(self, source: str, *args, **kwargs):
+        self.source = source
+        kwargs["editable"] = False
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs["editable"]
+        kwargs["source"] = self.source
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = date_ordinal(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
 
 
 class Logger(models.Model):
-    # todo doc
+    """
+    Abstract model which logs every save and delete in the ActionLog table.
+
+    The field values are captured when the record is loaded from the
+    database (or saved), so an update is diffed in memory: only the changed
+    fields are written and logged as `old_data`, and saving an unchanged
+    record is skipped entirely (no query, no log).
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields can not be diffed, so the snapshot is only taken
+        # when every field is loaded.
+        if len(values) == len(cls._meta.concrete_fields):
+            instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        if getattr(self, "_loaded_values", None) is not None:
+            self._take_snapshot()
+
+    def _take_snapshot(self):
+        self._loaded_values = {
+            f.attname: getattr(self, f.attname)
+            for f in self._meta.concrete_fields
+        }
+
+    def _changed_fields(self) -> list:
+        return [
+            f
+            for f in self._meta.concrete_fields
+            if not f.primary_key
+            and getattr(self, f.attname) != self._loaded_values[f.attname]
+        ]
+
     def save(self, *args, **kwargs):
         user = kwargs.pop("user", "SYSTEM")
         log_msg = kwargs.pop("log", None)
@@ -36,12 +121,35 @@ class Logger(models.Model):
         if self._state.adding:
             action_type = ActionLog.ActionTypeChoices.CREATE
             old_data = None
-        else:
+        elif getattr(self, "_loaded_values", None) is None:
+            # Not loaded from the database (or loaded partially).
             action_type = ActionLog.ActionTypeChoices.UPDATE
             old_instance = self.__class__.objects.get(pk=self.pk)
             old_data = model_to_dict(old_instance)
+        else:
+            action_type = ActionLog.ActionTypeChoices.UPDATE
+            changed_fields = self._changed_fields()
+            if not changed_fields:
+                return
+
+            old_data = {
+                f.name: self._loaded_values[f.attname] for f in changed_fields
+            }
+            if kwargs.get("update_fields") is None:
+                # Besides the fields which are calculated on save.
+                changed_names = {f.name for f in changed_fields}
+                kwargs["update_fields"] = [f.name for f in changed_fields] + [
+                    f.name
+                    for f in self._meta.concrete_fields
+                    if f not in changed_fields
+                    and (
+                        getattr(f, "auto_now", False)
+                        or getattr(f, "source", None) in changed_names
+                    )
+                ]
 
         super().save(*args, **kwargs)
+        self._take_snapshot()
 
         model = self._meta.model
         record_id = self.id
@@ -118,6 +226,10 @@ class User(models.Model):
                 fields=["Personnel"], name="unique_personnel"
             )
         ]
+        indexes = [
+            # Every authenticated request looks the token up.
+            models.Index(fields=["Token"], name="user_token_idx"),
+        ]
 
 
 class SystemSetting(models.Model):
@@ -164,10 +276,18 @@ class Holiday(models.Model):
     """
 
     HolidayDate = models.CharField(max_length=10)
+    HolidayDateOrdinal = DateOrdinalField("HolidayDate")
 
     def __str__(self) -> str:
         return self.HolidayDate
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["HolidayDateOrdinal"], name="holiday_day_idx"
+            ),
+        ]
+
 
 class Category(models.Model):
     """The categorization of orderable items is placed in this table. Note
@@ -216,6 +336,8 @@ class Subsidy(models.Model):
 
     FromDate = models.CharField(max_length=10)
     UntilDate = models.CharField(max_length=10, null=True)
+    FromDateOrdinal = DateOrdinalField("FromDate")
+    UntilDateOrdinal = DateOrdinalField("UntilDate", null=True)
 
     class Meta:
         constraints = [
@@ -223,6 +345,12 @@ class Subsidy(models.Model):
                 fields=["UntilDate"], name="untildate_unique"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["FromDateOrdinal", "UntilDateOrdinal"],
+                name="subsidy_days_idx",
+            ),
+        ]
 
 
 class ItemProvider(models.Model):
@@ -308,7 +436,11 @@ class Deadlines(Logger):
 
 
 class Order(models.Model):
-    """Personnel Orders View"""
+    """Personnel Orders View
+
+    The system reads orders from `OrderSummary` instead, this view is kept
+    for the database level reports.
+    """
 
     Id = models.PositiveIntegerField(primary_key=True)
     Personnel = models.CharField(max_length=250)
@@ -338,6 +470,67 @@ class Order(models.Model):
         db_table = "Order"
 
 
+class OrderSummary(models.Model):
+    """Materialized replacement of the `Order` view.
+
+    Each record summarizes the ordered items of a personnel on a date for a
+    meal type, so reading an order is an indexed point lookup instead of an
+    aggregation over the whole OrderItem table.
+
+    This table only contains derived data, it is kept up to date by
+    `business.refresh_order_summary` whenever an OrderItem changes (and by
+    the Subsidy signals). Never change its records manually, if it gets out
+    of sync use the `rebuild_order_summary` management command.
+
+    Since the OrderItem changes are already logged, changes on this table
+    are not recorded in the ActionLog table.
+    """
+
+    Personnel = models.CharField(max_length=250)
+    DeliveryDate = models.CharField(max_length=10)
+    DeliveryDateOrdinal = DateOrdinalField("DeliveryDate")
+    MealType = models.CharField(choices=MealTypeChoices.choices, max_length=3)
+    HasPrimary = models.BooleanField(default=False)
+
+    # HR ConstValue Table Code
+    DeliveryBuilding = models.CharField(max_length=250)
+    DeliveryFloor = models.CharField(max_length=250)
+
+    TotalPrice = models.PositiveIntegerField(default=0)
+    SubsidyCap = models.PositiveIntegerField(default=0)
+
+    # PersonnelDebt = TotalPrice - SubsidyCap
+    # Note that PersonnelDebt will never be negative
+    PersonnelDebt = models.PositiveIntegerField(default=0)
+
+    # The amount spent by Fanavaran
+    SubsidySpent = models.PositiveIntegerField(default=0)
+
+    def apply_subsidy(self, amount: int) -> None:
+        """Calculating the bill of the order based on the subsidy amount."""
+
+        self.SubsidyCap = amount
+        self.PersonnelDebt = max(self.TotalPrice - amount, 0)
+        self.SubsidySpent = min(self.TotalPrice, amount)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["Personnel", "DeliveryDate", "MealType"],
+                name="unique_personnel_date_mealtype",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["DeliveryDateOrdinal"], name="ordersummary_day_idx"
+            ),
+            models.Index(
+                fields=["Personnel", "DeliveryDateOrdinal"],
+                name="ordersummary_personnel_day_idx",
+            ),
+        ]
+
+
 class FoodProviderOrdering(models.Model):
     """Food Provider Ordering List View"""
 
@@ -364,6 +557,7 @@ class OrderItem(Logger):
     ModifiedAt = models.DateTimeField(auto_now=True, null=True)
     Personnel = models.CharField(max_length=250)
     DeliveryDate = models.CharField(max_length=10)
+    DeliveryDateOrdinal = DateOrdinalField("DeliveryDate")
     Item = models.ForeignKey(Item, on_delete=models.CASCADE)
     Quantity = models.PositiveSmallIntegerField(default=1)
 
@@ -382,6 +576,18 @@ class OrderItem(Logger):
                 name="unique_item_date_personnel",
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["Personnel", "DeliveryDateOrdinal"],
+                name="orderitem_personnel_day_idx",
+            ),
+            # Orders of an item (or a meal type) on a day, regardless of
+            # the personnel.
+            models.Index(
+                fields=["DeliveryDateOrdinal", "Item"],
+                name="orderitem_day_item_idx",
+            ),
+        ]
 
 
 class ItemsOrdersPerDay(models.Model):
@@ -429,6 +635,7 @@ class DailyMenuItem(Logger):
     """
 
     AvailableDate = models.CharField(max_length=10)
+    AvailableDateOrdinal = DateOrdinalField("AvailableDate")
     Item = models.ForeignKey(Item, on_delete=models.CASCADE)
     IsActive = models.BooleanField(default=True)  # todo
 
@@ -439,6 +646,12 @@ class DailyMenuItem(Logger):
                 name="unique_AvailableDate_Item",
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["AvailableDateOrdinal", "Item"],
+                name="dailymenuitem_day_item_idx",
+            ),
+        ]
 
 
 class ActionLog(models.Model):
@@ -478,7 +691,7 @@ class ActionLog(models.Model):
             comment=None,
         ):
             table_name = model._meta.model_name if model else None
-            return self.create(
+            record = self.model(
                 User=user,
                 TableName=table_name,
                 ReferencedRecordId=record_id,
@@ -489,6 +702,12 @@ class ActionLog(models.Model):
                 ManipulationReason=reason,
                 ManipulationReasonComment=comment,
             )
+            if log_writer.get_mode() == log_writer.BUFFERED:
+                # Inserted later by the log writer, see `log_writer`.
+                log_writer.enqueue(record, using=self.db)
+            else:
+                record.save(using=self.db, force_insert=True)
+            return record
 
     class ActionTypeChoices(models.TextChoices):
         CREATE = "C", "create"
@@ -496,7 +715,9 @@ class ActionLog(models.Model):
         UPDATE = "U", "update"
         DELETE = "D", "delete"
 
-    ActionAt = models.DateTimeField(auto_now_add=True)
+    # Set on creation of the record (not on insertion), so the buffered logs
+    # keep the real time of their action.
+    ActionAt = models.DateTimeField(default=timezone.now, editable=False)
 
     # If the system automatically logs an action, the user should be
     # recorded as  'SYSTEM'
@@ -0,0 +1,169 @@
+"""Registry of the raw queries of the `SQLs` directory.
+
+Every query is read and validated once, when the app gets ready (see
+`apps.PorsConfig.ready`), and is looked up by its file name (without the
+extension) afterwards:
+
+    rows = queries.registry["DayWithMenuOrderCount"].execute(params)
+
+Each query counts its executions, fetched rows and the time spent on them,
+`QueryRegistry.stats` returns them for monitoring purposes.
+
+Notes:
+    The `v_*.sql` files define the database views, they are created on the
+    database directly and are not registered here.
+"""
+
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .utils import (
+    COLUMNS,
+    DICT_ROWS,
+    execute_raw_sql_with_params,
+    iterate_raw_sql_with_params,
+)
+
+SQLS_DIR = Path(__file__).resolve().parent / "SQLs"
+
+# Prefix of the files which define database views.
+VIEW_PREFIX = "v_"
+
+
+class Query:
+    """
+    A named raw query, with its counters.
+
+    Args:
+        name: Name of the query, its file name without the extension.
+        sql: The raw query, with `%s` placeholders for its parameters.
+
+    Raises:
+        ValueError: If the query is not a single SELECT statement.
+    """
+
+    def __init__(self, name: str, sql: str) -> None:
+        sql = sql.strip()
+        if not re.match(r"(?i)(select|with)\b", sql):
+            raise ValueError(f"Query {name} is not a SELECT statement.")
+        if ";" in sql.rstrip(";"):
+            raise ValueError(f"Query {name} has more than one statement.")
+
+        self.name = name
+        self.sql = sql
+        self.params_count = sql.count("%s")
+        self.calls = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self._lock = threading.Lock()
+
+    def execute(self, params: tuple, mode: str = DICT_ROWS):
+        """
+        Executing the query, returns its rows in the `mode`, see
+        `utils.execute_raw_sql_with_params`.
+        """
+
+        self._check_params(params)
+        started_at = time.perf_counter()
+        result = execute_raw_sql_with_params(self.sql, params, mode)
+        self._count(_rows_count(result, mode), started_at, calls=1)
+        return result
+
+    def iterate(
+        self,
+        params: tuple,
+        mode: str = DICT_ROWS,
+        chunk_size: Optional[int] = None,
+    ) -> Iterator:
+        """
+        Executing the query, yields its rows in chunks, see
+        `utils.iterate_raw_sql_with_params`. Only the time spent on
+        fetching the chunks is counted.
+        """
+
+        self._check_params(params)
+        chunks = iterate_raw_sql_with_params(
+            self.sql, params, mode, chunk_size
+        )
+        calls = 1
+        while True:
+            started_at = time.perf_counter()
+            chunk = next(chunks, None)
+            rows_count = 0 if chunk is None else _rows_count(chunk, mode)
+            self._count(rows_count, started_at, calls)
+            if chunk is None:
+                return
+            calls = 0
+            yield chunk
+
+    def _check_params(self, params: tuple) -> None:
+        if len(params) != self.params_count:
+            raise ValueError(
+                f"Query {self.name} takes {self.params_count} parameters,"
+                f" {len(params)} were given."
+            )
+
+    def _count(self, rows: int, started_at: float, calls: int) -> None:
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.calls += calls
+            self.rows += rows
+            self.total_time += elapsed
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "total_time": self.total_time,
+        }
+
+
+def _rows_count(result, mode: str) -> int:
+    if mode == COLUMNS:
+        return len(next(iter(result.values()), []))
+    return len(result)
+
+
+class QueryRegistry:
+    """
+    The queries of a directory, keyed by their names.
+
+    Args:
+        directory: Where the `.sql` files are, `SQLS_DIR` by default.
+    """
+
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = directory or SQLS_DIR
+        self._queries: dict[str, Query] = {}
+
+    def load(self) -> None:
+        """Reading and validating every query of the directory."""
+
+        queries = {}
+        for path in sorted(self.directory.glob("*.sql")):
+            if path.name.startswith(VIEW_PREFIX):
+                continue
+            queries[path.stem] = Query(
+                path.stem, path.read_text(encoding="utf-8")
+            )
+        self._queries = queries
+
+    def __getitem__(self, name: str) -> Query:
+        try:
+            return self._queries[name]
+        except KeyError:
+            raise KeyError(
+                f"Query {name} is not registered, is the app ready?"
+            ) from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._queries
+
+    def stats(self) -> dict[str, dict]:
+        return {name: query.stats() for name, query in self._queries.items()}
+
+
+registry = QueryRegistry()
@@ -0,0 +1,166 @@
+"""On disk cache of the generated reports.
+
+Reports of the past dates do not change (orders are closed after their
+deadline), so they are kept in the cache directory of PORS_REPORTS_DIR,
+keyed by the report and its parameters.
+
+When an order changes anyway (e.g. by an admin override), the month of its
+date is marked as invalidated, and every cached report of that month which
+is older than the mark is ignored from then on. Marks are used instead of
+deleting the reports, since a report can be open (being downloaded) at the
+same time. Since the cache lives on the disk, an invalidation is seen by
+every worker process right away.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from hashlib import sha256
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from django.conf import settings
+
+from . import utils as u
+
+# Seconds that a cached report is kept, even if it's still valid.
+REPORT_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Mark of the invalidations which are not limited to a date range.
+ALL_MONTHS = "all"
+
+
+def get_directory() -> Path:
+    directory = Path(settings.PORS_REPORTS_DIR) / "cache"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def _entry_path(report: str, params: dict, extension: str) -> Path:
+    key = sha256(
+        json.dumps([report, params], sort_keys=True).encode()
+    ).hexdigest()
+    return get_directory() / f"{report}-{key}.{extension}"
+
+
+def _mark_path(month: str) -> Path:
+    return get_directory() / f"invalidated-{month}"
+
+
+def _months(from_date: str, until_date: str) -> list[str]:
+    """Months between the dates (inclusive), in yyyymm format."""
+
+    year, month = map(int, from_date.split("/")[:2])
+    until_year, until_month = map(int, until_date.split("/")[:2])
+    months = []
+    while (year, month) <= (until_year, until_month):
+        months.append(f"{year:04}{month:02}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _invalidated_at(dates: tuple[str, str]) -> float:
+    """The last time that any of the dates was invalidated."""
+
+    invalidated_at = 0.0
+    for month in [ALL_MONTHS, *_months(*dates)]:
+        try:
+            mtime = _mark_path(month).stat().st_mtime
+        except FileNotFoundError:
+            continue
+        invalidated_at = max(invalidated_at, mtime)
+    return invalidated_at
+
+
+def is_cacheable(dates: tuple[str, str]) -> bool:
+    """Only the reports which their dates are passed can be cached."""
+
+    return dates[1] < u.get_str(u.localnow().date())
+
+
+def open_cached(
+    report: str, params: dict, dates: tuple[str, str], extension: str
+) -> Optional[BinaryIO]:
+    """
+    Opening the cached report, None if it's not cached or it's not valid
+    anymore.
+
+    Args:
+        report: Name of the report.
+        params: Parameters of the report.
+        dates: First and last date which the report covers.
+        extension: Extension of the report's file.
+    """
+
+    path = _entry_path(report, params, extension)
+    try:
+        cached_at = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    if (
+        cached_at < time.time() - REPORT_CACHE_TTL
+        or cached_at <= _invalidated_at(dates)
+    ):
+        return None
+    return open(path, "rb")
+
+
+def store(
+    report: str,
+    params: dict,
+    dates: tuple[str, str],
+    extension: str,
+    output: BinaryIO,
+    started_at: float,
+) -> None:
+    """
+    Caching the generated report (`output`), if its dates are passed. The
+    position of the `output` is not preserved.
+
+    Args:
+        started_at: When the generation of the report was started, the
+            report is not cached if its dates are invalidated since then.
+        Others are the same as `open_cached`.
+    """
+
+    if not is_cacheable(dates) or _invalidated_at(dates) >= started_at:
+        return
+
+    output.seek(0)
+    path = _entry_path(report, params, extension)
+    # Replaced at once, so readers never see a half written report.
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+        shutil.copyfileobj(output, tmp)
+    try:
+        os.replace(tmp.name, path)
+    except OSError:
+        # The old report is open by another request (on Windows).
+        os.unlink(tmp.name)
+
+    _purge_expired()
+
+
+def invalidate(from_date: str, until_date: Optional[str] = None) -> None:
+    """
+    Invalidating the cached reports which cover any date between
+    `from_date` and `until_date` (inclusive, every date after the
+    `from_date` if it's None).
+    """
+
+    months = _months(from_date, until_date) if until_date else [ALL_MONTHS]
+    for month in months:
+        _mark_path(month).touch()
+
+
+def _purge_expired() -> None:
+    expired_at = time.time() - REPORT_CACHE_TTL
+    for path in get_directory().iterdir():
+        try:
+            if path.stat().st_mtime < expired_at:
+                path.unlink()
+        except OSError:
+            # Deleted by another process in the meantime, or it's open.
+            continue
@@ -0,0 +1,303 @@
+"""Background generation of the administrative reports.
+
+A job is queued by `ReportJobQueue.submit` and built by a local thread pool
+into the reports directory (PORS_REPORTS_DIR). The state of each job is
+kept in a json file next to its report, so every worker process can serve
+the status and the download of a job, no matter which process built it.
+
+Notes:
+    Identical requests (of the same user) are only deduplicated inside the
+    same process.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import models as m
+from . import reports as r
+
+logger = logging.getLogger(__name__)
+
+# Number of reports which are generated at the same time, per process.
+REPORT_JOB_WORKERS = 2
+
+# Seconds that an identical request (same user, report and parameters)
+# gets the already queued job, instead of a new one.
+REPORT_JOB_DEDUP_WINDOW = 60
+
+# Seconds that the state of a pending or running job can stay untouched,
+# after that its worker is considered dead (e.g. the process was recycled)
+# and the job failed. Running jobs touch their state every third of it.
+REPORT_JOB_TIMEOUT = 30 * 60
+
+# Seconds that the generated reports are kept on the disk.
+REPORT_JOB_RETENTION = 60 * 60
+
+
+class ReportJob:
+    """
+    A report which is (being) generated in the background.
+
+    Attributes:
+        id: Unique id (uuid4) of the job.
+        report: Name of the report, one of `reports.REPORTS`.
+        params: Validated parameters of the report.
+        user: The personnel who requested the report.
+        status: One of PENDING, RUNNING, DONE, EMPTY (no rows) and FAILED.
+        error: The error message of a failed job.
+        created_at: Unix timestamp of the job's creation.
+        path: Path of the generated report.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    EMPTY = "empty"
+    FAILED = "failed"
+
+    def __init__(
+        self,
+        id: str,
+        report: str,
+        params: dict,
+        user: str,
+        directory: Path,
+        status: str = PENDING,
+        error: Optional[str] = None,
+        created_at: float = 0,
+    ) -> None:
+        self.id = id
+        self.report = report
+        self.params = params
+        self.user = user
+        self.status = status
+        self.error = error
+        self.created_at = created_at
+        self.path = directory / f"{id}.{self.extension}"
+        self.state_path = directory / f"{id}.json"
+
+    @property
+    def extension(self) -> str:
+        return r.REPORTS[self.report].extension
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "report": self.report,
+            "params": self.params,
+            "user": self.user,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+        }
+
+    def save(self) -> None:
+        # Replaced at once, so readers never see a half written state.
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.to_dict()))
+        os.replace(tmp_path, self.state_path)
+
+
+class ReportJobQueue:
+    """
+    Queue of the report jobs of this process.
+
+    Args:
+        directory: Where the reports are generated, PORS_REPORTS_DIR by
+            default.
+        max_workers: Number of reports which are generated at the same time.
+        dedup_window: See `REPORT_JOB_DEDUP_WINDOW`.
+        timeout: See `REPORT_JOB_TIMEOUT`.
+        retention: See `REPORT_JOB_RETENTION`.
+        executor: The pool which runs the jobs, a thread pool by default.
+        timer: Clock of the queue, replaceable for testing purposes.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        max_workers: int = REPORT_JOB_WORKERS,
+        dedup_window: float = REPORT_JOB_DEDUP_WINDOW,
+        timeout: float = REPORT_JOB_TIMEOUT,
+        retention: float = REPORT_JOB_RETENTION,
+        executor=None,
+        timer=time.time,
+    ) -> None:
+        self._directory = directory
+        self.max_workers = max_workers
+        self.dedup_window = dedup_window
+        self.timeout = timeout
+        self.retention = retention
+        self._executor = executor
+        self._timer = timer
+        self._recent_jobs: dict[tuple[str, str, str], ReportJob] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> Path:
+        directory = Path(self._directory or settings.PORS_REPORTS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def submit(self, report: str, params: dict, user: str) -> ReportJob:
+        """
+        Queuing the `report` with its validated `params`, or returning the
+        job of an identical request of the `user` in the dedup window.
+        """
+
+        key = (user, report, json.dumps(params, sort_keys=True))
+        now = self._timer()
+        with self._lock:
+            self._purge(now)
+
+            job = self._recent_jobs.get(key)
+            if (
+                job is not None
+                and job.status != ReportJob.FAILED
+                and now - job.created_at < self.dedup_window
+            ):
+                return job
+
+            job = ReportJob(
+                str(uuid.uuid4()),
+                report,
+                params,
+                user,
+                self.directory,
+                created_at=now,
+            )
+            job.save()
+            self._recent_jobs[key] = job
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="report-job"
+                )
+
+        self._executor.submit(self._run_in_worker, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        """
+        Loading the job from the disk, None if it does not exist. A pending
+        or running job which its state has not been touched for the
+        `timeout` is marked as failed, since its worker has died.
+        """
+
+        try:
+            job_id = str(uuid.UUID(job_id))
+        except ValueError:
+            return None
+
+        directory = self.directory
+        state_path = directory / f"{job_id}.json"
+        try:
+            state = json.loads(state_path.read_text())
+            updated_at = state_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+        job = ReportJob(directory=directory, **state)
+        if (
+            job.status in (ReportJob.PENDING, ReportJob.RUNNING)
+            and self._timer() - updated_at >= self.timeout
+        ):
+            logger.error("Report job %s timed out.", job.id)
+            job.status = ReportJob.FAILED
+            job.error = "The report job timed out."
+            job.save()
+        return job
+
+    def _run_in_worker(self, job: ReportJob) -> None:
+        try:
+            self.run(job)
+        finally:
+            # Worker threads have their own connections.
+            close_old_connections()
+
+    def run(self, job: ReportJob) -> None:
+        """Generating the report of the job."""
+
+        report = r.REPORTS[job.report]
+        job.status = ReportJob.RUNNING
+        job.save()
+        heartbeat = self._start_heartbeat(job)
+
+        try:
+            output = r.generate(job.report, job.params)
+            if output is not None:
+                with output, open(job.path, "wb") as file:
+                    shutil.copyfileobj(output, file)
+                job.status = ReportJob.DONE
+                m.ActionLog.objects.log(
+                    m.ActionLog.ActionTypeChoices.CREATE,
+                    job.user,
+                    report.log_msg(**job.params),
+                    report.log_model,
+                )
+            else:
+                job.status = ReportJob.EMPTY
+        except Exception as err:
+            logger.exception("Report job %s failed.", job.id)
+            job.status = ReportJob.FAILED
+            job.error = str(err)
+            job.path.unlink(missing_ok=True)
+        finally:
+            heartbeat.set()
+            job.save()
+
+    def _start_heartbeat(self, job: ReportJob) -> threading.Event:
+        """
+        Touching the state of the running job every third of the `timeout`,
+        so it is not considered dead, until the returned event is set.
+        """
+
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(self.timeout / 3):
+                try:
+                    os.utime(job.state_path)
+                except FileNotFoundError:
+                    return
+
+        threading.Thread(
+            target=beat, name="report-job-heartbeat", daemon=True
+        ).start()
+        return stopped
+
+    def _purge(self, now: float) -> None:
+        """
+        Deleting the expired jobs (of every process) and their reports, and
+        failing the jobs which their worker has died.
+        """
+
+        for key, job in list(self._recent_jobs.items()):
+            if now - job.created_at >= self.dedup_window:
+                del self._recent_jobs[key]
+
+        for state_path in self.directory.glob("*.json"):
+            try:
+                age = now - state_path.stat().st_mtime
+            except FileNotFoundError:
+                # Purged by another process in the meantime.
+                continue
+            if age >= self.retention:
+                for path in self.directory.glob(f"{state_path.stem}.*"):
+                    path.unlink(missing_ok=True)
+            elif age >= self.timeout:
+                self.get(state_path.stem)
+
+
+queue = ReportJobQueue()
@@ -1,4 +1,3 @@
-from django.db.models import Count, Sum
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -6,6 +5,8 @@ from rest_framework.response import Response
 from . import business as b
 from . import decorators as decs
 from . import models as m
+from . import report_jobs
+from . import reports as r
 from . import serializers as s
 from . import utils as u
 from .messages import Message
@@ -17,34 +18,17 @@ message = Message()
 @decs.check([decs.is_open_for_admins])
 @decs.authenticate(privileged_users=True)
 def food_provider_daily_ordering_report(request, user: m.User, override_user: m.User):
-    schema = {"date": ""}
     try:
-        u.validate_request_based_on_schema(schema, request.data)
+        params = r.validate_date_params(request.data)
     except ValueError as err:
         return Response({"errors": str(err)}, status.HTTP_400_BAD_REQUEST)
 
-    date = u.validate_date(request.data.get("date"))
+    date = params["date"]
 
-    queryset = m.FoodProviderOrdering.objects.filter(DeliveryDate=date).order_by(
-        "MealType",
-        "FoodProvider",
-        "DeliveryBuilding").values(
-        "ItemName",
-        "ItemTotalCount",
-        "DeliveryBuildingPersian",
-        "FoodProviderPersian",
-    )
-    if not queryset:
+    response = r.respond("daily-foodprovider-ordering", params)
+    if response is None:
         return u.raise_report_notfound(message, request)
 
-    providers = queryset.values_list("FoodProviderPersian", flat=True)
-    response = u.queryset_to_xlsx_response_food_provider_ordering(queryset, [
-        "آیتم",
-        "تعداد",
-        "محل تحویل",
-        "تامین کننده"
-    ], providers)
-
     m.ActionLog.objects.log(
         m.ActionLog.ActionTypeChoices.CREATE,
         user,
@@ -66,39 +50,16 @@ def personnel_daily_report(request, user: m.User, override_user: m.User):
         -  'date' (str): The date which you want to look for.
     """
 
-    schema = {"date": ""}
     try:
-        u.validate_request_based_on_schema(schema, request.data)
+        params = r.validate_date_params(request.data)
     except ValueError as err:
         return Response({"errors": str(err)}, status.HTTP_400_BAD_REQUEST)
 
-    date = u.validate_date(request.data.get("date"))
-
-    queryset = m.PersonnelDailyReport.objects.filter(DeliveryDate=date).order_by("-DeliveryDate", "Personnel").values(
-        "NationalCode",
-        "Personnel",
-        "FirstName",
-        "LastName",
-        "ItemName",
-        "Quantity",
-        "DeliveryDate",
-        "DeliveryBuildingPersian",
-        "DeliveryFloorPersian"
-    )
-    if not queryset:
-        return u.raise_report_notfound(message, request)
+    date = params["date"]
 
-    response = u.queryset_to_xlsx_response(queryset, [
-        "کد ملی",
-        "نام کاربری",
-        "نام",
-        "نام خانوادگی",
-        "ایتم",
-        "تعداد",
-        "زمان تحویل",
-        "ساختمان تحویل",
-        "طبقه تحویل"
-    ])
+    response = r.respond("daily-orders", params)
+    if response is None:
+        return u.raise_report_notfound(message, request)
 
     m.ActionLog.objects.log(
         m.ActionLog.ActionTypeChoices.CREATE,
@@ -137,19 +98,8 @@ def personnel_financial_report(request, user: m.User, override_user: m.User):
             {"errors": "Invalid month value."}, status.HTTP_400_BAD_REQUEST
         )
 
-    first_date, last_date = u.first_and_last_day_date(month, year)
-
-    orders = m.Order.objects.filter(
-        DeliveryDate__range=[first_date, last_date]
-    )
-
-    result = orders.values("Personnel", "FirstName", "LastName").annotate(
-        TotalOrders=Count("Id"),
-        TotalPrice=Sum("TotalPrice"),
-        TotalSubsidySpent=Sum("SubsidySpent"),
-        TotalPersonnelDebt=Sum("PersonnelDebt"),
-    )
-    if not result:
+    response = r.respond("monthly-financial", {"year": year, "month": month})
+    if response is None:
         return u.raise_report_notfound(message, request)
 
     m.ActionLog.objects.log(
@@ -157,10 +107,9 @@ def personnel_financial_report(request, user: m.User, override_user: m.User):
         user,
         f"Monthly Financial report generated for year {year} and month "
         f"{month}",
-        m.Order
+        m.OrderSummary
     )
-    csv_content = u.generate_csv(result)
-    return csv_content
+    return response
 
 
 @api_view(["POST"])
@@ -193,35 +142,10 @@ def item_ordering_personnel_list_report(
             status.HTTP_400_BAD_REQUEST,
         )
 
-    # query sets that are in report must have .values for specifying columns
-    res = m.PersonnelDailyReport.objects.filter(
-        DeliveryDate=date, ItemId=item_id
-    ).order_by("-DeliveryDate").values(
-        "NationalCode",
-        "Personnel",
-        "FirstName",
-        "LastName",
-        "ItemName",
-        "Quantity",
-        "DeliveryDate",
-        "DeliveryBuildingPersian",
-        "DeliveryFloorPersian",
-    )
-    if not res:
+    response = r.respond("specific-item", {"date": date, "item": item_id})
+    if response is None:
         return u.raise_report_notfound(message, request)
 
-    response = u.queryset_to_xlsx_response(res, [
-        "کد ملی",
-        "نام کاربری",
-        "نام",
-        "نام خانوادگی",
-        "ایتم",
-        "تعداد",
-        "زمان تحویل",
-        "ساختمان تحویل",
-        "طبقه تحویل"
-    ])
-
     m.ActionLog.objects.log(
         m.ActionLog.ActionTypeChoices.CREATE,
         user,
@@ -242,34 +166,9 @@ def personnel_monthly_report(request, user: m.User, override_user: m.User):
 
     month = serializer.validated_data.get("month")
     year = serializer.validated_data.get("year")
-    first_date, last_date = u.first_and_last_day_date(month, year)
-    qs = m.PersonnelDailyReport.objects.filter(
-        DeliveryDate__range=[first_date, last_date]
-    ).order_by("-DeliveryDate").values(
-        "NationalCode",
-        "Personnel",
-        "FirstName",
-        "LastName",
-        "ItemName",
-        "Quantity",
-        "DeliveryDate",
-        "DeliveryBuildingPersian",
-        "DeliveryFloorPersian",
-    )
-    if not qs:
+    response = r.respond("monthly-orders", {"year": year, "month": month})
+    if response is None:
         return u.raise_report_notfound(message, request)
-
-    response = u.queryset_to_xlsx_response(qs, [
-        "کد ملی",
-        "نام کاربری",
-        "نام",
-        "نام خانوادگی",
-        "ایتم",
-        "تعداد",
-        "زمان تحویل",
-        "ساختمان تحویل",
-        "طبقه تحویل"
-    ])
     m.ActionLog.objects.log(
         m.ActionLog.ActionTypeChoices.CREATE,
         user,
@@ -278,3 +177,89 @@ def personnel_monthly_report(request, user: m.User, override_user: m.User):
     )
 
     return response
+
+
+def _report_job_response(job: report_jobs.ReportJob, status_code):
+    return Response(
+        {
+            "jobId": job.id,
+            "report": job.report,
+            "status": job.status,
+            "error": job.error,
+        },
+        status_code,
+    )
+
+
+@api_view(["POST"])
+@decs.check([decs.is_open_for_admins])
+@decs.authenticate(privileged_users=True)
+def create_report_job(request, user: m.User, override_user: m.User):
+    """
+    Queuing one of the reports to be generated in the background, the
+    result can be downloaded (once it's done) via `report_job_download`.
+
+    Identical requests in a short window share the same job.
+
+    Args:
+        request (dict): Request data which must contains:
+        -  'report' (str): Name of the report, one of `reports.REPORTS`.
+        And the parameters of the report, the same as its own view.
+    """
+
+    report_name = request.data.get("report")
+    report = r.REPORTS.get(report_name)
+    if report is None:
+        return Response(
+            {"errors": f"Invalid report, choices are {list(r.REPORTS)}."},
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    data = {k: v for k, v in request.data.items() if k != "report"}
+    try:
+        params = report.validate(data)
+    except ValueError as err:
+        return Response({"errors": str(err)}, status.HTTP_400_BAD_REQUEST)
+
+    job = report_jobs.queue.submit(report_name, params, user.Personnel)
+    return _report_job_response(job, status.HTTP_202_ACCEPTED)
+
+
+@api_view(["GET"])
+@decs.check([decs.is_open_for_admins])
+@decs.authenticate(privileged_users=True)
+def report_job_status(
+        request, user: m.User, override_user: m.User, job_id
+):
+    job = report_jobs.queue.get(str(job_id))
+    if job is None:
+        return Response(
+            {"errors": "Report job not found."}, status.HTTP_404_NOT_FOUND
+        )
+    return _report_job_response(job, status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@decs.check([decs.is_open_for_admins])
+@decs.authenticate(privileged_users=True)
+def report_job_download(
+        request, user: m.User, override_user: m.User, job_id
+):
+    job = report_jobs.queue.get(str(job_id))
+    if job is None:
+        return Response(
+            {"errors": "Report job not found."}, status.HTTP_404_NOT_FOUND
+        )
+    if job.status == report_jobs.ReportJob.EMPTY:
+        return u.raise_report_notfound(message, request)
+    if job.status != report_jobs.ReportJob.DONE:
+        return _report_job_response(job, status.HTTP_409_CONFLICT)
+
+    try:
+        output = open(job.path, "rb")
+    except FileNotFoundError:
+        # Purged since the job was loaded.
+        return Response(
+            {"errors": "Report job is expired."}, status.HTTP_410_GONE
+        )
+    return u.report_file_response(output, job.extension)
@@ -0,0 +1,319 @@
+"""Definitions of the administrative reports.
+
+Each report knows how to validate its parameters, which rows it contains,
+and how those rows are written to a file. They are shared by the report
+views (which respond right away) and the report jobs (which build the file
+in the background).
+"""
+
+import tempfile
+import time
+from functools import partial
+from typing import BinaryIO, Callable, Iterable, NamedTuple, Optional
+
+from django.db.models import Count, Sum
+from django.http.response import HttpResponseBase
+
+from . import business as b
+from . import models as m
+from . import report_cache
+from . import serializers as s
+from . import utils as u
+
+PERSONNEL_REPORT_HEADERS = [
+    "کد ملی",
+    "نام کاربری",
+    "نام",
+    "نام خانوادگی",
+    "ایتم",
+    "تعداد",
+    "زمان تحویل",
+    "ساختمان تحویل",
+    "طبقه تحویل",
+]
+
+PERSONNEL_REPORT_FIELDS = (
+    "NationalCode",
+    "Personnel",
+    "FirstName",
+    "LastName",
+    "ItemName",
+    "Quantity",
+    "DeliveryDate",
+    "DeliveryBuildingPersian",
+    "DeliveryFloorPersian",
+)
+
+FOOD_PROVIDER_REPORT_HEADERS = [
+    "آیتم",
+    "تعداد",
+    "محل تحویل",
+    "تامین کننده",
+]
+
+
+class Report(NamedTuple):
+    """
+    Attributes:
+        extension: Extension of the report's file (xlsx or csv).
+        validate: Returns the validated parameters of the report out of the
+            request data, raises ValueError if they are not valid.
+        rows: Returns the rows of the report for the validated parameters.
+        dates: Returns the first and last date which the report covers.
+        write: Writes the rows into a binary file, returns their number.
+        log_msg: Returns the ActionLog message for the validated parameters.
+        log_model: The model which the ActionLog refers to.
+        stream: Returns a streaming response of the rows, for the reports
+            which can be sent while their rows are fetched (csv).
+    """
+
+    extension: str
+    validate: Callable[[dict], dict]
+    rows: Callable[..., Iterable]
+    dates: Callable[..., tuple[str, str]]
+    write: Callable
+    log_msg: Callable[..., str]
+    log_model: type
+    stream: Optional[Callable] = None
+
+
+def validate_date_params(data: dict) -> dict:
+    u.validate_request_based_on_schema({"date": ""}, data)
+    date = u.validate_date(data.get("date"))
+    if not date:
+        raise ValueError("Invalid date value.")
+    return {"date": date}
+
+
+def validate_month_params(data: dict) -> dict:
+    serializer = s.PersonnelMonthlyReport(data=data)
+    if not serializer.is_valid():
+        raise ValueError("Invalid year or month value.")
+    return {
+        "year": serializer.validated_data["year"],
+        "month": serializer.validated_data["month"],
+    }
+
+
+def validate_item_params(data: dict) -> dict:
+    date, item = b.validate_request(data)
+    return {"date": date, "item": item}
+
+
+def day_dates(date: str, **kwargs) -> tuple[str, str]:
+    return date, date
+
+
+def month_dates(year: int, month: int) -> tuple[str, str]:
+    return u.first_and_last_day_date(month, year)
+
+
+def food_provider_ordering_rows(date: str):
+    # Ordered by the provider first, since it's a section per provider.
+    return (
+        m.FoodProviderOrdering.objects.filter(DeliveryDate=date)
+        .order_by(
+            "FoodProviderPersian",
+            "MealType",
+            "FoodProvider",
+            "DeliveryBuilding",
+        )
+        .values(
+            "ItemName",
+            "ItemTotalCount",
+            "DeliveryBuildingPersian",
+            "FoodProviderPersian",
+        )
+    )
+
+
+def personnel_daily_rows(date: str):
+    return (
+        m.PersonnelDailyReport.objects.filter(DeliveryDate=date)
+        .order_by("-DeliveryDate", "Personnel")
+        .values(*PERSONNEL_REPORT_FIELDS)
+    )
+
+
+def item_ordering_personnel_rows(date: str, item: int):
+    return (
+        m.PersonnelDailyReport.objects.filter(DeliveryDate=date, ItemId=item)
+        .order_by("-DeliveryDate")
+        .values(*PERSONNEL_REPORT_FIELDS)
+    )
+
+
+def personnel_monthly_rows(year: int, month: int):
+    first_date, last_date = u.first_and_last_day_date(month, year)
+    return (
+        m.PersonnelDailyReport.objects.filter(
+            DeliveryDate__range=[first_date, last_date]
+        )
+        .order_by("-DeliveryDate")
+        .values(*PERSONNEL_REPORT_FIELDS)
+    )
+
+
+def personnel_financial_rows(year: int, month: int):
+    """
+    Yielding the financial rows of each personnel in the month, the names of
+    the personnel are fetched once (not per row).
+    """
+
+    first_date, last_date = u.first_and_last_day_date(month, year)
+    orders = m.OrderSummary.objects.filter(
+        DeliveryDateOrdinal__range=[
+            m.date_ordinal(first_date),
+            m.date_ordinal(last_date),
+        ]
+    )
+    totals = (
+        orders.values("Personnel")
+        .annotate(
+            TotalOrders=Count("id"),
+            TotalPrice=Sum("TotalPrice"),
+            TotalSubsidySpent=Sum("SubsidySpent"),
+            TotalPersonnelDebt=Sum("PersonnelDebt"),
+        )
+        .order_by("Personnel")
+    )
+    names = {
+        row["UserName"]: row
+        for row in m.TempUsers.objects.filter(
+            UserName__in=orders.values("Personnel")
+        ).values("UserName", "FirstName", "LastName")
+    }
+    for row in totals.iterator():
+        name = names.get(row["Personnel"], {})
+        yield {
+            "Personnel": row["Personnel"],
+            "FirstName": name.get("FirstName"),
+            "LastName": name.get("LastName"),
+            "TotalOrders": row["TotalOrders"],
+            "TotalPrice": row["TotalPrice"],
+            "TotalSubsidySpent": row["TotalSubsidySpent"],
+            "TotalPersonnelDebt": row["TotalPersonnelDebt"],
+        }
+
+
+REPORTS = {
+    "daily-foodprovider-ordering": Report(
+        extension="xlsx",
+        validate=validate_date_params,
+        rows=food_provider_ordering_rows,
+        dates=day_dates,
+        write=partial(
+            u.write_grouped_xlsx,
+            persian_headers=FOOD_PROVIDER_REPORT_HEADERS,
+            group_by="FoodProviderPersian",
+        ),
+        log_msg=lambda date: (
+            f"Food Provider Ordering report generated for {date}"
+        ),
+        log_model=m.PersonnelDailyReport,
+    ),
+    "daily-orders": Report(
+        extension="xlsx",
+        validate=validate_date_params,
+        rows=personnel_daily_rows,
+        dates=day_dates,
+        write=partial(u.write_xlsx, persian_headers=PERSONNEL_REPORT_HEADERS),
+        log_msg=lambda date: f"Daily Orders report generated for {date}",
+        log_model=m.PersonnelDailyReport,
+    ),
+    "specific-item": Report(
+        extension="xlsx",
+        validate=validate_item_params,
+        rows=item_ordering_personnel_rows,
+        dates=day_dates,
+        write=partial(u.write_xlsx, persian_headers=PERSONNEL_REPORT_HEADERS),
+        log_msg=lambda date, item: (
+            f"Item Orders report generated for item {item} for {date}"
+        ),
+        log_model=m.PersonnelDailyReport,
+    ),
+    "monthly-orders": Report(
+        extension="xlsx",
+        validate=validate_month_params,
+        rows=personnel_monthly_rows,
+        dates=month_dates,
+        write=partial(u.write_xlsx, persian_headers=PERSONNEL_REPORT_HEADERS),
+        log_msg=lambda year, month: (
+            f"Monthly Orders report generated for year {year} and month"
+            f" {month}"
+        ),
+        log_model=m.PersonnelDailyReport,
+    ),
+    "monthly-financial": Report(
+        extension="csv",
+        validate=validate_month_params,
+        rows=personnel_financial_rows,
+        dates=month_dates,
+        write=u.write_csv,
+        stream=u.generate_csv,
+        log_msg=lambda year, month: (
+            f"Monthly Financial report generated for year {year} and month"
+            f" {month}"
+        ),
+        log_model=m.OrderSummary,
+    ),
+}
+
+
+def generate(report_name: str, params: dict) -> Optional[BinaryIO]:
+    """
+    Returning the (open) file of the report, which is read from the cache
+    if possible. None if the report has no rows.
+
+    Args:
+        report_name: Name of the report, one of `REPORTS`.
+        params: Validated parameters of the report.
+    """
+
+    report = REPORTS[report_name]
+    dates = report.dates(**params)
+    cached = report_cache.open_cached(
+        report_name, params, dates, report.extension
+    )
+    if cached is not None:
+        return cached
+
+    started_at = time.time()
+    rows = u.peek_rows(report.rows(**params))
+    if rows is None:
+        return None
+
+    output = tempfile.TemporaryFile()
+    report.write(output, rows)
+
+    report_cache.store(
+        report_name, params, dates, report.extension, output, started_at
+    )
+    output.seek(0)
+    return output
+
+
+def respond(report_name: str, params: dict) -> Optional[HttpResponseBase]:
+    """
+    Returning the response of the report, None if the report has no rows.
+
+    Streamable reports which are not cached (their dates are not passed)
+    are sent while their rows are being fetched. The others are generated
+    into a file (or read from the cache) first, see `generate`.
+
+    Args:
+        report_name: Name of the report, one of `REPORTS`.
+        params: Validated parameters of the report.
+    """
+
+    report = REPORTS[report_name]
+    if report.stream is not None and not report_cache.is_cacheable(
+        report.dates(**params)
+    ):
+        rows = u.peek_rows(report.rows(**params))
+        return None if rows is None else report.stream(rows)
+
+    output = generate(report_name, params)
+    if output is None:
+        return None
+    return u.report_file_response(output, report.extension)
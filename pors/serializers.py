@@ -2,7 +2,8 @@ from collections import namedtuple
 
 from rest_framework import serializers
 
-from . import business as b
+from . import caches
+from . import encoders
 from . import models as m
 from . import utils as u
 from .models import MealTypeChoices, User
@@ -47,17 +48,6 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ("id", "Title")
 
 
-class HolidaySerializer(serializers.Serializer):
-    holidays = serializers.SerializerMethodField()
-
-    def get_holidays(self, obj):
-        result = []
-        for date in obj.values():
-            if date["HolidayDate"] not in result:
-                result.append(date["HolidayDate"])
-        return result
-
-
 class ItemOrderSerializer(serializers.Serializer):
     id = serializers.IntegerField(source="Item")
     allowToRemoveMenuItems = serializers.SerializerMethodField()
@@ -69,40 +59,30 @@ class ItemOrderSerializer(serializers.Serializer):
         return True
 
 
+encode_item_order = encoders.Encoder(ItemOrderSerializer)
+
+
 class MenuItemSerializer(serializers.Serializer):
     menuItems = serializers.SerializerMethodField()
 
     def get_menuItems(self, obj):
         result = []
         current_date_obj = {}
-        breakfast_deadlines, launch_deadlines = u.get_deadlines(Deadline)
-        breakfast_deadlines: dict[int, Deadline]
-        launch_deadlines: dict[int, Deadline]
+        deadlines = caches.get_deadline_table()
         now = u.localnow()
 
         for object in obj:
-            serializer = ItemOrderSerializer(
-                data={"id": object.Item, "orderedBy": object.TotalOrders},
-            ).initial_data
+            serializer = encode_item_order(object)
             if current_date_obj.get("date") == object.Date:
                 current_date_obj["items"].append(serializer)
             else:
                 current_date_obj = {}
                 current_date_obj["date"] = object.Date
-                weekday = u.create_jdate_object(object.Date).weekday()
-                current_date_obj["openForLaunch"] = b.is_date_valid_for_action(
-                    now,
-                    current_date_obj["date"],
-                    launch_deadlines[weekday].Days,
-                    launch_deadlines[weekday].Hour,
+                current_date_obj["openForLaunch"] = deadlines.is_open(
+                    object.Date, MealTypeChoices.LAUNCH, now
                 )
-                current_date_obj["openForBreakfast"] = (
-                    b.is_date_valid_for_action(
-                        now,
-                        current_date_obj["date"],
-                        breakfast_deadlines[weekday].Days,
-                        breakfast_deadlines[weekday].Hour,
-                    )
+                current_date_obj["openForBreakfast"] = deadlines.is_open(
+                    object.Date, MealTypeChoices.BREAKFAST, now
                 )
                 current_date_obj["items"] = []
                 current_date_obj["items"].append(serializer)
@@ -128,6 +108,9 @@ class OrderItemSerializer(serializers.Serializer):
     # deliveryFloor = serializers.CharField(source="DeliveryFloor")
 
 
+encode_order_item = encoders.Encoder(OrderItemSerializer)
+
+
 class OrderSerializer(serializers.Serializer):
     orders = serializers.SerializerMethodField()
 
@@ -135,7 +118,7 @@ class OrderSerializer(serializers.Serializer):
         result = []
         schema = {}
         for object in obj:
-            serializer = OrderItemSerializer(object).data
+            serializer = encode_order_item(object)
             date = schema.get("orderDate")
             if date == object["DeliveryDate"]:
                 u.add_mealtype_building(object, schema)
@@ -183,11 +166,6 @@ class FirstPageSerializer(serializers.Serializer):
     godMode = serializers.BooleanField()
 
 
-class DayWithMenuSerializer(serializers.Serializer):
-    day = serializers.CharField(source="AvailableDate")
-    ordersNumber = serializers.IntegerField(source="OrderCount")
-
-
 class ListedDaysWithMenu(serializers.Serializer):
     dates = serializers.SerializerMethodField()
 
@@ -209,15 +187,16 @@ class MenuItems(serializers.Serializer):
     id = serializers.IntegerField(source="Item_id")
 
 
+encode_menu_item = encoders.Encoder(MenuItems)
+
+
 class PersonnelMenuItemSerializer(serializers.Serializer):
     menuItems = serializers.SerializerMethodField()
 
     def get_menuItems(self, obj):
         result = []
         current_date_obj = {}
-        breakfast_deadlines, launch_deadlines = u.get_deadlines(Deadline)
-        breakfast_deadlines: dict[int, Deadline]
-        launch_deadlines: dict[int, Deadline]
+        deadlines = caches.get_deadline_table()
         now = u.localnow()
 
         # Its set to true if user is admin and accessing another
@@ -226,33 +205,24 @@ class PersonnelMenuItemSerializer(serializers.Serializer):
         bypass_date_limitations = self.context.get("bypass_date_limitations")
 
         for object in obj:
-            serializer = MenuItems(object).data
+            serializer = encode_menu_item(object)
             if current_date_obj.get("date") == object.get("AvailableDate"):
                 current_date_obj["items"].append(serializer)
             else:
                 current_date_obj = {}
                 current_date_obj["date"] = object.get("AvailableDate")
-                weekday = u.create_jdate_object(
-                    object.get("AvailableDate")
-                ).weekday()
                 current_date_obj["openForLaunch"] = (
-                    b.is_date_valid_for_action(
-                        now,
-                        current_date_obj["date"],
-                        launch_deadlines[weekday].Days,
-                        launch_deadlines[weekday].Hour,
+                    deadlines.is_open(
+                        current_date_obj["date"], MealTypeChoices.LAUNCH, now
                     )
                     if not bypass_date_limitations
                     else True
                 )
                 current_date_obj["openForBreakfast"] = (
-                    (
-                        b.is_date_valid_for_action(
-                            now,
-                            current_date_obj["date"],
-                            breakfast_deadlines[weekday].Days,
-                            breakfast_deadlines[weekday].Hour,
-                        )
+                    deadlines.is_open(
+                        current_date_obj["date"],
+                        MealTypeChoices.BREAKFAST,
+                        now,
                     )
                     if not bypass_date_limitations
                     else True
@@ -0,0 +1,96 @@
+"""Signal receivers which keep the in-process caches (and the report cache)
+consistent with the database.
+
+Note that these receivers are only triggered by ORM `save` and `delete`
+calls, queryset `update` calls or manual changes on the database level will
+NOT invalidate anything, the ttl of the caches takes care of them.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import business as b
+from . import caches
+from . import models as m
+from . import report_cache
+
+
+@receiver([post_save, post_delete], sender=m.User)
+def invalidate_user_cache(sender, instance: m.User, **kwargs):
+    caches.invalidate_user(instance)
+
+
+@receiver([post_save, post_delete], sender=m.SystemSetting)
+def invalidate_system_setting_cache(sender, **kwargs):
+    caches.system_setting_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=m.DailyMenuItem)
+def invalidate_menu_calendar_cache(
+    sender, instance: m.DailyMenuItem, **kwargs
+):
+    caches.invalidate_calendar_month(instance.AvailableDate)
+
+
+# A holiday's date may move to another month, and deadlines affect every
+# month, so the whole calendar cache is dropped for them.
+@receiver([post_save, post_delete], sender=m.Holiday)
+@receiver([post_save, post_delete], sender=m.Deadlines)
+def invalidate_calendar_cache(sender, **kwargs):
+    caches.calendar_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=m.Holiday)
+def invalidate_holiday_cache(sender, **kwargs):
+    caches.holiday_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=m.Deadlines)
+def invalidate_deadline_cache(sender, **kwargs):
+    caches.deadline_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=m.HR_constvalue)
+def invalidate_location_cache(sender, **kwargs):
+    caches.location_cache.clear()
+
+
+@receiver(pre_save, sender=m.Subsidy)
+def remember_subsidy_dates(sender, instance: m.Subsidy, **kwargs):
+    # The summaries of the previous dates must be refreshed too, if the
+    # dates of the subsidy are changed.
+    instance._previous_dates = (
+        m.Subsidy.objects.filter(pk=instance.pk)
+        .values_list("FromDate", "UntilDate")
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver([post_save, post_delete], sender=m.Subsidy)
+def refresh_order_summary_subsidies(sender, instance: m.Subsidy, **kwargs):
+    caches.subsidy_cache.clear()
+
+    from_date, until_date = instance.FromDate, instance.UntilDate
+    previous_dates = vars(instance).pop("_previous_dates", None)
+    if previous_dates is not None:
+        previous_from_date, previous_until_date = previous_dates
+        from_date = min(from_date, previous_from_date)
+        if until_date is None or previous_until_date is None:
+            # Open ended, if any of them is.
+            until_date = None
+        else:
+            until_date = max(until_date, previous_until_date)
+
+    b.refresh_order_summary_subsidies(from_date, until_date)
+    transaction.on_commit(
+        lambda: report_cache.invalidate(from_date, until_date)
+    )
+
+
+@receiver([post_save, post_delete], sender=m.OrderItem)
+def invalidate_report_cache(sender, instance: m.OrderItem, **kwargs):
+    date = instance.DeliveryDate
+    transaction.on_commit(lambda: report_cache.invalidate(date, date))
@@ -1,14 +1,91 @@
+import codecs
+import os
+import random
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
 import unittest
+import uuid
+import zipfile
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
 
 import jdatetime
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import HttpRequest
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.urls import reverse
+from django.utils import timezone
 
 from . import business as b
+from . import (
+    caches,
+    deadlines,
+    encoders,
+    log_writer,
+    metrics,
+    queries,
+    report_cache,
+    report_jobs,
+    reports,
+)
+from . import serializers as s
+from . import utils as u
+from . import models as m
+from .caches import TTLCache
+from .decorators import is_open_for_admins, is_open_for_personnel
+from .general_actions import GeneralCalendar, PersonnelCalendar
+from .messages import Message
 from .serializers import Deadline
+from .utils import (
+    generate_csv,
+    write_csv,
+    write_grouped_xlsx,
+    write_xlsx,
+)
 
 # Create your tests here.
 
 
+def first_orderable_date_by_loop(now, breakfast_deadlines, launch_deadlines):
+    """The previous, day by day, `get_first_orderable_date`."""
+
+    passed_days = 0
+    weekday = now.weekday()
+    while True:
+        breakfast_deadline = breakfast_deadlines[weekday]
+        launch_deadline = launch_deadlines[weekday]
+        if (
+            (
+                breakfast_deadline.Days == passed_days
+                and breakfast_deadline.Hour <= now.hour
+            )
+            or (breakfast_deadline.Days > passed_days)
+        ) and (
+            (
+                launch_deadline.Days == passed_days
+                and launch_deadline.Hour <= now.hour
+            )
+            or (launch_deadline.Days > passed_days)
+        ):
+            passed_days += 1
+            weekday = (weekday + 1) % 7
+        else:
+            now += jdatetime.timedelta(days=passed_days)
+            return now.year, now.month, now.day
+
+
 class TestDeadlineValidators(unittest.TestCase):
     def setUp(self) -> None:
         self.launch_deadlines = {
@@ -37,6 +114,59 @@ class TestDeadlineValidators(unittest.TestCase):
         )
         self.assertEqual((year, month, day), (1403, 4, 19))
 
+    def random_deadlines(self, rnd, max_days):
+        return {
+            weekday: Deadline(rnd.randrange(max_days), rnd.randrange(25))
+            for weekday in range(7)
+        }
+
+    def test_first_orderable_date_matches_the_loop(self):
+        rnd = random.Random(1403)
+        start = jdatetime.datetime(1402, 1, 1)
+        for _ in range(2000):
+            now = start + jdatetime.timedelta(
+                hours=rnd.randrange(24 * 800), minutes=rnd.randrange(60)
+            )
+            breakfast = self.random_deadlines(rnd, 10)
+            launch = self.random_deadlines(rnd, 10)
+            self.assertEqual(
+                b.get_first_orderable_date(now, breakfast, launch),
+                first_orderable_date_by_loop(now, breakfast, launch),
+                (now, breakfast, launch),
+            )
+
+    def test_first_orderable_date_is_the_first_open_date(self):
+        rnd = random.Random(1402)
+        for _ in range(500):
+            now = jdatetime.datetime(1403, 12, 25, rnd.randrange(24))
+            breakfast = self.random_deadlines(rnd, 400)
+            launch = self.random_deadlines(rnd, 400)
+            first = m.date_ordinal(
+                "%04d/%02d/%02d"
+                % b.get_first_orderable_date(now, breakfast, launch)
+            )
+
+            def is_open(day):
+                date = jdatetime.date.fromordinal(day).strftime("%Y/%m/%d")
+                weekday = deadlines.weekday(day)
+                return any(
+                    b.is_date_valid_for_action(now, date, *deadline[weekday])
+                    for deadline in (breakfast, launch)
+                )
+
+            self.assertTrue(is_open(first))
+            self.assertFalse(
+                any(map(is_open, range(now.toordinal(), first)))
+            )
+
+    def test_weekday(self):
+        day = m.date_ordinal("1402/01/01")
+        for offset in range(14):
+            self.assertEqual(
+                deadlines.weekday(day + offset),
+                jdatetime.date.fromordinal(day + offset).weekday(),
+            )
+
     # def test_is_date_valid_for_action(self):
     #     mock_datetime = jdatetime.datetime(1402, 9, 28, 13)
     #     target_date = "1402/09/28"
@@ -52,3 +182,1577 @@ class TestDeadlineValidators(unittest.TestCase):
     #     target_date = "1402/09/29"
     #     result = b.is_date_valid_for_action(mock_datetime, target_date, 1, 14)
     #     self.assertEqual(result, False, "NAKHOY")
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.cache = TTLCache(max_size=2, ttl=10, timer=lambda: self.now)
+
+    def test_expiration(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(
+            self.cache.stats(), {"hits": 1, "misses": 1, "size": 0}
+        )
+
+    def test_least_recently_used_eviction(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+
+
+class TestAuthCache(TestCase):
+    def setUp(self) -> None:
+        caches.auth_cache.clear()
+        self.user = m.User.objects.create(
+            Personnel="test@eit",
+            FullName="test",
+            Token="token",
+            ExpiredAt="1403/05/01",
+        )
+
+    def test_hot_path_has_no_query(self):
+        caches.get_user_by_token("token", "1403/04/01")
+        with self.assertNumQueries(0):
+            user = caches.get_user_by_token("token", "1403/04/01")
+        self.assertEqual(user, self.user)
+
+    def test_expired_token(self):
+        caches.get_user_by_token("token", "1403/04/01")
+        self.assertIsNone(caches.get_user_by_token("token", "1403/05/02"))
+
+    def test_token_rotation_invalidates_cache(self):
+        caches.get_user_by_token("token", "1403/04/01")
+        self.user.Token = "rotated"
+        self.user.save()
+        self.assertIsNone(caches.get_user_by_token("token", "1403/04/01"))
+        self.assertEqual(
+            caches.get_user_by_token("rotated", "1403/04/01"), self.user
+        )
+
+    def test_delivery_place_is_not_cached(self):
+        caches.get_user_by_token("token", "1403/04/01")
+        # Changed by another worker, the signals of this one are not sent.
+        m.User.objects.filter(pk=self.user.pk).update(
+            LastDeliveryBuilding="b1", LastDeliveryFloor="f1"
+        )
+        user = caches.get_user_by_token("token", "1403/04/01")
+        self.assertEqual(user.IsAdmin, False)
+        self.assertEqual(user.LastDeliveryBuilding, "b1")
+
+        # Loaded fields of a request are not shared with the next ones.
+        m.User.objects.filter(pk=self.user.pk).update(
+            LastDeliveryBuilding="b2"
+        )
+        with self.assertNumQueries(1):
+            validator = b.ValidateBreakfast({}, user, None)
+            validator._validate_default_delivery_building()
+        self.assertEqual(validator.user.LastDeliveryBuilding, "b2")
+        self.assertEqual(
+            caches.get_user_by_personnel("test@eit").LastDeliveryBuilding,
+            "b2",
+        )
+
+
+class TestSystemSettingCache(TestCase):
+    def setUp(self) -> None:
+        caches.system_setting_cache.clear()
+        self.setting = m.SystemSetting.objects.create()
+
+    def test_check_gates_have_no_query(self):
+        caches.get_system_setting()
+        with self.assertNumQueries(0):
+            self.assertTrue(is_open_for_admins())
+            self.assertTrue(is_open_for_personnel())
+
+    def test_save_invalidates_snapshot(self):
+        caches.get_system_setting()
+        self.setting.IsSystemOpenForPersonnel = False
+        self.setting.save()
+        self.assertFalse(is_open_for_personnel())
+
+
+class TestSubsidyIndex(TestCase):
+    def setUp(self) -> None:
+        caches.subsidy_cache.clear()
+
+    def test_lookup(self):
+        day = m.date_ordinal
+        index = caches.SubsidyIndex(
+            [
+                (day("1402/01/01"), day("1402/06/31"), 100),
+                (day("1402/03/01"), day("1402/03/31"), 50),
+                (day("1402/07/01"), day("1402/12/29"), 150),
+                (day("1403/02/01"), None, 200),
+            ]
+        )
+        expected = {
+            "1401/12/29": None,
+            "1402/01/01": 100,
+            "1402/03/15": 100,
+            "1402/06/31": 100,
+            "1402/07/01": 150,
+            "1402/12/29": 150,
+            "1403/01/15": None,
+            "1403/02/01": 200,
+            "1410/01/01": 200,
+        }
+        for date, amount in expected.items():
+            self.assertEqual(index.get(date), amount, date)
+        self.assertEqual(index.get_many(expected), expected)
+        self.assertIsNone(caches.SubsidyIndex([]).get("1402/01/01"))
+
+    def test_cached_and_invalidated(self):
+        m.Subsidy.objects.create(Amount=50, FromDate="1402/01/01")
+        self.assertEqual(u.get_subsidy_amount("1402/08/01"), 50)
+        with self.assertNumQueries(0):
+            self.assertEqual(u.get_subsidy_amount("1403/08/01"), 50)
+
+        subsidy = m.Subsidy.objects.get()
+        subsidy.UntilDate = "1402/12/29"
+        subsidy.save()
+        self.assertIsNone(u.get_subsidy_amount("1403/08/01"))
+
+
+class TestDeadlineTable(TestCase):
+    def setUp(self) -> None:
+        caches.deadline_cache.clear()
+
+    def test_is_open(self):
+        # 1402/09/29 is a Wednesday (4).
+        table = caches.DeadlineTable(
+            [
+                (4, m.MealTypeChoices.LAUNCH, 1, 14),
+                (4, m.MealTypeChoices.BREAKFAST, 3, 10),
+            ]
+        )
+        launch = m.MealTypeChoices.LAUNCH
+        cases = [
+            (jdatetime.datetime(1402, 9, 28, 13), True),
+            (jdatetime.datetime(1402, 9, 28, 13, 59), True),
+            (jdatetime.datetime(1402, 9, 28, 14), False),
+            (jdatetime.datetime(1402, 9, 29, 9), False),
+            (jdatetime.datetime(1402, 8, 30, 23), True),
+        ]
+        for now, is_open in cases:
+            self.assertEqual(table.is_open("1402/09/29", launch, now), is_open)
+            self.assertEqual(
+                b.is_date_valid_for_action(now, "1402/09/29", 1, 14), is_open
+            )
+        self.assertTrue(
+            table.is_open(
+                "1402/09/29",
+                m.MealTypeChoices.BREAKFAST,
+                jdatetime.datetime(1402, 9, 26, 9),
+            )
+        )
+        with self.assertRaises(m.Deadlines.DoesNotExist):
+            table.is_open("1402/09/30", launch, jdatetime.datetime.now())
+
+    def test_cached_and_invalidated(self):
+        deadline = m.Deadlines.objects.create(
+            WeekDay=4, MealType=m.MealTypeChoices.LAUNCH, Days=1, Hour=14
+        )
+        self.assertEqual(
+            caches.get_deadline_table().get(4, m.MealTypeChoices.LAUNCH),
+            (1, 14),
+        )
+        with self.assertNumQueries(0):
+            breakfast, launch = u.get_deadlines(Deadline)
+        self.assertEqual((breakfast, launch), ({}, {4: Deadline(1, 14)}))
+
+        deadline.Hour = 16
+        deadline.save()
+        self.assertEqual(
+            caches.get_deadline_table().get(4, m.MealTypeChoices.LAUNCH),
+            (1, 16),
+        )
+
+
+class TestGeneralCalendar(TestCase):
+    def setUp(self) -> None:
+        caches.holiday_cache.clear()
+
+    def test_month_metadata(self):
+        for year in (1402, 1403):
+            for month in range(1, 13):
+                metadata = caches.get_month_metadata(year, month)
+                dates = [
+                    jdatetime.date(year, month, day)
+                    for day in range(1, metadata.length + 1)
+                ]
+                self.assertEqual(metadata.first_weekday, dates[0].weekday())
+                self.assertEqual(
+                    (dates[-1] + jdatetime.timedelta(days=1)).day, 1
+                )
+                self.assertEqual(
+                    metadata.weekend_days,
+                    {date.day for date in dates if date.weekday() in (5, 6)},
+                )
+
+    def test_holidays_are_cached_per_year(self):
+        m.Holiday.objects.create(HolidayDate="1402/08/01")
+        m.Holiday.objects.create(HolidayDate="1402/08/01")
+        m.Holiday.objects.create(HolidayDate="1402/09/02")
+        m.Holiday.objects.create(HolidayDate="1403/08/03")
+
+        data = GeneralCalendar(1402, 8).get_calendar()
+        self.assertEqual(
+            (data["firstDayOfWeek"], data["lastDayOfMonth"]), (3, 30)
+        )
+        self.assertEqual(
+            sorted(data["holidays"]), [1, 4, 5, 11, 12, 18, 19, 25, 26]
+        )
+        with self.assertNumQueries(0):
+            data = GeneralCalendar(1402, 9).get_calendar()
+        self.assertIn(2, data["holidays"])
+
+        m.Holiday.objects.create(HolidayDate="1402/09/06")
+        data = GeneralCalendar(1402, 9).get_calendar()
+        self.assertIn(6, data["holidays"])
+
+
+class TestLocationTree(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        root = m.HR_constvalue.objects.create(Caption="root", Code="root")
+        for i in (2, 1):
+            building = m.HR_constvalue.objects.create(
+                Caption=f"building {i}",
+                Code=f"Building_{i}",
+                Parent=root,
+                OrderNumber=i,
+            )
+            for j in (2, 1):
+                m.HR_constvalue.objects.create(
+                    Caption=f"floor {i}{j}",
+                    Code=f"Floor_{i}{j}",
+                    Parent=building,
+                    OrderNumber=j,
+                )
+
+    def setUp(self) -> None:
+        caches.location_cache.clear()
+
+    def test_tree(self):
+        with self.assertNumQueries(1):
+            buildings = u.fetch_available_location()
+        self.assertEqual(
+            [
+                (building["code"], [f["code"] for f in building["floors"]])
+                for building in buildings
+            ],
+            [
+                ("Building_1", ["Floor_11", "Floor_12"]),
+                ("Building_2", ["Floor_21", "Floor_22"]),
+            ],
+        )
+        self.assertEqual(
+            buildings[0]["floors"][0], {"code": "Floor_11", "title": "floor 11"}
+        )
+
+        with self.assertNumQueries(0):
+            floors = caches.get_location_tree().floors
+        self.assertEqual(floors["Building_2"], {"Floor_21", "Floor_22"})
+
+    def test_invalidated(self):
+        caches.get_location_tree()
+        m.HR_constvalue.objects.create(
+            Caption="floor 13",
+            Code="Floor_13",
+            Parent=m.HR_constvalue.objects.get(Code="Building_1"),
+        )
+        self.assertIn(
+            "Floor_13", caches.get_location_tree().floors["Building_1"]
+        )
+
+
+class TestQueryRegistry(TestCase):
+    def test_loaded_at_ready(self):
+        for name in (
+            "DayWithMenuOrderCount",
+            "PersonnelCalendarMenu",
+            "PersonnelOrderWithBill",
+        ):
+            self.assertIn(name, queries.registry)
+        self.assertNotIn("v_Order", queries.registry)
+
+    def test_counters(self):
+        query = queries.registry["DayWithMenuOrderCount"]
+        calls, rows = query.calls, query.rows
+        m.DailyMenuItem.objects.create(
+            AvailableDate="1402/08/02",
+            Item=m.Item.objects.create(
+                ItemName="drink",
+                Category=m.Category.objects.create(CategoryName="drink"),
+                MealType=m.MealTypeChoices.LAUNCH,
+                CurrentPrice=30,
+            ),
+        )
+        b.get_days_with_menu(8, 1402)
+        self.assertEqual((query.calls, query.rows), (calls + 1, rows + 1))
+        self.assertGreater(
+            queries.registry.stats()["DayWithMenuOrderCount"]["total_time"], 0
+        )
+
+        with self.assertRaises(ValueError):
+            query.execute((1,))
+
+    def test_validation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, "Valid.sql").write_text("select %s")
+            Path(directory, "v_View.sql").write_text("CREATE VIEW v AS ...")
+            registry = queries.QueryRegistry(Path(directory))
+            registry.load()
+            self.assertEqual(registry["Valid"].params_count, 1)
+            self.assertNotIn("v_View", registry)
+
+            Path(directory, "Invalid.sql").write_text("delete from x")
+            with self.assertRaises(ValueError):
+                registry.load()
+
+
+class TestRawSqlModes(TestCase):
+    query = "SELECT %s AS a, %s AS b UNION ALL SELECT 3, 4 ORDER BY a"
+
+    def test_modes(self):
+        rows = u.execute_raw_sql_with_params(self.query, (1, 2))
+        self.assertEqual(rows, [{"a": 1, "b": 2}, {"a": 3, "b": 4}])
+
+        rows = u.execute_raw_sql_with_params(
+            self.query, (1, 2), u.TUPLE_ROWS
+        )
+        self.assertEqual(rows, [(1, 2), (3, 4)])
+        self.assertEqual((rows[1].a, rows[1].b), (3, 4))
+
+        columns = u.execute_raw_sql_with_params(self.query, (1, 2), u.COLUMNS)
+        self.assertEqual(columns, {"a": [1, 3], "b": [2, 4]})
+
+        empty = u.execute_raw_sql_with_params(
+            "SELECT 1 AS a WHERE 1 = %s", (0,), u.COLUMNS
+        )
+        self.assertEqual(empty, {"a": []})
+
+        with self.assertRaises(ValueError):
+            u.execute_raw_sql_with_params(self.query, (1, 2), "rows")
+
+    def test_chunks(self):
+        chunks = list(
+            u.iterate_raw_sql_with_params(
+                self.query, (1, 2), u.TUPLE_ROWS, chunk_size=1
+            )
+        )
+        self.assertEqual(chunks, [[(1, 2)], [(3, 4)]])
+
+        query = queries.Query("Pairs", self.query)
+        chunks = list(query.iterate((1, 2), u.COLUMNS, chunk_size=1))
+        self.assertEqual(chunks, [{"a": [1], "b": [2]}, {"a": [3], "b": [4]}])
+        self.assertEqual((query.calls, query.rows), (1, 2))
+
+
+class TestEncoder(unittest.TestCase):
+    order_item = {
+        "id": 1,
+        "ItemName": "food",
+        "CurrentPrice": 10,
+        "Image": None,
+        "Category_id": 2,
+        "ItemDesc": "desc",
+        "Quantity": 2,
+        "PricePerOne": 10,
+        "DeliveryDate": "1402/08/02",
+    }
+
+    def test_same_as_serializers(self):
+        self.assertEqual(
+            s.encode_order_item(self.order_item),
+            s.OrderItemSerializer(self.order_item).data,
+        )
+        self.assertEqual(
+            list(s.encode_order_item(self.order_item)),
+            list(s.OrderItemSerializer().fields),
+        )
+
+        for total_orders in (0, 3):
+            row = SimpleNamespace(Item=7, TotalOrders=total_orders)
+            self.assertEqual(
+                s.encode_item_order(row), s.ItemOrderSerializer(row).data
+            )
+
+    def test_nested_source(self):
+        class NestedSerializer(s.serializers.Serializer):
+            category = s.serializers.CharField(source="Category.Title")
+
+        with self.assertRaises(ValueError):
+            encoders.Encoder(NestedSerializer)
+
+    def test_many_rows(self):
+        rows = [dict(self.order_item, id=id) for id in range(200)]
+        self.assertEqual(
+            [s.encode_order_item(row) for row in rows],
+            [s.OrderItemSerializer(row).data for row in rows],
+        )
+
+    @unittest.skipUnless(
+        os.environ.get("PORS_BENCHMARKS"), "Set PORS_BENCHMARKS to run."
+    )
+    def test_benchmark(self):
+        rows = [dict(self.order_item, id=id) for id in range(200)]
+
+        def serialize():
+            return [s.OrderItemSerializer(row).data for row in rows]
+
+        def encode():
+            return [s.encode_order_item(row) for row in rows]
+
+        serializer_time = min(timeit.repeat(serialize, number=1, repeat=3))
+        encoder_time = min(timeit.repeat(encode, number=1, repeat=3))
+        self.assertLess(encoder_time * 5, serializer_time)
+
+
+class TestPersonnelCalendar(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for weekday in range(7):
+            for meal_type in m.MealTypeChoices.values:
+                m.Deadlines.objects.create(
+                    WeekDay=weekday, MealType=meal_type, Days=1, Hour=14
+                )
+
+        category = m.Category.objects.create(CategoryName="food")
+        cls.items = [
+            m.Item.objects.create(
+                ItemName=f"item {i}",
+                Category=category,
+                MealType=m.MealTypeChoices.LAUNCH,
+                CurrentPrice=100,
+            )
+            for i in range(3)
+        ]
+        m.DailyMenuItem.objects.create(
+            AvailableDate="1402/08/02", Item=cls.items[1]
+        )
+        m.DailyMenuItem.objects.create(
+            AvailableDate="1402/08/02", Item=cls.items[0]
+        )
+        m.DailyMenuItem.objects.create(
+            AvailableDate="1402/08/07", Item=cls.items[2], IsActive=False
+        )
+        m.DailyMenuItem.objects.create(
+            AvailableDate="1402/09/01", Item=cls.items[2]
+        )
+        m.Holiday.objects.create(HolidayDate="1402/08/01")
+        m.Holiday.objects.create(HolidayDate="1402/08/01")
+
+        m.OrderItem.objects.create(
+            Personnel="test@eit",
+            DeliveryDate="1402/08/02",
+            Item=cls.items[0],
+            Quantity=2,
+            DeliveryBuilding="Building_1",
+            DeliveryFloor="Floor_1",
+            PricePerOne=100,
+        )
+        m.Subsidy.objects.create(Amount=50, FromDate="1402/01/01")
+        b.refresh_order_summary(
+            "test@eit", "1402/08/02", m.MealTypeChoices.LAUNCH
+        )
+
+    def setUp(self) -> None:
+        caches.calendar_cache.clear()
+        caches.deadline_cache.clear()
+        caches.subsidy_cache.clear()
+
+    def test_query_count(self):
+        with self.assertNumQueries(3):
+            PersonnelCalendar(1402, 8, "test@eit").get_calendar()
+
+        # Month's menu, holidays and the deadlines are cached now.
+        with self.assertNumQueries(1):
+            PersonnelCalendar(1402, 8, "other@eit").get_calendar()
+
+    def test_menu_change_invalidates_month(self):
+        PersonnelCalendar(1402, 8, "test@eit").get_calendar()
+        m.DailyMenuItem.objects.create(
+            AvailableDate="1402/08/09", Item=self.items[0]
+        )
+        data = PersonnelCalendar(1402, 8, "test@eit").get_calendar()
+        self.assertEqual(data["daysWithMenu"], [2, 7, 9])
+
+    def test_calendar_data(self):
+        data = PersonnelCalendar(1402, 8, "test@eit").get_calendar()
+
+        self.assertEqual(data["firstDayOfWeek"], 3)
+        self.assertEqual(data["lastDayOfMonth"], 30)
+        self.assertEqual(
+            sorted(data["holidays"]), [1, 4, 5, 11, 12, 18, 19, 25, 26]
+        )
+        self.assertEqual(data["daysWithMenu"], [2, 7])
+        self.assertEqual(
+            data["menuItems"],
+            [
+                {
+                    "date": "1402/08/02",
+                    "openForLaunch": False,
+                    "openForBreakfast": False,
+                    "items": [
+                        {"id": self.items[0].pk},
+                        {"id": self.items[1].pk},
+                    ],
+                }
+            ],
+        )
+        self.assertEqual(data["orderedDays"], [2])
+        self.assertEqual(data["totalDebt"], 150)
+        self.assertEqual(len(data["orders"]), 1)
+        self.assertEqual(
+            data["orders"][0]["orderBill"],
+            {"total": 200, "fanavaran": 50, "debt": 150},
+        )
+        self.assertEqual(data["orders"][0]["orderItems"][0]["quantity"], 2)
+
+
+class TestOrderSummary(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        m.Subsidy.objects.create(
+            Amount=150, FromDate="1402/01/01", UntilDate="1402/12/29"
+        )
+        cls.primary = m.Item.objects.create(
+            ItemName="primary",
+            Category=m.Category.objects.create(
+                CategoryName="primary", IsPrimary=True
+            ),
+            MealType=m.MealTypeChoices.LAUNCH,
+            CurrentPrice=100,
+        )
+        cls.drink = m.Item.objects.create(
+            ItemName="drink",
+            Category=m.Category.objects.create(CategoryName="drink"),
+            MealType=m.MealTypeChoices.LAUNCH,
+            CurrentPrice=30,
+        )
+
+    def setUp(self) -> None:
+        caches.subsidy_cache.clear()
+
+    def order(self, item, quantity=1):
+        m.OrderItem.objects.create(
+            Personnel="test@eit",
+            DeliveryDate="1402/08/02",
+            Item=item,
+            Quantity=quantity,
+            DeliveryBuilding="Building_1",
+            DeliveryFloor="Floor_1",
+            PricePerOne=item.CurrentPrice,
+        )
+        b.refresh_order_summary(
+            "test@eit", "1402/08/02", m.MealTypeChoices.LAUNCH
+        )
+
+    def test_refresh(self):
+        self.order(self.drink, 2)
+        summary = m.OrderSummary.objects.get()
+        self.assertFalse(summary.HasPrimary)
+        self.assertEqual(
+            (summary.TotalPrice, summary.PersonnelDebt, summary.SubsidySpent),
+            (60, 0, 60),
+        )
+
+        self.order(self.primary)
+        summary = m.OrderSummary.objects.get()
+        self.assertTrue(summary.HasPrimary)
+        self.assertEqual(
+            (summary.TotalPrice, summary.PersonnelDebt, summary.SubsidySpent),
+            (160, 10, 150),
+        )
+
+        m.OrderItem.objects.all().delete()
+        b.refresh_order_summary(
+            "test@eit", "1402/08/02", m.MealTypeChoices.LAUNCH
+        )
+        self.assertFalse(m.OrderSummary.objects.exists())
+
+    def test_subsidy_change(self):
+        self.order(self.primary)
+        m.Subsidy.objects.create(Amount=200, FromDate="1403/01/01")
+        subsidy = m.Subsidy.objects.get(FromDate="1402/01/01")
+        subsidy.Amount = 40
+        subsidy.save()
+        summary = m.OrderSummary.objects.get()
+        self.assertEqual((summary.SubsidyCap, summary.PersonnelDebt), (40, 60))
+
+    def test_subsidy_dates_change(self):
+        self.order(self.primary)
+        subsidy = m.Subsidy.objects.get(FromDate="1402/01/01")
+        subsidy.FromDate = "1403/01/01"
+        subsidy.save()
+        summary = m.OrderSummary.objects.get()
+        self.assertEqual((summary.SubsidyCap, summary.PersonnelDebt), (0, 100))
+
+        subsidy.FromDate = "1402/01/01"
+        subsidy.save()
+        summary = m.OrderSummary.objects.get()
+        self.assertEqual((summary.SubsidyCap, summary.PersonnelDebt), (150, 0))
+
+        subsidy.delete()
+        summary = m.OrderSummary.objects.get()
+        self.assertEqual((summary.SubsidyCap, summary.PersonnelDebt), (0, 100))
+
+    def test_stale_subsidy_cache(self):
+        caches.get_subsidy_index()
+        # Changed by another worker, this worker's cache is stale.
+        m.Subsidy.objects.update(Amount=40)
+        self.order(self.primary)
+        summary = m.OrderSummary.objects.get()
+        self.assertEqual((summary.SubsidyCap, summary.PersonnelDebt), (40, 60))
+        self.assertEqual(u.get_subsidy_amount("1402/08/02"), 150)
+
+    def test_rebuild_and_verify_command(self):
+        self.order(self.primary)
+        m.OrderSummary.objects.update(TotalPrice=0)
+        with self.assertRaises(CommandError):
+            call_command(
+                "rebuild_order_summary", "--verify", stdout=StringIO()
+            )
+
+        call_command("rebuild_order_summary", stdout=StringIO())
+        call_command("rebuild_order_summary", "--verify", stdout=StringIO())
+        self.assertEqual(m.OrderSummary.objects.get().TotalPrice, 100)
+
+
+def add_drink(item):
+    b.add_order_item(
+        m.OrderItem(
+            Personnel="test@eit",
+            DeliveryDate="1402/08/02",
+            Item=item,
+            Quantity=1,
+            DeliveryBuilding="Building_1",
+            DeliveryFloor="Floor_1",
+            PricePerOne=item.CurrentPrice,
+        ),
+        create_log="created",
+        increase_log="increased",
+        user="test@eit",
+    )
+
+
+class TestAddOrderItem(TestCase):
+    def test_insert_then_increase(self):
+        item = m.Item.objects.create(
+            ItemName="drink",
+            Category=m.Category.objects.create(CategoryName="drink"),
+            MealType=m.MealTypeChoices.LAUNCH,
+            CurrentPrice=30,
+        )
+        add_drink(item)
+        add_drink(item)
+
+        order_item = m.OrderItem.objects.get()
+        self.assertEqual(order_item.Quantity, 2)
+        logs = m.ActionLog.objects.filter(TableName="orderitem").order_by(
+            "id"
+        )
+        self.assertEqual(
+            [(log.ActionType, log.ActionDesc) for log in logs],
+            [("C", "created"), ("U", "increased")],
+        )
+        self.assertEqual(logs[1].ReferencedRecordId, order_item.id)
+        self.assertEqual(logs[1].OldData, {"Quantity": 1})
+
+        # The same shape as the updates logged by `Logger`.
+        order_item.Quantity = 3
+        order_item.save(log="changed")
+        self.assertEqual(
+            m.ActionLog.objects.get(ActionDesc="changed").OldData,
+            {"Quantity": 2},
+        )
+
+    def race(self, before_insert, after_insert=None):
+        """
+        Adding a drink while a parallel request runs `before_insert` between
+        the failed UPDATE and the INSERT of the order item, and
+        `after_insert` right after the INSERT.
+        """
+
+        item = m.Item.objects.create(
+            ItemName="drink",
+            Category=m.Category.objects.create(CategoryName="drink"),
+            MealType=m.MealTypeChoices.LAUNCH,
+            CurrentPrice=30,
+        )
+        inserts = []
+
+        # Outside of the savepoint of the INSERT, which is rolled back.
+        @contextmanager
+        def racing_atomic(*args, **kwargs):
+            is_first = not inserts
+            inserts.append(None)
+            if is_first:
+                before_insert(item)
+            try:
+                with transaction.atomic(*args, **kwargs):
+                    yield
+            finally:
+                if is_first and after_insert:
+                    after_insert(item)
+
+        with patch.object(
+            b, "transaction", SimpleNamespace(atomic=racing_atomic)
+        ):
+            add_drink(item)
+        return m.ActionLog.objects.filter(TableName="orderitem").order_by(
+            "id"
+        )
+
+    def test_inserted_in_parallel(self):
+        logs = self.race(add_drink)
+        self.assertEqual(m.OrderItem.objects.get().Quantity, 2)
+        self.assertEqual(
+            [(log.ActionType, log.ActionDesc) for log in logs],
+            [("C", "created"), ("U", "increased")],
+        )
+
+    def test_removed_in_parallel(self):
+        logs = self.race(
+            add_drink, lambda item: m.OrderItem.objects.all().delete()
+        )
+        self.assertEqual(m.OrderItem.objects.get().Quantity, 1)
+        self.assertEqual(
+            [(log.ActionType, log.ActionDesc) for log in logs],
+            [("C", "created"), ("C", "created")],
+        )
+
+
+@skipUnlessDBFeature("test_db_allows_multiple_connections")
+class TestAddOrderItemConcurrency(TransactionTestCase):
+    THREADS = 8
+    REQUESTS_PER_THREAD = 5
+
+    def test_no_increment_is_lost(self):
+        item = m.Item.objects.create(
+            ItemName="drink",
+            Category=m.Category.objects.create(CategoryName="drink"),
+            MealType=m.MealTypeChoices.LAUNCH,
+            CurrentPrice=30,
+        )
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def hammer():
+            try:
+                barrier.wait()
+                for _ in range(self.REQUESTS_PER_THREAD):
+                    with transaction.atomic():
+                        add_drink(item)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=hammer) for _ in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.THREADS * self.REQUESTS_PER_THREAD
+        self.assertEqual(m.OrderItem.objects.get().Quantity, total)
+        self.assertEqual(
+            m.ActionLog.objects.filter(TableName="orderitem").count(), total
+        )
+
+
+class TestMessage(unittest.TestCase):
+    def test_request_scoped(self):
+        message = Message()
+        first, second = HttpRequest(), HttpRequest()
+        message.add_message(first, "first", Message.ERROR)
+        message.add_message(second, "second")
+        message.add_message(first, "third")
+
+        self.assertEqual(
+            [msg["message"] for msg in message.messages(first)],
+            ["first", "third"],
+        )
+        self.assertEqual(message.messages(first), [])
+        self.assertEqual(Message().messages(second)[0]["level"], Message.INFO)
+
+    def test_threads(self):
+        message = Message()
+        results = []
+
+        def handle(index):
+            request = HttpRequest()
+            for _ in range(100):
+                message.add_message(request, str(index))
+            results.append(
+                {msg["message"] for msg in message.messages(request)}
+            )
+
+        threads = [
+            threading.Thread(target=handle, args=(index,))
+            for index in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [{str(i)} for i in range(8)])
+
+    def test_memory_is_flat(self):
+        message = Message()
+
+        def handle(index):
+            request = HttpRequest()
+            message.add_message(request, "failed", Message.ERROR)
+            # Half of the requests return early, without collecting.
+            if index % 2:
+                message.messages(request)
+
+        tracemalloc.start()
+        try:
+            for index in range(10_000):
+                handle(index)
+            warmed_up, _ = tracemalloc.get_traced_memory()
+            for index in range(100_000):
+                handle(index)
+            current, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(current - warmed_up, 64 * 1024)
+        self.assertEqual(vars(message), {})
+
+
+class TestMetrics(TestCase):
+    def setUp(self) -> None:
+        caches.auth_cache.clear()
+        metrics.registry.clear()
+        for name, is_admin in (("admin", True), ("user", False)):
+            m.User.objects.create(
+                Personnel=f"{name}@eit",
+                FullName=name,
+                Token=name,
+                ExpiredAt="1499/01/01",
+                IsAdmin=is_admin,
+            )
+
+    def test_histogram(self):
+        histogram = metrics.Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(
+            list(histogram.samples("x", 'view="v"')),
+            [
+                'x_bucket{view="v",le="1"} 2',
+                'x_bucket{view="v",le="10"} 3',
+                'x_bucket{view="v",le="+Inf"} 4',
+                'x_sum{view="v"} 56.5',
+                'x_count{view="v"} 4',
+            ],
+        )
+
+    def test_endpoint(self):
+        url = reverse("pors:metrics")
+        self.client.cookies["token"] = "user"
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.cookies["token"] = "admin"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+        # Only the first (forbidden) request is recorded yet, its user was
+        # not cached.
+        body = response.content.decode()
+        labels = '{view="pors:metrics"}'
+        self.assertIn(f"pors_request_duration_seconds_count{labels} 1", body)
+        self.assertIn(f"pors_request_queries_sum{labels} 1", body)
+        self.assertIn(f"pors_response_size_bytes_count{labels} 1", body)
+        self.assertIn('pors_cache_misses_total{cache="auth"}', body)
+        self.assertIn(
+            'pors_raw_query_calls_total{query="DayWithMenuOrderCount"}', body
+        )
+
+        self.client.get("/not-found/")
+        self.assertIn(
+            'pors_request_queries_count{view="unmatched"} 1',
+            metrics.registry.render(),
+        )
+
+
+class TestLogger(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item = m.Item.objects.create(
+            ItemName="drink",
+            Category=m.Category.objects.create(CategoryName="drink"),
+            MealType=m.MealTypeChoices.LAUNCH,
+            CurrentPrice=30,
+        )
+        m.OrderItem.objects.create(
+            Personnel="test@eit",
+            DeliveryDate="1402/08/02",
+            Item=item,
+            DeliveryBuilding="Building_1",
+            DeliveryFloor="Floor_1",
+            PricePerOne=30,
+        )
+
+    def test_unchanged_save_is_skipped(self):
+        order_item = m.OrderItem.objects.get()
+        with self.assertNumQueries(0):
+            order_item.save(log="nothing")
+        self.assertFalse(m.ActionLog.objects.filter(ActionDesc="nothing"))
+
+    def test_only_changed_fields_are_written_and_logged(self):
+        order_item = m.OrderItem.objects.get()
+        modified_at = order_item.ModifiedAt
+        order_item.Quantity = 3
+        # The UPDATE and the log insertion, no SELECT.
+        with self.assertNumQueries(2):
+            order_item.save(log="changed")
+
+        log = m.ActionLog.objects.get(ActionDesc="changed")
+        self.assertEqual(log.ActionType, m.ActionLog.ActionTypeChoices.UPDATE)
+        self.assertEqual(log.OldData, {"Quantity": 1})
+        order_item.refresh_from_db()
+        self.assertEqual(order_item.Quantity, 3)
+        self.assertNotEqual(order_item.ModifiedAt, modified_at)
+
+        # The snapshot is taken again after saving.
+        with self.assertNumQueries(0):
+            order_item.save()
+
+    def test_not_loaded_instance_falls_back_to_select(self):
+        order_item = m.OrderItem.objects.only("Quantity").get()
+        order_item.Quantity = 2
+        order_item.save(log="deferred")
+        self.assertEqual(
+            m.ActionLog.objects.get(ActionDesc="deferred").OldData["Quantity"],
+            1,
+        )
+
+
+class TestDateOrdinal(TestCase):
+    def test_ordinals_keep_the_order_of_dates(self):
+        date = jdatetime.date(1402, 1, 1)
+        previous = None
+        for _ in range(800):
+            ordinal = m.date_ordinal(date.strftime("%Y/%m/%d"))
+            if previous is not None:
+                self.assertEqual(ordinal, previous + 1)
+            previous = ordinal
+            date += jdatetime.timedelta(days=1)
+        self.assertIsNone(m.date_ordinal(None))
+
+    def test_ordinals_are_kept_in_sync(self):
+        holiday = m.Holiday.objects.create(HolidayDate="1402/12/29")
+        self.assertEqual(
+            holiday.HolidayDateOrdinal, m.date_ordinal("1402/12/29")
+        )
+
+        m.Subsidy.objects.bulk_create(
+            [m.Subsidy(Amount=10, FromDate="1403/01/01")]
+        )
+        subsidy = m.Subsidy.objects.get()
+        self.assertEqual(subsidy.FromDateOrdinal, m.date_ordinal("1403/01/01"))
+        self.assertIsNone(subsidy.UntilDateOrdinal)
+
+        # Only the changed fields are written by the Logger models.
+        m.OrderItem.objects.create(
+            Personnel="test@eit",
+            DeliveryDate="1402/08/02",
+            Item=m.Item.objects.create(
+                ItemName="drink",
+                Category=m.Category.objects.create(CategoryName="drink"),
+                MealType=m.MealTypeChoices.LAUNCH,
+                CurrentPrice=30,
+            ),
+            DeliveryBuilding="Building_1",
+            DeliveryFloor="Floor_1",
+            PricePerOne=30,
+        )
+        order_item = m.OrderItem.objects.get()
+        order_item.DeliveryDate = "1402/08/03"
+        order_item.save()
+        order_item.refresh_from_db()
+        self.assertEqual(
+            order_item.DeliveryDateOrdinal, m.date_ordinal("1402/08/03")
+        )
+
+
+@skipUnlessDBFeature("supports_explaining_query_execution")
+class TestQueryPlans(TestCase):
+    """The hot filters must be served by an index, not a full table scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = m.Category.objects.create(CategoryName="food")
+        cls.items = m.Item.objects.bulk_create(
+            m.Item(
+                ItemName=f"item {i}",
+                Category=category,
+                MealType=m.MealTypeChoices.values[i % 2],
+                CurrentPrice=100,
+            )
+            for i in range(10)
+        )
+        dates = [f"1402/08/{day:02}" for day in range(1, 31)]
+        m.User.objects.bulk_create(
+            m.User(
+                Personnel=f"user{i}@eit",
+                FullName=f"user {i}",
+                Token=f"token{i}",
+                ExpiredAt="1403/01/01",
+            )
+            for i in range(50)
+        )
+        m.DailyMenuItem.objects.bulk_create(
+            m.DailyMenuItem(AvailableDate=date, Item=item)
+            for date in dates
+            for item in cls.items
+        )
+        m.OrderItem.objects.bulk_create(
+            m.OrderItem(
+                Personnel=f"user{i}@eit",
+                DeliveryDate=date,
+                Item=cls.items[i % 10],
+                DeliveryBuilding="Building_1",
+                DeliveryFloor="Floor_1",
+                PricePerOne=100,
+            )
+            for date in dates
+            for i in range(20)
+        )
+
+    def assertUsesIndex(self, queryset):
+        table = queryset.model._meta.db_table
+        if connection.vendor == "sqlite":
+            scan = f"SCAN {table}"
+        elif connection.vendor == "postgresql":
+            scan = f"Seq Scan on {table}"
+            # Tiny tables are scanned anyway, unless it's discouraged.
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        else:
+            self.skipTest(f"Plans of {connection.vendor} are not parsed.")
+
+        plan = queryset.explain()
+        self.assertNotIn(scan, plan)
+        self.assertIn(table, plan)
+
+    def test_user_by_token(self):
+        self.assertUsesIndex(
+            m.User.objects.filter(Token="token7", IsActive=True)
+        )
+
+    def test_order_item_of_personnel(self):
+        self.assertUsesIndex(
+            m.OrderItem.objects.filter(
+                Personnel="user1@eit",
+                DeliveryDate="1402/08/02",
+                Item=self.items[1],
+            )
+        )
+        self.assertUsesIndex(
+            m.OrderItem.objects.filter(
+                Personnel="user1@eit",
+                DeliveryDate="1402/08/02",
+                Item__MealType=m.MealTypeChoices.LAUNCH,
+            )
+        )
+
+    def test_order_items_of_day(self):
+        self.assertUsesIndex(
+            m.OrderItem.objects.filter(
+                DeliveryDateOrdinal=m.date_ordinal("1402/08/02"),
+                Item=self.items[1],
+            )
+        )
+        self.assertUsesIndex(
+            m.OrderItem.objects.filter(
+                DeliveryDateOrdinal=m.date_ordinal("1402/08/02"),
+                Item__MealType=m.MealTypeChoices.LAUNCH,
+            )
+        )
+
+    def test_daily_menu_item(self):
+        self.assertUsesIndex(
+            m.DailyMenuItem.objects.filter(
+                Item=self.items[1],
+                AvailableDate="1402/08/02",
+                IsActive=True,
+                Item__IsActive=True,
+            )
+        )
+        self.assertUsesIndex(
+            m.DailyMenuItem.objects.filter(
+                AvailableDateOrdinal__range=(
+                    m.date_ordinal("1402/08/01"),
+                    m.date_ordinal("1402/08/30"),
+                )
+            )
+        )
+
+
+class TestActionLogBuffer(TestCase):
+    def log(self, msg):
+        return m.ActionLog.objects.log(
+            m.ActionLog.ActionTypeChoices.READ, log_msg=msg
+        )
+
+    def test_flush(self):
+        buffer = log_writer.ActionLogBuffer(max_size=10)
+        for i in range(3):
+            buffer.add(m.ActionLog(ActionType="R", ActionDesc=str(i)))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(m.ActionLog.objects.count(), 3)
+
+    def test_bounded_queue(self):
+        buffer = log_writer.ActionLogBuffer(max_size=10, max_queued=5)
+        with self.assertLogs("pors.log_writer", "ERROR"):
+            for i in range(7):
+                buffer.add(m.ActionLog(ActionType="R", ActionDesc=str(i)))
+        self.assertEqual(len(buffer), 5)
+
+        # The database is down, the records are kept up to the limit.
+        with patch.object(
+            m.ActionLog._base_manager, "bulk_create", side_effect=Exception
+        ), self.assertLogs("pors.log_writer", "ERROR") as logs:
+            buffer.add(m.ActionLog(ActionType="R", ActionDesc="7"))
+            self.assertEqual(buffer.flush(), 0)
+        self.assertIn("Dropped 1 queued action logs.", logs.output[0])
+        self.assertEqual(len(buffer), 5)
+
+        self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(
+            [log.ActionDesc for log in m.ActionLog.objects.order_by("id")],
+            ["3", "4", "5", "6", "7"],
+        )
+
+    def test_writer_recovers(self):
+        buffer = log_writer.ActionLogBuffer(flush_interval=0.01)
+        flushed = threading.Event()
+        calls = []
+
+        def bulk_create(records, batch_size):
+            calls.append([log.ActionDesc for log in records])
+            if len(calls) == 1:
+                raise Exception("connection is broken")
+            flushed.set()
+
+        # The writer thread would insert through its own connection,
+        # outside of the test's transaction.
+        with patch.object(
+            m.ActionLog._base_manager, "bulk_create", side_effect=bulk_create
+        ), patch.object(
+            log_writer, "close_old_connections"
+        ) as close_old_connections, self.assertLogs(
+            "pors.log_writer", "ERROR"
+        ):
+            buffer.add(m.ActionLog(ActionType="R", ActionDesc="0"))
+            buffer.start()
+            self.assertTrue(flushed.wait(5))
+            buffer.stop()
+
+        self.assertEqual(calls, [["0"], ["0"]])
+        self.assertEqual(len(buffer), 0)
+        # The connection of the failed flush is checked before the next one.
+        self.assertGreaterEqual(close_old_connections.call_count, 2)
+
+    @override_settings(PORS_ACTION_LOG_MODE=log_writer.BUFFERED)
+    def test_buffered_mode(self):
+        buffer = log_writer.ActionLogBuffer()
+        # The writer thread would insert through its own connection,
+        # outside of the test's transaction.
+        buffer.start = lambda: None
+        with patch.object(log_writer, "buffer", buffer):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(0):
+                    record = self.log("buffered")
+            self.assertIsNone(record.pk)
+            self.assertEqual(len(buffer), 1)
+
+            # Logs of a rolled back transaction are dropped.
+            with self.captureOnCommitCallbacks(execute=False):
+                self.log("rolled back")
+            self.assertEqual(len(buffer), 1)
+
+            buffer.stop()
+
+        log = m.ActionLog.objects.get()
+        self.assertEqual(log.ActionDesc, "buffered")
+        self.assertLess(log.ActionAt, timezone.now())
+
+    def test_sync_mode(self):
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(self.log("sync").pk)
+
+
+class TestXlsxReport(unittest.TestCase):
+    def test_report(self):
+        rows = ({"Name": f"item {i}", "Count": i} for i in range(1000))
+        output = BytesIO()
+        self.assertEqual(write_xlsx(output, rows, ["نام", "تعداد"]), 1000)
+
+        with zipfile.ZipFile(output) as xlsx:
+            sheet = xlsx.read("xl/worksheets/sheet1.xml").decode()
+
+        self.assertIn("item 999", sheet)
+        # Widest cells are "item 999" and the header, plus 2.
+        self.assertIn('<col min="1" max="1" width="10.7109375"', sheet)
+        self.assertIn('<col min="2" max="2" width="7.7109375"', sheet)
+
+    def test_grouped_report(self):
+        rows = [
+            {"Item": "kebab", "Provider": "A"},
+            {"Item": "rice", "Provider": "A"},
+            {"Item": "soup", "Provider": "B"},
+        ]
+        output = BytesIO()
+        self.assertEqual(
+            write_grouped_xlsx(
+                output, rows, ["آیتم", "تامین کننده"], "Provider"
+            ),
+            3,
+        )
+        with zipfile.ZipFile(output) as xlsx:
+            sheet = xlsx.read("xl/worksheets/sheet1.xml").decode()
+
+        # Title, headers, two rows, two empty rows, then the next section.
+        for cell, value in [
+            ("A1", "A"),
+            ("B2", "تامین کننده"),
+            ("A4", "rice"),
+            ("A7", "B"),
+            ("A9", "soup"),
+        ]:
+            self.assertRegex(sheet, f'<c r="{cell}" [^>]*><is><t>{value}<')
+        self.assertNotIn('<row r="5"', sheet)
+        self.assertNotIn('<row r="10"', sheet)
+
+
+class TestPeekRows(TestCase):
+    def test_single_query(self):
+        m.Category.objects.create(CategoryName="drink")
+        m.Category.objects.create(CategoryName="food")
+        with self.assertNumQueries(1):
+            rows = u.peek_rows(
+                m.Category.objects.order_by("id").values("CategoryName")
+            )
+            self.assertEqual(
+                [row["CategoryName"] for row in rows], ["drink", "food"]
+            )
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(
+                u.peek_rows(m.Category.objects.filter(CategoryName="soup"))
+            )
+        self.assertIsNone(u.peek_rows(iter([])))
+
+
+class TestCsvReport(unittest.TestCase):
+    def test_dict_rows(self):
+        rows = ({"Personnel": f"p{i}", "Debt": i} for i in range(3))
+        response = generate_csv(rows)
+
+        self.assertTrue(response.streaming)
+        content = b"".join(response)
+        self.assertTrue(content.startswith(codecs.BOM_UTF8))
+        self.assertEqual(
+            content[len(codecs.BOM_UTF8) :].decode(),
+            "Personnel,Debt\r\np0,0\r\np1,1\r\np2,2\r\n",
+        )
+
+    def test_model_rows(self):
+        rows = [m.Category(id=1, CategoryName="drink")]
+        content = b"".join(generate_csv(rows))
+        self.assertEqual(
+            content[len(codecs.BOM_UTF8) :].decode(),
+            "id,CategoryName,IsPrimary\r\n1,drink,False\r\n",
+        )
+
+
+def numbers_report(rows):
+    """A report of `count` numbers, for testing purposes."""
+
+    return reports.Report(
+        extension="csv",
+        validate=lambda data: data,
+        rows=rows,
+        dates=lambda count: ("1400/01/01", "1400/01/01"),
+        write=write_csv,
+        log_msg=lambda count: f"{count} numbers report",
+        log_model=m.Item,
+    )
+
+
+class TestReportJobQueue(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        reports_dir = override_settings(PORS_REPORTS_DIR=directory.name)
+        reports_dir.enable()
+        self.addCleanup(reports_dir.disable)
+        self.now = 1000.0
+        self.submitted = []
+        executor = type("Executor", (), {})()
+        executor.submit = lambda fn, job: self.submitted.append(job)
+        self.queue = report_jobs.ReportJobQueue(
+            directory=Path(directory.name),
+            dedup_window=60,
+            executor=executor,
+            timer=lambda: self.now,
+        )
+
+        def rows(count):
+            if count < 0:
+                raise ValueError("negative count")
+            return ({"Number": i} for i in range(count))
+
+        report = numbers_report(rows)
+        patcher = patch.dict(reports.REPORTS, {"numbers": report})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generated_report(self):
+        job = self.queue.submit("numbers", {"count": 3}, "admin@eit")
+        self.assertEqual(self.queue.get(job.id).status, job.PENDING)
+
+        self.queue.run(self.submitted.pop())
+        # Loaded from the disk, like the other processes do.
+        job = self.queue.get(job.id)
+        self.assertEqual(job.status, job.DONE)
+        self.assertEqual(
+            job.path.read_bytes(),
+            codecs.BOM_UTF8 + b"Number\r\n0\r\n1\r\n2\r\n",
+        )
+        self.assertTrue(
+            m.ActionLog.objects.filter(
+                User="admin@eit", ActionDesc="3 numbers report"
+            ).exists()
+        )
+
+    def test_empty_report(self):
+        job = self.queue.submit("numbers", {"count": 0}, "admin@eit")
+        self.queue.run(self.submitted.pop())
+        job = self.queue.get(job.id)
+        self.assertEqual(job.status, job.EMPTY)
+        self.assertFalse(job.path.exists())
+
+    def test_failed_report(self):
+        job = self.queue.submit("numbers", {"count": -1}, "admin@eit")
+        with self.assertLogs("pors.report_jobs", "ERROR"):
+            self.queue.run(self.submitted.pop())
+        job = self.queue.get(job.id)
+        self.assertEqual((job.status, job.error), (job.FAILED, "negative count"))
+        self.assertFalse(job.path.exists())
+
+        # Failed jobs are not reused.
+        self.assertNotEqual(
+            self.queue.submit("numbers", {"count": -1}, "admin@eit").id, job.id
+        )
+
+    def test_deduplication(self):
+        job = self.queue.submit("numbers", {"count": 3}, "admin@eit")
+        self.assertIs(
+            self.queue.submit("numbers", {"count": 3}, "admin@eit"), job
+        )
+        self.assertIsNot(
+            self.queue.submit("numbers", {"count": 4}, "admin@eit"), job
+        )
+        # Each user gets (and is logged for) their own job.
+        self.assertIsNot(
+            self.queue.submit("numbers", {"count": 3}, "other@eit"), job
+        )
+
+        self.now += 60
+        self.assertIsNot(
+            self.queue.submit("numbers", {"count": 3}, "admin@eit"), job
+        )
+        self.assertEqual(len(self.submitted), 4)
+
+    def test_dead_worker(self):
+        job = self.queue.submit("numbers", {"count": 3}, "admin@eit")
+        job.status = job.RUNNING
+        job.save()
+        self.now = job.state_path.stat().st_mtime + 60
+        self.assertEqual(self.queue.get(job.id).status, job.RUNNING)
+
+        self.now += self.queue.timeout
+        with self.assertLogs("pors.report_jobs", "ERROR"):
+            job = self.queue.get(job.id)
+        self.assertEqual(job.status, job.FAILED)
+        self.assertEqual(self.queue.get(job.id).status, job.FAILED)
+
+    def test_heartbeat(self):
+        queue = report_jobs.ReportJobQueue(
+            directory=self.queue.directory,
+            timeout=0.15,
+            executor=self.queue._executor,
+        )
+        statuses = []
+
+        def rows(count):
+            # A job which is running longer than the timeout.
+            time.sleep(0.3)
+            statuses.append(queue.get(job.id).status)
+            return ({"Number": i} for i in range(count))
+
+        reports.REPORTS["numbers"] = numbers_report(rows)
+        job = queue.submit("numbers", {"count": 3}, "admin@eit")
+        queue.run(self.submitted.pop())
+        self.assertEqual(statuses, [job.RUNNING])
+        self.assertEqual(queue.get(job.id).status, job.DONE)
+
+    def test_concurrent_purge(self):
+        job = self.queue.submit("numbers", {"count": 3}, "admin@eit")
+        missing = job.state_path.with_name(f"{uuid.uuid4()}.json")
+        # Another process purges it between the glob and the stat.
+        with patch.object(Path, "glob", return_value=[missing]):
+            self.now += 60
+            self.assertIsNot(
+                self.queue.submit("numbers", {"count": 3}, "admin@eit"), job
+            )
+
+    def test_purged_download(self):
+        caches.auth_cache.clear()
+        caches.system_setting_cache.clear()
+        m.SystemSetting.objects.create()
+        m.User.objects.create(
+            Personnel="admin@eit",
+            FullName="admin",
+            Token="admin",
+            ExpiredAt="1499/01/01",
+            IsAdmin=True,
+        )
+        job = self.queue.submit("numbers", {"count": 3}, "admin@eit")
+        self.queue.run(self.submitted.pop())
+        url = reverse("pors:report_job_download", args=[job.id])
+        self.client.cookies["token"] = "admin"
+        with patch.object(report_jobs, "queue", self.queue):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+            job.path.unlink()
+            self.assertEqual(self.client.get(url).status_code, 410)
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.queue.get("../../settings"))
+        self.assertIsNone(self.queue.get(str(uuid.uuid4())))
+
+
+class TestReportCache(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        reports_dir = override_settings(PORS_REPORTS_DIR=directory.name)
+        reports_dir.enable()
+        self.addCleanup(reports_dir.disable)
+
+        self.generated = 0
+
+        def rows(count):
+            self.generated += 1
+            return ({"Number": i} for i in range(count))
+
+        report = numbers_report(rows)
+        patcher = patch.dict(reports.REPORTS, {"numbers": report})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate(self, count=3):
+        with reports.generate("numbers", {"count": count}) as output:
+            return output.read()
+
+    def test_past_reports_are_cached(self):
+        content = self.generate()
+        self.assertEqual(self.generate(), content)
+        self.assertEqual(self.generated, 1)
+
+        self.generate(count=4)
+        self.assertEqual(self.generated, 2)
+
+    def test_invalidation(self):
+        self.generate()
+        report_cache.invalidate("1399/12/01", "1400/01/01")
+        self.generate()
+        self.assertEqual(self.generated, 2)
+
+        # Other months are not affected.
+        report_cache.invalidate("1400/02/01", "1400/02/01")
+        self.generate()
+        self.assertEqual(self.generated, 2)
+
+        report_cache.invalidate("1400/02/01")
+        self.generate()
+        self.assertEqual(self.generated, 3)
+
+    def test_invalidated_while_generating(self):
+        report_cache.invalidate("1400/01/01", "1400/01/01")
+        with tempfile.TemporaryFile() as output:
+            report_cache.store(
+                "numbers",
+                {"count": 3},
+                ("1400/01/01", "1400/01/01"),
+                "csv",
+                output,
+                started_at=0,
+            )
+        self.generate()
+        self.assertEqual(self.generated, 1)
+
+    def test_order_change_invalidates(self):
+        self.generate()
+        with self.captureOnCommitCallbacks(execute=True):
+            b.refresh_order_summary(
+                "test@eit", "1400/01/01", m.MealTypeChoices.LAUNCH
+            )
+        self.generate()
+        self.assertEqual(self.generated, 2)
+
+    def test_current_reports_are_not_cached(self):
+        today = u.get_str(u.localnow().date())
+        report = reports.REPORTS["numbers"]._replace(
+            dates=lambda count: (today, today)
+        )
+        with patch.dict(reports.REPORTS, {"numbers": report}):
+            self.generate()
+            self.generate()
+        self.assertEqual(self.generated, 2)
+
+    def test_current_reports_are_streamed(self):
+        today = u.get_str(u.localnow().date())
+        report = reports.REPORTS["numbers"]._replace(
+            dates=lambda count: (today, today), stream=generate_csv
+        )
+        content = codecs.BOM_UTF8 + b"Number\r\n0\r\n1\r\n2\r\n"
+        with patch.dict(reports.REPORTS, {"numbers": report}):
+            response = reports.respond("numbers", {"count": 3})
+            self.assertNotIn("Content-Length", response)
+            self.assertEqual(b"".join(response), content)
+            self.assertIsNone(reports.respond("numbers", {"count": 0}))
+
+        # Past reports are generated into the cache first.
+        response = reports.respond("numbers", {"count": 3})
+        self.assertIn("Content-Length", response)
+        response.close()
+        self.assertEqual(self.generate(), content)
+        self.assertEqual(self.generated, 3)
@@ -60,10 +60,26 @@ urlpatterns = [
         report_views.personnel_financial_report,
         name="personnel_financial_report",
     ),
+    path(
+        "administrative/reports/jobs/",
+        report_views.create_report_job,
+        name="create_report_job",
+    ),
+    path(
+        "administrative/reports/jobs/<uuid:job_id>/",
+        report_views.report_job_status,
+        name="report_job_status",
+    ),
+    path(
+        "administrative/reports/jobs/<uuid:job_id>/download/",
+        report_views.report_job_download,
+        name="report_job_download",
+    ),
     path("auth-gateway/", views.auth_gateway, name="gateway"),
     path("admin/", views.uiadmin, name="admin_panel"),
     path("", views.ui, name="personnel_panel"),
     path("available-users/", views.available_users, name="available_users"),
+    path("administrative/metrics/", views.metrics, name="metrics"),
     path("administrative/reasons/", views.admin_manipulation_reasons, name="manipulation_reasons"),
 
 ]
@@ -1,10 +1,12 @@
 import codecs
 import csv
-import io
-import json
 import re
+from collections import namedtuple
+from functools import lru_cache
 from hashlib import sha256
-from typing import Optional
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import Iterator, Optional
 from urllib.parse import urlunparse
 
 import jdatetime
@@ -12,12 +14,13 @@ import pytz
 import xlsxwriter
 from django.db import connection
 from django.db.models import QuerySet
-from django.http import HttpResponse
+from django.http import FileResponse, StreamingHttpResponse
 from persiantools.jdatetime import JalaliDate
 from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from . import caches
 from . import models as m
 from .messages import Message
 
@@ -53,19 +56,6 @@ def first_and_last_day_date(month: int, year: int) -> tuple[str, str]:
     return first_day_date, last_day_date
 
 
-def get_weekend_holidays(year: int, month: int) -> list[jdatetime.date]:
-    """This function is responsible for calculating weekend holidays"""
-
-    # Todo get last day of month in jalali date
-    last_day_of_month = JalaliDate.days_in_month(month, year)
-    holidays = []
-    for daynum in range(1, last_day_of_month + 1):
-        daynum_date = jdatetime.date(year, month, daynum)
-        if daynum_date.weekday() in (6, 5):
-            holidays.append(daynum_date.strftime("%Y/%m/%d").replace("-", "/"))
-    return holidays
-
-
 def get_current_date() -> tuple[int, int, int]:
     """Returning current date"""
     now = localnow()
@@ -123,25 +113,6 @@ def split_dates(dates, mode: str):
         return new_dates
 
 
-def split_json_dates(dates: str) -> dict[str, str]:
-    """
-    Splitting a json list of dates and generating a dict with day number.
-    This function assumes that you have a `day` key in your json data that
-    contains a VALID date
-
-    Args:
-        dates: serialized (json) data contains a `date` key.
-
-    Returns:
-        Deserialized data, date key will contain the number of day only.
-    """
-
-    dates = json.loads(dates)
-    for obj in dates:
-        obj["day"] = int(obj["day"].split("/")[2])
-    return dates
-
-
 def validate_date(date: str) -> Optional[str]:
     """
     Validating date value and format.
@@ -169,32 +140,118 @@ def validate_date(date: str) -> Optional[str]:
         return None
 
 
-def execute_raw_sql_with_params(query: str, params: tuple) -> list:
+# Result modes of the raw queries: a dict per row, a namedtuple per row, or
+# a list per column (keyed by the column names).
+DICT_ROWS = "dict"
+TUPLE_ROWS = "tuple"
+COLUMNS = "columns"
+
+
+@lru_cache(maxsize=64)
+def _row_type(columns: tuple[str, ...]) -> type:
+    return namedtuple("Row", columns, rename=True)
+
+
+def _shape_rows(description, rows: list, mode: str):
+    columns = [col[0] for col in description]
+    if mode == DICT_ROWS:
+        return [dict(zip(columns, row)) for row in rows]
+    if mode == TUPLE_ROWS:
+        return list(map(_row_type(tuple(columns))._make, rows))
+    if mode == COLUMNS:
+        values = map(list, zip(*rows)) if rows else ([] for _ in columns)
+        return dict(zip(columns, values))
+    raise ValueError(f"Invalid result mode {mode!r}.")
+
+
+def execute_raw_sql_with_params(
+    query: str, params: tuple, mode: str = DICT_ROWS
+):
     """
     Executing raw queries via context manager
 
     Args:
         query: the raw query
         params: parameters used in query, avoiding sql injections
+        mode: shape of the result, DICT_ROWS (default), TUPLE_ROWS (the
+            cheapest, attributes are the column names) or COLUMNS.
 
     Returns:
         result: the data retrieved by query
     """
     with connection.cursor() as cursor:
         cursor.execute(query, params)
-        columns = [col[0] for col in cursor.description]
-        result = [dict(zip(columns, row)) for row in cursor.fetchall()]
-    return result
+        return _shape_rows(cursor.description, cursor.fetchall(), mode)
 
 
-def queryset_to_xlsx_response_food_provider_ordering(
-    queryset, persian_headers, providers
+def iterate_raw_sql_with_params(
+    query: str,
+    params: tuple,
+    mode: str = DICT_ROWS,
+    chunk_size: Optional[int] = None,
 ):
-    # Create an in-memory output file for the new workbook.
-    output = io.BytesIO()
+    """
+    Same as `execute_raw_sql_with_params`, but fetches the rows in chunks
+    of `chunk_size` (REPORT_CHUNK_SIZE by default) rows, and yields each
+    chunk in the requested `mode`.
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size or REPORT_CHUNK_SIZE)
+            if not rows:
+                return
+            yield _shape_rows(cursor.description, rows, mode)
+
+
+XLSX_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+)
+
+REPORT_CONTENT_TYPES = {"xlsx": XLSX_CONTENT_TYPE, "csv": "text/csv"}
+
+# Number of rows which are fetched from the database at once while
+# generating a report.
+REPORT_CHUNK_SIZE = 2000
+
+
+def iterate_rows(rows):
+    """
+    Iterating over the report rows, querysets are streamed from the
+    database (instead of being cached) to keep the memory usage bounded.
+    """
+
+    if isinstance(rows, QuerySet):
+        return rows.iterator(chunk_size=REPORT_CHUNK_SIZE)
+    return iter(rows)
+
+
+def peek_rows(rows) -> Optional[Iterator]:
+    """
+    Starting the iteration of the report rows (see `iterate_rows`), None
+    if there is no row. Only the first chunk gets fetched to check that,
+    so the report's query is not run twice (like `exists()` and then
+    iterating would do).
+    """
+
+    rows = iterate_rows(rows)
+    for first_row in rows:
+        return chain([first_row], rows)
+    return None
+
 
-    # Create a new Excel workbook and add a worksheet.
-    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+def new_xlsx_workbook(output):
+    """
+    Creating an xlsx workbook in the constant memory mode (rows are flushed
+    to a temp file as soon as they are written, so they MUST be written in
+    order), besides its table and header formats.
+
+    Returns:
+        tuple: workbook, worksheet, table_font, header_format
+    """
+
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
     worksheet = workbook.add_worksheet()
 
     # Define a format for the table that sets the font.
@@ -210,77 +267,100 @@ def queryset_to_xlsx_response_food_provider_ordering(
             "border": 1,
         }
     )
+    return workbook, worksheet, table_font, header_format
 
-    # spilting qs to providers
-    providers_qs = {}
-    for provider in providers:
-        providers_qs[provider] = queryset.filter(FoodProviderPersian=provider)
 
-    main_row_number = 0
-    for provider, qs in providers_qs.items():
-        worksheet.write(main_row_number, 0, provider, header_format)
-        main_row_number += 1
+def report_file_response(output, extension: str = "xlsx") -> FileResponse:
+    """
+    Streaming the generated report file (xlsx or csv) from its beginning,
+    the file gets closed (and deleted if it is a temp file) by the
+    response.
+    """
 
-        # Write Persian headers to the first row.
-        for col_num, header in enumerate(persian_headers):
-            worksheet.write(
-                0 + main_row_number, col_num, header, header_format
-            )
-        main_row_number += 1
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=f"report.{extension}",
+        content_type=REPORT_CONTENT_TYPES[extension],
+    )
+
+
+def write_grouped_xlsx(output, queryset, persian_headers, group_by) -> int:
+    """
+    Writing an xlsx report which has a section per group of the rows
+    (dicts) of the `queryset` into the (binary) `output` file. Each section
+    starts with the group's title and the `persian_headers`.
+
+    The rows are fetched in a single pass and the sections are emitted on
+    the group boundaries, so the `queryset` MUST be ordered by `group_by`
+    first.
+
+    Args:
+        output: Binary file which the workbook is written into.
+        queryset: Rows of the report, ordered by `group_by`.
+        persian_headers: Headers of the columns.
+        group_by: The key of the rows which the sections are based on.
+
+    Returns:
+        int: Number of the written rows.
+    """
+
+    workbook, worksheet, table_font, header_format = new_xlsx_workbook(
+        output
+    )
+
+    col_widths = [len(header) for header in persian_headers]
 
-        col_widths = [len(header) for header in persian_headers]
+    row_num = 0
+    rows_count = 0
+    groups = groupby(iterate_rows(queryset), key=itemgetter(group_by))
+    for group, rows in groups:
+        worksheet.write(row_num, 0, group, header_format)
+        row_num += 1
 
-        for row_num, obj in enumerate(qs):
+        for col_num, header in enumerate(persian_headers):
+            worksheet.write(row_num, col_num, header, header_format)
+        row_num += 1
+
+        for obj in rows:
             for col_num, data in enumerate(obj.values()):
                 value = str(data)  # Ensure value is a string
                 worksheet.write_string(
-                    row_num + main_row_number, col_num, value, table_font
+                    row_num, col_num, value, table_font
                 )  # Write as text
 
                 # update col width
                 col_widths[col_num] = max(col_widths[col_num], len(value))
-        main_row_number += len(qs) + 2
+            row_num += 1
+            rows_count += 1
 
-    # Adjust col len
+        # Two empty rows between the sections.
+        row_num += 2
+
+    # Adjust col len, the columns are written when the workbook is closed.
     for col_num, width in enumerate(col_widths):
         worksheet.set_column(col_num, col_num, width + 2)
 
-    # Close the workbook.
     workbook.close()
-
-    # Rewind the buffer.
-    output.seek(0)
-
-    # Create an HTTP response with the appropriate content type and headers.
-    response = HttpResponse(
-        output.read(),
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
-    response["Content-Disposition"] = "attachment; filename=report.xlsx"
-
-    return response
+    return rows_count
 
 
-def queryset_to_xlsx_response(queryset, persian_headers):
-    # Create an in-memory output file for the new workbook.
-    output = io.BytesIO()
+def write_xlsx(output, queryset, persian_headers) -> int:
+    """
+    Writing an xlsx report of the rows (dicts) of the `queryset` into the
+    (binary) `output` file, with the `persian_headers` as its first row.
 
-    # Create a new Excel workbook and add a worksheet.
-    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
-    worksheet = workbook.add_worksheet()
+    The queryset is streamed from the database and the workbook is written
+    in the constant memory mode, so the memory usage does not grow with the
+    number of rows.
 
-    # Define a format for the table that sets the font.
-    table_font = workbook.add_format({"font_name": "Tahoma", "font_size": 10})
+    Returns:
+        int: Number of the written rows.
+    """
 
-    # Add a bold format for headers.
-    header_format = workbook.add_format(
-        {
-            "bold": True,
-            "font_name": "Tahoma",
-            "font_size": 10,
-            "bg_color": "#D7E4BC",  # Light green background for headers
-            "border": 1,
-        }
+    workbook, worksheet, table_font, header_format = new_xlsx_workbook(
+        output
     )
 
     # Write Persian headers to the first row.
@@ -290,7 +370,8 @@ def queryset_to_xlsx_response(queryset, persian_headers):
     col_widths = [len(header) for header in persian_headers]
 
     # Write data to the sheet.
-    for row_num, obj in enumerate(queryset, start=1):
+    row_num = 0
+    for row_num, obj in enumerate(iterate_rows(queryset), start=1):
         for col_num, data in enumerate(obj.values()):
             value = str(data)  # Ensure value is a string
             worksheet.write_string(
@@ -300,24 +381,42 @@ def queryset_to_xlsx_response(queryset, persian_headers):
             # update col width
             col_widths[col_num] = max(col_widths[col_num], len(value))
 
-    # Adjust col len
+    # Adjust col len, the columns are written when the workbook is closed.
     for col_num, width in enumerate(col_widths):
         worksheet.set_column(col_num, col_num, width + 2)
 
-    # Close the workbook.
     workbook.close()
+    return row_num
 
-    # Rewind the buffer.
-    output.seek(0)
 
-    # Create an HTTP response with the appropriate content type and headers.
-    response = HttpResponse(
-        output.read(),
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
-    response["Content-Disposition"] = "attachment; filename=report.xlsx"
+class Echo:
+    """File-like object which returns what is written to it, instead of
+    keeping it, so `csv.writer` can be used to produce each line."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_rows(queryset):
+    """Yielding the header and then the values of each row."""
+
+    headers_appended = False
+
+    for obj in iterate_rows(queryset):
+        if isinstance(obj, dict):
+            keys = obj.keys()
+            values = obj.values()
+        else:
+            keys = []
+            values = []
+            for field in obj._meta.fields:
+                keys.append(field.name)
+                values.append(getattr(obj, field.name))
 
-    return response
+        if not headers_appended:
+            yield keys
+            headers_appended = True
+        yield values
 
 
 def generate_csv(queryset: QuerySet):
@@ -325,44 +424,45 @@ def generate_csv(queryset: QuerySet):
     This function generates a dynamic csv content based on
         the queryset data argument.
 
+    The content is streamed to the client line by line as the rows are
+    fetched from the database (or produced by the iterable), so it is
+    never kept in memory as a whole.
+
     Warnings:
         Please note that you have to customize your queryset via filter, values
             and other stuffs before using this function.
         All fields and values on received queryset will use in csv.
 
     Args:
-        queryset: The queryset that you want to generate csv from it.
+        queryset: The queryset (or an iterable of dicts/model instances)
+            that you want to generate csv from it.
 
     Returns:
-        str: csv content that generated from queryset.
+        StreamingHttpResponse: csv content that generated from queryset.
     """
-    response = HttpResponse(content_type="text/csv")
-    response.write(codecs.BOM_UTF8)
-
-    writer = csv.writer(response)
+    writer = csv.writer(Echo())
+    content = chain(
+        [codecs.BOM_UTF8],
+        (writer.writerow(row) for row in _csv_rows(queryset)),
+    )
+    return StreamingHttpResponse(content, content_type="text/csv")
 
-    headers_appended = False
 
-    for obj in queryset:
-        if isinstance(obj, dict):
-            data = obj.values()
-            if not headers_appended:
-                writer.writerow(obj.keys())
-                headers_appended = True
-            writer.writerow(data)
-        else:
-            keys = []
-            values = []
-            for field in obj._meta.fields:
-                keys.append(field.name)
-                values.append(getattr(obj, field.name))
+def write_csv(output, queryset) -> int:
+    """
+    Writing the csv content of `generate_csv` into the (binary) `output`
+    file.
 
-            if not headers_appended:
-                writer.writerow(keys)
-                headers_appended = True
-            writer.writerow(values)
+    Returns:
+        int: Number of the written rows (without the header).
+    """
 
-    return response
+    writer = csv.writer(Echo())
+    output.write(codecs.BOM_UTF8)
+    lines = -1
+    for lines, row in enumerate(_csv_rows(queryset)):
+        output.write(writer.writerow(row).encode())
+    return max(lines, 0)
 
 
 def validate_request_based_on_schema(schema: dict, data: dict):
@@ -390,43 +490,13 @@ def validate_request_based_on_schema(schema: dict, data: dict):
             raise ValueError(f"Invalid {param} value.")
 
 
-def get_specific_deadline(
-    weekday: int,
-    meal_type: m.Item.MealTypeChoices = None,
-    deadline: tuple = None,
-):
+def get_subsidy_amount(date: str) -> Optional[int]:
     """
-    Returning the submission's deadline based on the mealtype it has.
-    Deadline is fetched from db based on the weekday.
-
-    If meal_type parameter is not specified, all deadlines related to that
-        weekday will get returned instead.
-    Args:
-        meal_type: The submission's deadline.
-        weekday: Number of weekday (due to dynamic deadline logic).
-        deadline: named tuple for deadline that has Days and Hour args.
-
-    Returns:
-        Dict of specific weekday deadlines | Days and hour value.
-        Dict[str, namedtuple[Days, Hour]] | tuple[int, int]
+    Returning the subsidy amount of the date, None if no subsidy has been
+    defined for it. Looked up in the cached `caches.SubsidyIndex`.
     """
 
-    if not meal_type and deadline:
-        qs = m.Deadlines.objects.filter(WeekDay=weekday)
-        deadlines = {}
-        for row in qs:
-            if row.MealType == m.MealTypeChoices.BREAKFAST:
-                deadlines["breakfast"] = deadline(row.Days, row.Hour)
-            else:
-                deadlines["launch"] = deadline(row.Days, row.Hour)
-        return deadlines
-
-    qs = m.Deadlines.objects.get(MealType=meal_type, WeekDay=weekday)
-
-    if deadline:
-        return deadline(qs.Days, qs.Hour)
-
-    return qs.Days, qs.Hour
+    return caches.get_subsidy_index().get(date)
 
 
 def generate_token_hash(
@@ -467,7 +537,8 @@ def get_deadlines(
     deadline: tuple,
 ) -> tuple[MealTypeDeadlines, MealTypeDeadlines]:
     """
-    Fetching deadlines from database and forming 2 dicts from the data.
+    Reading deadlines from the cached `caches.DeadlineTable` and forming
+    2 dicts from the data.
     Dicts are formed based on the meal type, one for each type.
     Dicts keys are the weekday nums, so we have 7 keys for each dict.
 
@@ -483,39 +554,26 @@ def get_deadlines(
 
     """
 
-    deadlines = m.Deadlines.objects.all()
+    deadlines = caches.get_deadline_table().deadlines
     breakfast_deadlines = {}
     launch_deadlines = {}
 
-    for row in deadlines:
-        if row.MealType == m.MealTypeChoices.BREAKFAST:
-            breakfast_deadlines[row.WeekDay] = deadline(row.Days, row.Hour)
+    for (weekday, meal_type), row in deadlines.items():
+        if meal_type == m.MealTypeChoices.BREAKFAST:
+            breakfast_deadlines[weekday] = deadline(*row)
         else:
-            launch_deadlines[row.WeekDay] = deadline(row.Days, row.Hour)
+            launch_deadlines[weekday] = deadline(*row)
 
     return breakfast_deadlines, launch_deadlines
 
 
 def fetch_available_location():
-    """fetch available location (building and floors from HR)"""
-    from .serializers import BuildingSerializer
-
-    building_code_prefix = "Building_"
-    qs = m.HR_constvalue.objects.filter(Code__startswith=building_code_prefix)
-    if not qs:
-        return {}
-
-    buildings = []
-    for building in qs:
-        floors_qs = m.HR_constvalue.objects.filter(Parent_id=building.id)
-        buildings.append(
-            dict(
-                code=building.Code,
-                title=building.Caption,
-                floors=floors_qs,
-            )
-        )
-    return BuildingSerializer(buildings, many=True).data
+    """
+    fetch available location (building and floors from HR), out of the
+    cached `caches.LocationTree`.
+    """
+
+    return caches.get_location_tree().buildings or {}
 
 
 def raise_report_notfound(message_obj: Message, request: Request):
@@ -1,6 +1,5 @@
 from random import getrandbits
 
-from django.db.models import Q
 from django.http.response import HttpResponse
 from django.shortcuts import render
 from django.urls import reverse
@@ -11,23 +10,21 @@ from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 
 from . import business as b
+from . import metrics as mt
+from .caches import get_system_setting
 from .decorators import (
     authenticate,
     check,
     is_open_for_admins,
     is_open_for_personnel,
 )
-from .general_actions import GeneralCalendar
+from .general_actions import GeneralCalendar, PersonnelCalendar
 from .messages import Message
 from .models import (
     AdminManipulationReason,
     Category,
-    DailyMenuItem,
     Item,
     ItemsOrdersPerDay,
-    Order,
-    Subsidy,
-    SystemSetting,
     User,
 )
 from .serializers import (
@@ -36,20 +33,16 @@ from .serializers import (
     CategorySerializer,
     Deadline,
     FirstPageSerializer,
-    ListedDaysWithMenu,
     MenuItemSerializer,
-    OrderSerializer,
-    PersonnelMenuItemSerializer,
     UserSerializer,
 )
 from .utils import (
-    execute_raw_sql_with_params,
     fetch_available_location,
     first_and_last_day_date,
     generate_token_hash,
     get_deadlines,
+    get_subsidy_amount,
     localnow,
-    split_dates,
 )
 
 # todo shipment
@@ -189,74 +182,19 @@ def personnel_calendar(request, user: User, override_user: User):
 
     month = int(request.query_params.get("month"))
     year = int(request.query_params.get("year"))
-    first_day_date, last_day_date = first_and_last_day_date(month, year)
 
     personnel = (
         user.Personnel if not override_user else override_user.Personnel
     )
 
-    general_calendar = GeneralCalendar(year, month)
-
-    # Days that have menues.
-    days_with_menu_qs = (
-        DailyMenuItem.objects.filter(
-            AvailableDate__range=[first_day_date, last_day_date]
-        )
-        .values("AvailableDate")
-        .order_by("AvailableDate")
-        .distinct()
-    )
-    days_with_menu_data = ListedDaysWithMenu(days_with_menu_qs).data
-    splited_days_with_menu = split_dates(
-        days_with_menu_data["dates"], mode="day"
-    )
-
-    menu_items = (
-        DailyMenuItem.objects.filter(
-            AvailableDate__range=[first_day_date, last_day_date],
-            IsActive=True,
-        )
-        .order_by("AvailableDate", "Item_id")
-        .values("AvailableDate", "Item_id")
+    calendar = PersonnelCalendar(
+        year,
+        month,
+        personnel,
+        bypass_date_limitations=True if override_user else False,
     )
-    menu_items_serialized_data = PersonnelMenuItemSerializer(
-        menu_items,
-        context={"bypass_date_limitations": True if override_user else False},
-    ).data
-
-    orders = Order.objects.filter(
-        DeliveryDate__range=(first_day_date, last_day_date),
-        Personnel=personnel,
-    )
-    totalDebt = sum([obj.PersonnelDebt for obj in orders])
-
-    ordered_days_list = [obj.DeliveryDate for obj in orders]
-    spilitted_ordered_days_list = split_dates(ordered_days_list, "day")
-
-    # Couldn't use django orm because "Order" doesn't have
-    # relation with orderitem table.
-    with open("./pors/SQLs/PersonnelOrderWithBill.sql", mode="r") as f:
-        query = f.read()
-
-    params = (first_day_date, last_day_date, personnel)
-    order_items = execute_raw_sql_with_params(query, params)
-
-    orders_items_data = OrderSerializer(order_items).data
-    ordered_days_and_debt = {
-        "orderedDays": spilitted_ordered_days_list,
-        "totalDebt": totalDebt,
-    }
-
-    # Unpacking Serializers data into 1 single dictionary
-    final_schema = {
-        **general_calendar.get_calendar(),
-        "daysWithMenu": splited_days_with_menu,
-        **menu_items_serialized_data,
-        **ordered_days_and_debt,
-        **orders_items_data,
-    }
     return Response(
-        data=(final_schema),
+        data=calendar.get_calendar(),
         status=status.HTTP_200_OK,
     )
 
@@ -331,8 +269,17 @@ def first_page(request, user: User, override_user: User):
     """
     if override_user:
         user = override_user
+    # The cached user only has the identity fields, see `caches`.
+    user.refresh_from_db(
+        fields=[
+            "FullName",
+            "Profile",
+            "LastDeliveryBuilding",
+            "LastDeliveryFloor",
+        ]
+    )
 
-    system_settings = SystemSetting.objects.last()
+    system_settings = get_system_setting()
     open_for_admins = system_settings.IsSystemOpenForAdmin
     open_for_personnel = system_settings.IsSystemOpenForPersonnel
 
@@ -489,14 +436,7 @@ def get_subsidy(request):
             }
         )
 
-    subsidy = (
-        Subsidy.objects.filter(
-            Q(FromDate__lte=date, UntilDate__isnull=True)
-            | Q(FromDate__lte=date, UntilDate__gte=date)
-        )
-        .first()
-        .Amount
-    )
+    subsidy = get_subsidy_amount(date)
 
     return Response({"data": {"subsidy": subsidy}})
 
@@ -579,6 +519,7 @@ def auth_gateway(request):
         token = generate_token_hash(personnel, full_name, getrandbits(10))
         personnel_user_record.Token = token
         personnel_user_record.ExpiredAt = cookies_expire_time
+        # Saving the record also drops the old token from `auth_cache`.
         personnel_user_record.save()
 
         response.set_cookie(
@@ -640,3 +581,17 @@ def admin_manipulation_reasons(request, user, override_user):
     qs = AdminManipulationReason.objects.all()
     serializer = AdminManipulationReasonsSerializer(qs, many=True).data
     return Response(serializer, status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@authenticate(privileged_users=True)
+def metrics(request, user, override_user):
+    """
+    Metrics of the requests, raw queries and caches of this process, in
+    the Prometheus text format (see `metrics`).
+    """
+
+    return HttpResponse(
+        mt.registry.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )